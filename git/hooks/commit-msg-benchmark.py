@@ -0,0 +1,135 @@
+#!/usr/bin/env python2.7
+
+import json
+import os
+import shutil
+import subprocess as sp
+import sys
+import tempfile
+import time
+import unittest
+from optparse import OptionParser
+
+DEBUG = False
+
+SELF_DIR = os.path.dirname(os.path.abspath(__file__))
+BRANCH = "feature/ABC-123-benchmark"
+MESSAGE = "Fixed typo.\n\nAlso fixes DEF-456.\n"
+
+class Tests(unittest.TestCase):
+    def test_benchmark_onCurrentHook_measuresBothModes(self):
+        workDir = tempfile.mkdtemp(prefix="commit-msg-benchmark-")
+        try:
+            repositoryPath = createRepository(os.path.join(workDir, "repo"))
+            result = benchmarkHook(os.path.join(SELF_DIR, "commit-msg"), repositoryPath, invocations=3, batchMessages=10)
+            self.assertEqual(result["invocations"], 3)
+            self.assertEqual(result["message"], "ABC-123: " + MESSAGE)
+            self.assertEqual(result["batchMessages"], 10)
+        finally:
+            shutil.rmtree(workDir)
+
+def runGit(repositoryPath, *args):
+    env = dict(os.environ, GIT_AUTHOR_NAME="benchmark", GIT_AUTHOR_EMAIL="benchmark@localhost",
+               GIT_COMMITTER_NAME="benchmark", GIT_COMMITTER_EMAIL="benchmark@localhost")
+    sp.check_call(("git",) + args, cwd=repositoryPath, env=env, stdout=open(os.devnull, 'w'))
+
+def createRepository(path):
+    os.makedirs(path)
+    runGit(path, "init", "-q")
+    runGit(path, "commit", "-q", "--allow-empty", "-m", "Initial commit")
+    runGit(path, "checkout", "-q", "-b", BRANCH)
+    return path
+
+def exportHook(revision, workDir):
+    """
+    Writes the hook as of the revision of this repository to the work dir.
+    """
+    hookPath = os.path.join(workDir, "commit-msg@" + revision.replace("/", "_"))
+    with open(hookPath, 'w') as hookFile:
+        hookFile.write(sp.check_output(["git", "show", revision + ":./commit-msg"], cwd=SELF_DIR))
+    return hookPath
+
+def percentile(sortedValues, fraction):
+    return sortedValues[min(len(sortedValues) - 1, int(len(sortedValues) * fraction))]
+
+def benchmarkHook(hookPath, repositoryPath, invocations, batchMessages):
+    """
+    Runs the hook the way git does, once per commit, and then in batch mode if the hook supports it.
+    The interpreter is run directly so that the timing doesn't depend on how `python2.7` is resolved.
+    """
+    messagePath = os.path.join(repositoryPath, ".git", "COMMIT_EDITMSG")
+    durations = []
+    for _ in xrange(invocations):
+        with open(messagePath, 'w') as messageFile:
+            messageFile.write(MESSAGE)
+        startTime = time.time()
+        returnCode = sp.call([sys.executable, hookPath, messagePath], cwd=repositoryPath)
+        durations.append(time.time() - startTime)
+        if returnCode != 0:
+            raise Exception("{0} failed with {1}".format(hookPath, returnCode))
+    with open(messagePath) as messageFile:
+        message = messageFile.read()
+
+    durations.sort()
+    result = {
+        'hook': hookPath,
+        'invocations': invocations,
+        'message': message,
+        'meanMs': sum(durations) / len(durations) * 1000,
+        'p50Ms': percentile(durations, 0.5) * 1000,
+        'p95Ms': percentile(durations, 0.95) * 1000,
+    }
+
+    startTime = time.time()
+    batch = sp.Popen([sys.executable, hookPath, "--batch"], cwd=repositoryPath, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    out, _ = batch.communicate("\0".join([MESSAGE] * batchMessages))
+    elapsed = time.time() - startTime
+    if batch.returncode == 0 and out.count("\0") == batchMessages:
+        result['batchMessages'] = batchMessages
+        result['batchPerMessageUs'] = elapsed / batchMessages * 1000000
+    logDebug("{0}: {1}".format(hookPath, result))
+    return result
+
+def logDebug(msg):
+    if DEBUG:
+        for line in msg.split('\n'):
+            sys.stderr.write("[DEBUG] " + line + "\n")
+
+if __name__ == '__main__':
+    opt_parser = OptionParser(usage="%prog [options] [HOOK...]",
+                              description="Measures how long the commit-msg hooks given take per commit in a scratch repository."
+                                          " Default is the commit-msg hook next to this script.")
+    opt_parser.add_option("--baseline", action="append", default=[], metavar="REVISION",
+                          help="Also measure the hook as of the revision of this repository, e.g. HEAD~1.")
+    opt_parser.add_option("--invocations", action="store", type="int", default=200, metavar="N",
+                          help="Number of commits to simulate per hook. Default is 200.")
+    opt_parser.add_option("--batch-messages", action="store", type="int", default=10000, metavar="N",
+                          help="Number of messages rewritten in batch mode by the hooks supporting it. Default is 10000.")
+    opt_parser.add_option("--json", action="store_true", default=False, help="Print the results as JSON.")
+
+    opt_parser.add_option("--test", action="store_true", default=False, help="Run self-testing & diagnostics.")
+    opt_parser.add_option("--debug", action="store_true", default=False, help="Run in debug mode. Additional information will be printed to stderr.")
+
+    opts, args = opt_parser.parse_args()
+    if opts.test:
+        suite = unittest.TestLoader().loadTestsFromTestCase(Tests)
+        unittest.TextTestRunner(verbosity=2).run(suite)
+
+    else:
+        DEBUG = opts.debug
+        workDir = tempfile.mkdtemp(prefix="commit-msg-benchmark-")
+        try:
+            repositoryPath = createRepository(os.path.join(workDir, "repo"))
+            hooks = [exportHook(revision, workDir) for revision in opts.baseline] + (args or [os.path.join(SELF_DIR, "commit-msg")])
+            results = [benchmarkHook(os.path.abspath(hook), repositoryPath, opts.invocations, opts.batch_messages) for hook in hooks]
+        finally:
+            shutil.rmtree(workDir)
+
+        if opts.json:
+            print json.dumps(results, indent=2, sort_keys=True)
+        else:
+            print "{0:<30} {1:>9} {2:>9} {3:>9} {4:>16}".format("hook", "mean, ms", "p50, ms", "p95, ms", "batch, us/msg")
+            for result in results:
+                print "{0:<30} {1:>9.2f} {2:>9.2f} {3:>9.2f} {4:>16}".format(
+                    os.path.basename(result['hook']), result['meanMs'], result['p50Ms'], result['p95Ms'],
+                    "{0:.1f}".format(result['batchPerMessageUs']) if 'batchPerMessageUs' in result else "-")
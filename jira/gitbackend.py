@@ -0,0 +1,684 @@
+#!/usr/bin/env python2.7
+
+import binascii
+import bisect
+import glob
+import mmap
+import os
+import re
+import struct
+import subprocess as sp
+import threading
+import time
+import zlib
+
+DEBUG_FUNC = None
+STATS_FUNC = None  # called with a dict of per-process stats after every git process exits
+
+def loadTests():
+    import unittest
+
+    class Tests(unittest.TestCase):
+        def test_parseSubmodulePaths_onGitmodules_findsAllPaths(self):
+            gitmodules = '\n'.join([
+                '[submodule "a"]',
+                '\tpath = libs/a',
+                '\turl = https://example.com/a.git',
+                '[submodule "sub c"]',
+                '    url = https://example.com/c.git',
+                '    path = "sub c"',
+            ])
+            self.assertEqual(parseSubmodulePaths(gitmodules), ["libs/a", "sub c"])
+
+        def test_readConfigValue_onRemoteSection_findsURL(self):
+            config = '[core]\n\tbare = false\n[remote "origin"]\n\turl = git@example.com:a.git\n\tfetch = +refs/heads/*\n'
+            self.assertEqual(readConfigValue(config, 'remote "origin"', "url"), "git@example.com:a.git")
+            self.assertEqual(readConfigValue(config, 'remote "upstream"', "url"), None)
+
+        def test_applyDelta_onCopyAndInsert_buildsTarget(self):
+            base = "0123456789"
+            # source size 10, target size 7, copy 4 bytes from offset 2, insert 'abc'
+            delta = "\x0a\x07" + "\x91\x02\x04" + "\x03abc"
+            self.assertEqual(applyDelta(base, delta), "2345abc")
+
+        def test_readSubmodules_onAnnotatedTag_readsTheTaggedCommit(self):
+            import shutil
+            import tempfile
+            repoPath = tempfile.mkdtemp()
+            try:
+                env = dict(os.environ, GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@localhost",
+                           GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@localhost")
+                git = lambda *args: sp.check_output(("git",) + args, cwd=repoPath, env=env).strip()
+                git("init", "-q")
+                with open(os.path.join(repoPath, ".gitmodules"), 'w') as gitmodules:
+                    gitmodules.write('[submodule "lib"]\n\tpath = lib\n\turl = https://example.com/lib.git\n')
+                git("add", ".gitmodules")
+                git("update-index", "--add", "--cacheinfo", "160000,{0},lib".format("a" * 40))
+                git("commit", "-q", "-m", "Added lib")
+                git("tag", "-a", "v1", "-m", "Version 1")
+                tag = git("rev-parse", "v1")
+                for name, Backend in sorted(BACKENDS.items()):
+                    backend = Backend()
+                    try:
+                        self.assertEqual(backend.readSubmodules(repoPath, tag), [("lib", "a" * 40)], name)
+                    finally:
+                        backend.close()
+            finally:
+                shutil.rmtree(repoPath)
+
+    return Tests
+
+def logDebug(msg):
+    if DEBUG_FUNC:
+        DEBUG_FUNC(msg)
+
+def parseSubmodulePaths(gitmodules):
+    """
+    Returns the paths of the submodules listed in the contents of .gitmodules.
+    """
+    paths = []
+    inSubmodule = False
+    for line in gitmodules.splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            inSubmodule = line.startswith('[submodule')
+        elif inSubmodule:
+            match = re.match(r'path\s*=\s*(?P<path>.*)$', line)
+            if match:
+                paths.append(match.group('path').strip().strip('"'))
+    return paths
+
+def readConfigValue(config, section, key):
+    """
+    Returns the value of the key in the section of the git config contents, e.g. section 'remote "origin"' and key 'url'.
+    """
+    currentSection = None
+    for line in config.splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            currentSection = line.strip('[]')
+        elif currentSection == section:
+            match = re.match(r'(?P<key>[\w-]+)\s*=\s*(?P<value>.*)$', line)
+            if match and match.group('key').lower() == key:
+                return match.group('value').strip().strip('"')
+    return None
+
+def parseTree(data):
+    """
+    Returns the list of (mode, name, hex SHA) entries of the raw tree object.
+    """
+    entries = []
+    position = 0
+    while position < len(data):
+        nameEnd = data.index('\0', position)
+        mode, name = data[position:nameEnd].split(' ', 1)
+        entries.append((mode, name, binascii.hexlify(data[nameEnd + 1:nameEnd + 21])))
+        position = nameEnd + 21
+    return entries
+
+def parseParents(data):
+    """
+    Returns the parents of the raw commit object.
+    """
+    parents = []
+    for line in data.split('\n'):
+        if not line:
+            break  # the end of the headers
+        if line.startswith('parent '):
+            parents.append(line[7:47])
+    return parents
+
+def applyDelta(base, delta):
+    def readSize(position):
+        size = shift = 0
+        while True:
+            byte = ord(delta[position])
+            position += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return size, position
+
+    _, position = readSize(0)
+    targetSize, position = readSize(position)
+    target = []
+    while position < len(delta):
+        opcode = ord(delta[position])
+        position += 1
+        if opcode & 0x80:  # copy from the base
+            offset = size = 0
+            for i in range(4):
+                if opcode & (1 << i):
+                    offset |= ord(delta[position]) << (8 * i)
+                    position += 1
+            for i in range(3):
+                if opcode & (1 << (4 + i)):
+                    size |= ord(delta[position]) << (8 * i)
+                    position += 1
+            target.append(base[offset:offset + (size or 0x10000)])
+        elif opcode:  # insert the literal bytes
+            target.append(delta[position:position + opcode])
+            position += opcode
+    target = "".join(target)
+    assert len(target) == targetSize, "corrupted delta"
+    return target
+
+class GitBackend:
+    """
+    The git queries jira-find needs. The object-level queries are implemented by subclasses,
+    the submodules are then read from the trees the same way by all of them.
+    """
+    def readObject(self, repoPath, name):
+        """
+        Returns (full SHA, type, data) of the object or None if it doesn't exist.
+        """
+        raise NotImplementedError()
+
+    def readCommit(self, repoPath, name):
+        """
+        Returns (full SHA, type, data) of the commit the object names, peeling tags, or None if it names no commit.
+        """
+        found = self.readObject(repoPath, name)
+        while found and 'tag' == found[1]:
+            found = self.readObject(repoPath, found[2][7:47])  # tags start with 'object <SHA>'
+        return found if found and 'commit' == found[1] else None
+
+    def findCommits(self, repoPath, shas):
+        """
+        Returns a map of each SHA to the full SHA of the commit it names or None if there's no such commit.
+        """
+        raise NotImplementedError()
+
+    def listCommits(self, repoPath, head, excludedHead=None):
+        """
+        Returns the SHAs of the commits reachable from the head but not from the excluded one.
+        """
+        raise NotImplementedError()
+
+    def isAncestor(self, repoPath, ancestor, descendant):
+        raise NotImplementedError()
+
+    def commitMessages(self, repoPath, head, excludedHeads=()):
+        """
+        Returns (SHA, message) pairs of the commits reachable from the head but from none of the excluded heads.
+        """
+        revisions = "".join([head + "\n"] + ["^" + excludedHead + "\n" for excludedHead in excludedHeads])
+        out, _ = runGit(["log", "--stdin", "--format=%H%n%B%x00"], repoPath, revisions)
+        entries = [entry.lstrip("\n").split("\n", 1) for entry in out.split("\0")]
+        return [(entry[0], entry[1] if len(entry) > 1 else "") for entry in entries if entry[0]]
+
+    def gitDir(self, repoPath):
+        dotGit = os.path.join(repoPath, ".git")
+        if os.path.isfile(dotGit):  # submodules and worktrees have a 'gitdir: <path>' file instead
+            with open(dotGit, 'r') as dotGitFile:
+                return os.path.normpath(os.path.join(repoPath, dotGitFile.read().strip()[len("gitdir:"):].strip()))
+        return dotGit
+
+    def commonDir(self, repoPath):
+        gitDir = self.gitDir(repoPath)
+        commonDirFile = os.path.join(gitDir, "commondir")
+        if os.path.isfile(commonDirFile):
+            with open(commonDirFile, 'r') as commonDir:
+                return os.path.normpath(os.path.join(gitDir, commonDir.read().strip()))
+        return gitDir
+
+    def remoteURL(self, repoPath):
+        configPath = os.path.join(self.commonDir(repoPath), "config")
+        if not os.path.isfile(configPath):
+            return ""
+        with open(configPath, 'r') as configFile:
+            return readConfigValue(configFile.read(), 'remote "origin"', "url") or ""
+
+    def readSubmodules(self, repoPath, revision):
+        """
+        Returns (path, revision) pairs of the submodules as they are in the given revision of the repository.
+        """
+        commit = self.readCommit(repoPath, revision)
+        if not commit:
+            return []
+        rootTree = self.readObject(repoPath, commit[2][5:45])  # commits start with 'tree <SHA>'
+        rootEntries = dict((name, sha) for mode, name, sha in parseTree(rootTree[2]))
+        if '.gitmodules' not in rootEntries:
+            return []
+
+        submodules = []
+        for path in parseSubmodulePaths(self.readObject(repoPath, rootEntries['.gitmodules'])[2]):
+            entry = self.findTreeEntry(repoPath, rootTree[2], path)
+            if entry and '160000' == entry[0]:  # gitlink
+                submodules.append((path, entry[2]))
+        return submodules
+
+    def findTreeEntry(self, repoPath, treeData, path):
+        components = path.strip('/').split('/')
+        for i, component in enumerate(components):
+            entries = [entry for entry in parseTree(treeData) if entry[1] == component]
+            if not entries:
+                return None
+            if i == len(components) - 1:
+                return entries[0]
+            subtree = self.readObject(repoPath, entries[0][2])
+            if not subtree or 'tree' != subtree[1]:
+                return None
+            treeData = subtree[2]
+
+    def close(self):
+        pass
+
+def recordStats(command, startTime):
+    if STATS_FUNC:
+        STATS_FUNC({'command': command, 'seconds': time.time() - startTime})
+
+def runGit(args, repoPath, input=None):
+    startTime = time.time()
+    with open(os.devnull, 'w') as devnull:
+        p = sp.Popen(["git"] + args, cwd=repoPath, stdin=sp.PIPE if input is not None else None,
+                     stdout=sp.PIPE, stderr=devnull)
+        out, _ = p.communicate(input)
+    recordStats(args[0], startTime)
+    logDebug("{0} $ git {1} -> {2}".format(repoPath, " ".join(args), p.returncode))
+    return out, p.returncode
+
+class ShellGitBackend(GitBackend):
+    """
+    Runs a separate shell and git process for every query.
+    """
+    def execCommand(self, command, repoPath, raw=False):
+        startTime = time.time()
+        with open(os.devnull, 'w') as devnull:
+            p = sp.Popen(command, shell=True, cwd=repoPath, stdout=sp.PIPE, stderr=devnull)
+            out, _ = p.communicate()
+        recordStats(command.split()[1], startTime)
+        logDebug("{0} $ {1} -> {2}".format(repoPath, command, p.returncode))
+        return out if raw else out.strip(), p.returncode
+
+    def readObject(self, repoPath, name):
+        import pipes
+        sha, returnCode = self.execCommand("git rev-parse --verify {0}".format(pipes.quote(name)), repoPath)
+        if returnCode:
+            return None
+        objectType, _ = self.execCommand("git cat-file -t {0}".format(sha), repoPath)
+        data, _ = self.execCommand("git cat-file {0} {1}".format(objectType, sha), repoPath, raw=True)
+        return sha, objectType, data
+
+    def findCommits(self, repoPath, shas):
+        existence = {}
+        for sha in shas:
+            fullSHA, returnCode = self.execCommand("git rev-parse --verify {0}^{{commit}}".format(sha), repoPath)
+            existence[sha] = fullSHA if not returnCode else None
+        return existence
+
+    def listCommits(self, repoPath, head, excludedHead=None):
+        out, _ = self.execCommand("git rev-list {0}{1}".format(head, " ^" + excludedHead if excludedHead else ""), repoPath)
+        return out.split('\n') if out else []
+
+    def isAncestor(self, repoPath, ancestor, descendant):
+        _, returnCode = self.execCommand("git merge-base --is-ancestor {0} {1}".format(ancestor, descendant), repoPath)
+        return not returnCode  # invert shell's 0 for True
+
+    def gitDir(self, repoPath):
+        gitDir, _ = self.execCommand("git rev-parse --git-dir", repoPath)
+        return os.path.join(repoPath, gitDir)
+
+    def remoteURL(self, repoPath):
+        url, _ = self.execCommand("git config --local --get remote.origin.url", repoPath)
+        return url
+
+    def readSubmodules(self, repoPath, revision):
+        import pipes
+        submodules = []
+        gitmodules, _ = self.execCommand("git config --null --blob {0}:.gitmodules --get-regexp '^submodule\\..*\\.path$'".format(revision), repoPath)
+        for kvPair in gitmodules.split('\0'):
+            if '\n' in kvPair:
+                path = kvPair.split('\n', 1)[1]
+                entry, _ = self.execCommand("git ls-tree {0} -- {1}".format(revision, pipes.quote(path)), repoPath)
+                match = re.match(r'160000 commit (?P<revision>[0-9a-f]{40})\t', entry)
+                if match:
+                    submodules.append((path, match.group('revision')))
+        return submodules
+
+class BatchProcess:
+    """
+    A long-lived `git cat-file --batch` process answering object queries one by one.
+    """
+    def __init__(self, repoPath):
+        self.startTime = time.time()
+        self.devnull = open(os.devnull, 'w')
+        self.process = sp.Popen(["git", "cat-file", "--batch"], cwd=repoPath, stdin=sp.PIPE, stdout=sp.PIPE, stderr=self.devnull)
+        self.lock = threading.Lock()
+        logDebug("{0} $ git cat-file --batch (started)".format(repoPath))
+
+    def query(self, name):
+        with self.lock:
+            self.process.stdin.write(name + "\n")
+            self.process.stdin.flush()
+            header = self.process.stdout.readline().rstrip("\n")
+            if header.endswith(" missing") or header.endswith(" ambiguous"):
+                return None
+            sha, objectType, size = header.rsplit(" ", 2)
+            data = self.process.stdout.read(int(size) + 1)[:-1]  # the contents are followed by a newline
+            return sha, objectType, data
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+        self.devnull.close()
+        recordStats("cat-file --batch", self.startTime)  # the whole lifetime of the process
+
+class ProcessGitBackend(GitBackend):
+    """
+    Keeps one `git cat-file --batch` process per repository for object queries
+    and lists commits with a single `git rev-list --stdin` per query.
+    """
+    def __init__(self):
+        self.processes = {}
+        self.lock = threading.Lock()
+
+    def batchProcess(self, repoPath):
+        repoPath = os.path.abspath(repoPath)
+        with self.lock:
+            if repoPath not in self.processes:
+                self.processes[repoPath] = BatchProcess(repoPath)
+            return self.processes[repoPath]
+
+    def readObject(self, repoPath, name):
+        return self.batchProcess(repoPath).query(name)
+
+    def findCommits(self, repoPath, shas):
+        process = self.batchProcess(repoPath)
+        existence = {}
+        for sha in shas:
+            found = process.query(sha + "^{commit}")
+            existence[sha] = found[0] if found else None
+        return existence
+
+    def listCommits(self, repoPath, head, excludedHead=None):
+        out, _ = runGit(["rev-list", "--stdin"], repoPath, head + "\n" + ("^" + excludedHead + "\n" if excludedHead else ""))
+        return out.split()
+
+    def isAncestor(self, repoPath, ancestor, descendant):
+        _, returnCode = runGit(["merge-base", "--is-ancestor", ancestor, descendant], repoPath)
+        return not returnCode
+
+    def close(self):
+        with self.lock:
+            processes, self.processes = self.processes.values(), {}
+        for process in processes:
+            process.close()
+
+class PackFile:
+    """
+    A pack and its version 2 index, both memory-mapped.
+    """
+    TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+
+    def __init__(self, indexPath):
+        with open(indexPath, 'rb') as indexFile:
+            self.index = mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+        if '\377tOc' != self.index[:4] or 2 != struct.unpack('>I', self.index[4:8])[0]:
+            raise ValueError("unsupported pack index " + indexPath)
+        self.fanout = struct.unpack('>256I', self.index[8:8 + 1024])
+        self.count = self.fanout[255]
+        self.shasOffset = 8 + 1024
+        self.offsetsOffset = self.shasOffset + self.count * 24  # SHAs and CRCs
+        self.largeOffsetsOffset = self.offsetsOffset + self.count * 4
+
+        with open(indexPath[:-len(".idx")] + ".pack", 'rb') as packFile:
+            self.pack = mmap.mmap(packFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return self.index[self.shasOffset + i * 20:self.shasOffset + (i + 1) * 20]
+
+    def findPosition(self, binPrefix):
+        """
+        Returns the position of the first SHA which is not less than the binary prefix.
+        """
+        firstByte = ord(binPrefix[0])
+        low = self.fanout[firstByte - 1] if firstByte else 0
+        return bisect.bisect_left(self, binPrefix, low, self.fanout[firstByte])
+
+    def findOffset(self, binSHA):
+        i = self.findPosition(binSHA)
+        if i >= self.count or self[i] != binSHA:
+            return None
+        offset = struct.unpack('>I', self.index[self.offsetsOffset + i * 4:self.offsetsOffset + i * 4 + 4])[0]
+        if offset & 0x80000000:
+            largeOffset = self.largeOffsetsOffset + (offset & 0x7fffffff) * 8
+            offset = struct.unpack('>Q', self.index[largeOffset:largeOffset + 8])[0]
+        return offset
+
+    def expand(self, hexPrefix):
+        """
+        Returns the hex SHAs starting with the given hex prefix.
+        """
+        binPrefix = binascii.unhexlify(hexPrefix[:len(hexPrefix) & ~1])
+        found = []
+        i = self.findPosition(binPrefix) if binPrefix else 0
+        while i < self.count:
+            sha = binascii.hexlify(self[i])
+            if not sha.startswith(hexPrefix[:len(binPrefix) * 2]):
+                break
+            if sha.startswith(hexPrefix):
+                found.append(sha)
+            i += 1
+        return found
+
+    def inflate(self, position, size):
+        decompressor = zlib.decompressobj()
+        data = ""
+        chunkSize = size + 64
+        while len(data) < size:
+            chunk = self.pack[position:position + chunkSize]
+            if not chunk:
+                break
+            data += decompressor.decompress(chunk)
+            position += chunkSize
+        return data[:size]
+
+    def readAt(self, offset, objectStore):
+        """
+        Returns (type, data) of the object at the offset, resolving deltas.
+        """
+        byte = ord(self.pack[offset])
+        objectType = (byte >> 4) & 7
+        size = byte & 15
+        shift = 4
+        position = offset + 1
+        while byte & 0x80:
+            byte = ord(self.pack[position])
+            position += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+
+        if objectType in self.TYPES:
+            return self.TYPES[objectType], self.inflate(position, size)
+
+        if 6 == objectType:  # OFS_DELTA
+            byte = ord(self.pack[position])
+            position += 1
+            baseDistance = byte & 0x7f
+            while byte & 0x80:
+                byte = ord(self.pack[position])
+                position += 1
+                baseDistance = ((baseDistance + 1) << 7) | (byte & 0x7f)
+            baseType, baseData = self.readAt(offset - baseDistance, objectStore)
+        elif 7 == objectType:  # REF_DELTA
+            base = objectStore.read(binascii.hexlify(self.pack[position:position + 20]))
+            position += 20
+            baseType, baseData = base[1], base[2]
+        else:
+            raise ValueError("unknown pack object type {0}".format(objectType))
+        return baseType, applyDelta(baseData, self.inflate(position, size))
+
+class ObjectStore:
+    """
+    Reads loose and packed objects of a repository directly from its object directories.
+    """
+    def __init__(self, objectsDir):
+        self.objectDirs = [objectsDir]
+        alternatesPath = os.path.join(objectsDir, "info", "alternates")
+        if os.path.isfile(alternatesPath):
+            with open(alternatesPath, 'r') as alternates:
+                self.objectDirs.extend(os.path.join(objectsDir, line.strip()) for line in alternates if line.strip())
+        self.packs = []
+        for objectDir in self.objectDirs:
+            self.packs.extend(PackFile(indexPath) for indexPath in glob.glob(os.path.join(objectDir, "pack", "*.idx")))
+
+    def expand(self, hexPrefix):
+        found = set()
+        for objectDir in self.objectDirs:
+            looseDir = os.path.join(objectDir, hexPrefix[:2])
+            if len(hexPrefix) >= 2 and os.path.isdir(looseDir):
+                found.update(hexPrefix[:2] + name for name in os.listdir(looseDir) if (hexPrefix[:2] + name).startswith(hexPrefix))
+        for pack in self.packs:
+            found.update(pack.expand(hexPrefix))
+        return list(found)
+
+    def read(self, sha):
+        """
+        Returns (SHA, type, data) of the object or None if it doesn't exist.
+        """
+        for objectDir in self.objectDirs:
+            loosePath = os.path.join(objectDir, sha[:2], sha[2:])
+            if os.path.isfile(loosePath):
+                with open(loosePath, 'rb') as looseFile:
+                    raw = zlib.decompress(looseFile.read())
+                header, data = raw.split('\0', 1)
+                return sha, header.split(' ', 1)[0], data
+
+        binSHA = binascii.unhexlify(sha)
+        for pack in self.packs:
+            offset = pack.findOffset(binSHA)
+            if offset is not None:
+                objectType, data = pack.readAt(offset, self)
+                return sha, objectType, data
+        return None
+
+class NativeGitBackend(GitBackend):
+    """
+    Reads loose objects and packs in-process, without running git at all.
+    Refs aren't resolved, so all the queries have to be made with SHAs.
+    """
+    def __init__(self):
+        self.stores = {}
+        self.lock = threading.Lock()
+
+    def objectStore(self, repoPath):
+        repoPath = os.path.abspath(repoPath)
+        with self.lock:
+            if repoPath not in self.stores:
+                self.stores[repoPath] = ObjectStore(os.path.join(self.commonDir(repoPath), "objects"))
+            return self.stores[repoPath]
+
+    def readObject(self, repoPath, name):
+        store = self.objectStore(repoPath)
+        if not re.match(r'^[0-9a-f]{4,40}$', name):
+            return None
+        if len(name) < 40:
+            candidates = store.expand(name)
+            if 1 != len(candidates):
+                return None
+            name = candidates[0]
+        return store.read(name)
+
+    def findCommits(self, repoPath, shas):
+        existence = {}
+        for sha in shas:
+            found = self.readCommit(repoPath, sha)
+            existence[sha] = found[0] if found else None
+        return existence
+
+    def walk(self, repoPath, head, excluded=frozenset()):
+        store = self.objectStore(repoPath)
+        seen = set()
+        pending = [head]
+        while pending:
+            sha = pending.pop()
+            if sha in seen or sha in excluded:
+                continue
+            seen.add(sha)
+            commit = store.read(sha)
+            if commit:  # parents may be missing in shallow clones
+                pending.extend(parseParents(commit[2]))
+        return seen
+
+    def listCommits(self, repoPath, head, excludedHead=None):
+        head = self.readCommit(repoPath, head)
+        if not head:
+            return []
+        excluded = self.walk(repoPath, excludedHead) if excludedHead else frozenset()
+        return list(self.walk(repoPath, head[0], excluded))
+
+    def isAncestor(self, repoPath, ancestor, descendant):
+        ancestor, descendant = self.readCommit(repoPath, ancestor), self.readCommit(repoPath, descendant)
+        return bool(ancestor and descendant) and ancestor[0] in self.walk(repoPath, descendant[0])
+
+    def commitMessages(self, repoPath, head, excludedHeads=()):
+        head = self.readCommit(repoPath, head)
+        if not head:
+            return []
+        excluded = set()
+        for excludedHead in excludedHeads:
+            excluded.update(self.walk(repoPath, excludedHead))
+        store = self.objectStore(repoPath)
+        commits = (store.read(sha) for sha in self.walk(repoPath, head[0], excluded))
+        return [(commit[0], commit[2].split("\n\n", 1)[-1]) for commit in commits if commit]  # the message follows the headers
+
+BACKENDS = {
+    'shell': ShellGitBackend,
+    'process': ProcessGitBackend,
+    'native': NativeGitBackend,
+}
+
+def benchmark(repoPath, queriesCount):
+    """
+    Measures the latency of the queries jira-find makes for every backend.
+    """
+    head, _ = runGit(["rev-parse", "HEAD"], repoPath)
+    commits = ProcessGitBackend().listCommits(repoPath, head.strip())[:queriesCount]
+    missing = [binascii.hexlify(os.urandom(20)) for _ in commits]
+
+    print "{0:<10} {1:>16} {2:>16} {3:>16} {4:>14}".format("backend", "findCommits/rev", "isAncestor/rev",
+                                                           "readSubmodules", "listCommits")
+    for name in ['shell', 'process', 'native']:
+        backend = BACKENDS[name]()
+        timings = []
+
+        startTime = time.time()
+        backend.findCommits(repoPath, commits + missing)
+        timings.append((time.time() - startTime) / len(commits + missing))
+
+        startTime = time.time()
+        for commit in commits[:20]:
+            backend.isAncestor(repoPath, commit, commits[0])
+        timings.append((time.time() - startTime) / len(commits[:20]))
+
+        startTime = time.time()
+        backend.readSubmodules(repoPath, commits[0])
+        timings.append(time.time() - startTime)
+
+        startTime = time.time()
+        listed = backend.listCommits(repoPath, commits[0])
+        timings.append(time.time() - startTime)
+
+        backend.close()
+        print "{0:<10} {1:>14.3f}ms {2:>14.3f}ms {3:>14.3f}ms {4:>12.3f}ms ({5} commits)".format(
+            name, *([timing * 1000 for timing in timings] + [len(listed)]))
+
+if __name__ == '__main__':
+    import runtime
+    from optparse import OptionParser
+    opt_parser = OptionParser(usage="%prog [options] [GIT_REPO_PATH]",
+                              description="Git access backends of jira-find. Benchmarks them against the given repository.")
+    opt_parser.add_option("--queries", action="store", type="int", default=200, metavar="N",
+                          help="Number of commits to query. Default is 200.")
+    opt_parser.add_option("--test", action="store_true", default=False, help="Run self-testing & diagnostics.")
+
+    opts, args = opt_parser.parse_args()
+    if opts.test:
+        runtime.runTests(loadTests)
+
+    else:
+        benchmark(args[0] if args else '.', opts.queries)
@@ -0,0 +1,547 @@
+#!/usr/bin/env python2.7
+
+import BaseHTTPServer
+import SocketServer
+import collections
+import json
+import multiprocessing
+import os
+import random
+import resource
+import runtime
+import shutil
+import socket
+import subprocess as sp
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urlparse
+import zlib
+from optparse import OptionParser
+import jira
+from runtime import logDebug
+jirafind = __import__("jira-find")
+jirarecordbuild = __import__("jira-record-build")
+
+DEVTOOLS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "devtools")
+STARTUP_COMMANDS = ["find", "record", "pretty"]
+# imported by none of the commands unless their options need them
+STARTUP_DEFERRED_MODULES = ["unittest", "BaseHTTPServer", "SocketServer", "multiprocessing", "email"]
+
+# name: (submodules, commits per module, issues)
+SCALES = collections.OrderedDict([
+    ("small", (2, 200, 100)),
+    ("medium", (5, 2000, 1000)),
+    ("large", (10, 10000, 5000)),
+])
+
+class Tests(unittest.TestCase):
+    def test_runScenario_onSmallSuperproject_findsExactlyTheReachableIssues(self):
+        workDir = tempfile.mkdtemp()
+        try:
+            result = runScenario(workDir, "tiny", 2, 30, 20, latency=0, pageSize=8, jobs=2)
+            self.assertEqual(result["reachableKeys"], result["expectedReachableKeys"])
+            self.assertEqual(result["record"]["added"], len(result["expectedReachableKeys"]))
+            self.assertEqual(result["requests"]["search"], 3)  # 20 issues in pages of 8
+        finally:
+            shutil.rmtree(workDir)
+
+    def test_runScenario_onRateLimitedJIRA_retriesTheRejectedRequests(self):
+        workDir = tempfile.mkdtemp()
+        try:
+            result = runScenario(workDir, "tiny", 2, 30, 20, latency=0, pageSize=8, jobs=4, rateLimit=20)
+            self.assertEqual(result["reachableKeys"], result["expectedReachableKeys"])
+            self.assertEqual(result["record"]["failed"], 0)
+            rateLimited = result["requests"].get("rate limited", 0) + result["recordRequests"].get("rate limited", 0)
+            self.assertGreater(rateLimited, 0)
+            self.assertEqual(result["scheduler"]["retries"], rateLimited)
+        finally:
+            shutil.rmtree(workDir)
+
+    def test_addComment_onTimeoutOnReusedConnection_postsOnce(self):
+        fake = FakeJIRA([{"id": "1", "key": "KEY-1", "fields": {"comment": {"comments": []}}}], {})
+        client = jira.JIRA(fake.endpoint, timeout=0.2)
+        try:
+            client.getComments("KEY-1")
+            fake.latency = 0.4  # the comment is added only after the client has given up waiting
+            self.assertRaises(socket.timeout, client.addComment, "KEY-1", "build-1")
+            time.sleep(0.4)
+            self.assertEqual(fake.requests["comment POST"], 1)
+        finally:
+            client.close()
+            fake.close()
+
+    def test_measureStartup_onEachCommand_defersModulesNotNeeded(self):
+        for command in STARTUP_COMMANDS:
+            result = measureStartup(command, runs=1)
+            self.assertEqual([module for module in STARTUP_DEFERRED_MODULES if module in result["modules"]], [])
+        prettyModules = measureStartup("pretty", runs=1)["modules"]
+        self.assertEqual([module for module in ["jira-find", "jira", "httplib"] if module in prettyModules], [])
+
+    def test_measureRevisionModel_onFewRevisions_classifiesEveryIssue(self):
+        result = measureRevisionModel(1000)
+        self.assertEqual(result["revisions"], 1000)
+        self.assertEqual(result["reachables"] + result["unreachables"], result["issues"])
+        self.assertGreater(result["unreachables"], result["orphants"])
+
+class FakeJIRA:
+    """
+    A local stand-in for the JIRA REST API serving just what jira-find and jira-record-build use.
+    Every request is delayed by the given latency. The search pages are capped at maxPageSize issues.
+    With rateLimit, the requests over that many per second are answered with 429 and a Retry-After, as JIRA does.
+    """
+    def __init__(self, issues, repositoryCommits, latency=0, maxPageSize=100, commentsPageSize=50, rateLimit=None):
+        self.issues = issues
+        self.repositoryCommits = repositoryCommits
+        self.comments = dict((issue['key'], list(issue['fields']['comment']['comments'])) for issue in issues)
+        self.latency = latency
+        self.maxPageSize = maxPageSize
+        self.commentsPageSize = commentsPageSize
+        self.rateLimit = rateLimit
+        self.tokens = rateLimit
+        self.refillTime = time.time()
+        self.requests = collections.Counter()
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def setup(self):
+                BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # headers and body are separate writes
+
+            def do_GET(self):
+                self.respond(fake.handle("GET", self.path, None))
+
+            def do_POST(self):
+                self.respond(fake.handle("POST", self.path, self.readBody()))
+
+            def do_PUT(self):
+                self.respond(fake.handle("PUT", self.path, self.readBody()))
+
+            def readBody(self):
+                return json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+
+            def respond(self, response):
+                status, body = response[:2]
+                data = json.dumps(body)
+                self.send_response(status)
+                for name, value in response[2:]:
+                    self.send_header(name, value)
+                if "gzip" in self.headers.getheader("Accept-Encoding", ""):
+                    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                    data = compressor.compress(data) + compressor.flush()
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.endpoint = "http://127.0.0.1:{0}".format(self.server.server_port)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def handle(self, method, path, body):
+        time.sleep(self.latency)
+        if self.isRateLimited():
+            return self.count("rate limited", (429, {"errorMessages": ["Rate limit exceeded"]},
+                                               ("Retry-After", "{0:.3f}".format(1.0 / self.rateLimit))))
+        url = urlparse.urlparse(path)
+        query = dict(urlparse.parse_qsl(url.query))
+        parts = url.path.strip('/').split('/')
+
+        if "/rest/api/2/search" == url.path:
+            return self.count("search", self.search(query))
+        if "/rest/api/2/field" == url.path:
+            return self.count("field", (200, [{"id": "comment", "name": "Comment"}, {"id": "summary", "name": "Summary"}]))
+        if url.path.startswith("/rest/dev-status/1.0/issue/detail"):
+            commits = self.repositoryCommits.get(query.get("issueId"), [])
+            return self.count("dev-status", (200, {"detail": [{"repositories": [{"commits": commits}]}]}))
+        if len(parts) >= 6 and "comment" == parts[5]:
+            return self.count("comment " + method, self.comment(method, parts[4], parts[6] if len(parts) > 6 else None, query, body))
+        return self.count("unknown", (404, {"errorMessages": ["Not found: " + path]}))
+
+    def isRateLimited(self):
+        if not self.rateLimit:
+            return False
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rateLimit, self.tokens + (now - self.refillTime) * self.rateLimit)
+            self.refillTime = now
+            if self.tokens < 1:
+                return True
+            self.tokens -= 1
+            return False
+
+    def count(self, name, response):
+        with self.lock:
+            self.requests[name] += 1
+        return response
+
+    def search(self, query):
+        startAt = int(query.get("startAt", 0))
+        maxResults = min(int(query.get("maxResults", 50)), self.maxPageSize)
+        fields = query.get("fields", "").split(",")
+        issues = [{"id": issue["id"], "key": issue["key"],
+                   "fields": dict((name, value) for name, value in issue["fields"].iteritems() if name in fields)}
+                  for issue in self.issues[startAt:startAt + maxResults]]
+        return 200, {"startAt": startAt, "maxResults": maxResults, "total": len(self.issues), "issues": issues}
+
+    def comment(self, method, issueKey, commentId, query, body):
+        with self.lock:
+            comments = self.comments.setdefault(issueKey, [])
+            if "GET" == method:
+                startAt = int(query.get("startAt", 0))
+                maxResults = min(int(query.get("maxResults", self.commentsPageSize)), self.commentsPageSize)
+                return 200, {"startAt": startAt, "maxResults": maxResults, "total": len(comments),
+                             "comments": comments[startAt:startAt + maxResults]}
+            if "POST" == method:
+                comments.append({"id": str(len(comments) + 1), "body": body["body"]})
+                return 201, comments[-1]
+            for comment in comments:
+                if comment["id"] == commentId:
+                    comment["body"] = body["body"]
+                    return 200, comment
+            return 404, {"errorMessages": ["No comment " + commentId]}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def createRepository(path, commitsCount, submodules=()):
+    """
+    Creates a repository with a linear history using git fast-import. The last commit links the given
+    (path, URL, revision) submodules. Returns the SHAs of the commits, oldest first.
+    """
+    sp.check_call(["git", "init", "-q", path])
+    sp.check_call(["git", "symbolic-ref", "HEAD", "refs/heads/master"], cwd=path)
+
+    def data(text):
+        return "data {0}\n{1}\n".format(len(text), text)
+
+    stream = []
+    for i in xrange(commitsCount):
+        stream.append("commit refs/heads/master\nmark :{0}\n".format(i + 1))
+        stream.append("committer Benchmark <benchmark@example.com> {0} +0000\n".format(1500000000 + i * 60))
+        stream.append(data("Change {0} of {1}".format(i, os.path.basename(path))))  # unique SHAs per repository
+        if i:
+            stream.append("from :{0}\n".format(i))
+        stream.append("M 100644 inline file.txt\n" + data("line {0}\n".format(i)))
+        if i == commitsCount - 1 and submodules:
+            gitmodules = "".join('[submodule "{0}"]\n\tpath = {0}\n\turl = {1}\n'.format(subPath, url) for subPath, url, _ in submodules)
+            stream.append("M 100644 inline .gitmodules\n" + data(gitmodules))
+            for subPath, _, revision in submodules:
+                stream.append("M 160000 {0} {1}\n".format(revision, subPath))
+
+    marksPath = os.path.join(path, ".git", "benchmark-marks")
+    p = sp.Popen(["git", "fast-import", "--quiet", "--export-marks=" + marksPath], cwd=path, stdin=sp.PIPE)
+    p.communicate("".join(stream))
+    with open(marksPath, 'r') as marks:
+        shas = dict((int(mark[1:]), sha) for mark, sha in (line.split() for line in marks))
+    return [shas[i + 1] for i in xrange(commitsCount)]
+
+def createSuperproject(path, submodulesCount, commitsCount, issuesCount, seed=0):
+    """
+    Creates a superproject with submodules and issues referring to its commits. A tenth of the history of each
+    module lies beyond the revision linked in the superproject, so the issues referring to it are unreachable.
+    Some issues refer to nonexistent commits. Returns the issues, their dev-status commits and the reachable keys.
+    """
+    rand = random.Random(seed)
+    modules = []
+    submodules = []
+    for i in xrange(submodulesCount):
+        subPath = "modules/m{0}".format(i)
+        url = "https://git.example.com/m{0}.git".format(i)
+        commits = createRepository(os.path.join(path, subPath), commitsCount)
+        linkedIndex = commitsCount * 9 / 10
+        submodules.append((subPath, url, commits[linkedIndex]))
+        modules.append((commits, linkedIndex))
+    rootCommits = createRepository(path, commitsCount, submodules)
+    modules.append((rootCommits, len(rootCommits) - 1))
+
+    issues = []
+    repositoryCommits = {}
+    reachableKeys = set()
+    for i in xrange(issuesCount):
+        key = "BENCH-{0}".format(i + 1)
+        commits, linkedIndex = rand.choice(modules)
+        if rand.random() < 0.05:
+            revision = "%040x" % rand.getrandbits(160)  # nonexistent
+        else:
+            index = rand.randrange(len(commits))
+            revision = commits[index]
+            if index <= linkedIndex:
+                reachableKeys.add(key)
+        comments = [{"id": str(n + 1), "body": "Some discussion " * 20} for n in xrange(rand.randrange(4))]
+        comments.append({"id": str(len(comments) + 1), "body": "Fixed in " + revision})
+        issues.append({"id": str(10000 + i), "key": key, "fields": {
+            "summary": "Issue {0}".format(i), "resolution": {"name": "Fixed"},
+            "comment": {"startAt": 0, "maxResults": len(comments), "total": len(comments), "comments": comments},
+        }})
+        repositoryCommits[str(10000 + i)] = [{"id": revision, "merge": False, "authorTimestamp": 1500000000000 + i}]
+    return issues, repositoryCommits, reachableKeys
+
+_Popen = sp.Popen
+
+class CountingPopen(_Popen):
+    count = 0
+    seconds = 0.0
+
+    def __init__(self, *args, **kwargs):
+        CountingPopen.count += 1
+        self.startTime = time.time()
+        _Popen.__init__(self, *args, **kwargs)
+
+    def wait(self):
+        returnCode = _Popen.wait(self)
+        CountingPopen.seconds += time.time() - self.startTime
+        return returnCode
+
+def runScenario(workDir, name, submodulesCount, commitsCount, issuesCount, latency, pageSize, jobs, gitBackend="process",
+                rateLimit=None, maxRate=None):
+    """
+    Measures jira-find and jira-record-build against a fake JIRA and a synthetic superproject.
+    The superproject is created in the work dir once and reused by later runs.
+    """
+    repoPath = os.path.join(workDir, "{0}-{1}x{2}-{3}".format(name, submodulesCount, commitsCount, issuesCount))
+    issuesPath = repoPath + ".json"
+    if not os.path.isfile(issuesPath):
+        if os.path.isdir(repoPath):
+            shutil.rmtree(repoPath)
+        startTime = time.time()
+        issues, repositoryCommits, reachableKeys = createSuperproject(repoPath, submodulesCount, commitsCount, issuesCount)
+        with open(issuesPath, 'w') as issuesFile:
+            json.dump([issues, repositoryCommits, sorted(reachableKeys)], issuesFile)
+        logDebug("Created {0} in {1:.1f}s".format(repoPath, time.time() - startTime))
+    with open(issuesPath, 'r') as issuesFile:
+        issues, repositoryCommits, reachableKeys = json.load(issuesFile)
+
+    fake = FakeJIRA(issues, repositoryCommits, latency, rateLimit=rateLimit)
+    client = jira.JIRA(fake.endpoint, maxIdleConnections=max(4, jobs), maxConcurrentRequests=jobs, maxRequestsPerSecond=maxRate)
+    jirafind.GIT_BACKEND = jirafind.gitbackend.BACKENDS[gitBackend]()
+    sp.Popen = CountingPopen
+    try:
+        startTime = time.time()
+        revisions = jirafind.calculateIssuesReachability(client, "project = BENCH", ["comment"], repoPath, "HEAD",
+                                                         jobs, pageSize, useCache=False)
+        findTime = time.time() - startTime
+        reachables = jirafind.filterReachables(revisions)
+        findRequests = dict(fake.requests)
+        findSubprocesses, findSubprocessSeconds = CountingPopen.count, CountingPopen.seconds
+
+        startTime = time.time()
+        recordSummary = jirarecordbuild.recordBuildInTickets(client, sorted(reachables), "build-1", jobs)
+        recordTime = time.time() - startTime
+    finally:
+        sp.Popen = _Popen
+        jirafind.GIT_BACKEND.close()
+        client.close()
+        fake.close()
+
+    return {
+        "scale": name, "submodules": submodulesCount, "commits": commitsCount, "issues": issuesCount,
+        "findSeconds": findTime, "recordSeconds": recordTime,
+        "requests": findRequests,
+        "recordRequests": dict((endpoint, count - findRequests.get(endpoint, 0)) for endpoint, count in fake.requests.iteritems()),
+        "subprocesses": findSubprocesses, "subprocessSeconds": findSubprocessSeconds,
+        "scheduler": client.schedulerStats(),
+        "peakRSSKB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "record": recordSummary,
+        "reachableKeys": sorted(reachables), "expectedReachableKeys": sorted(reachableKeys),
+    }
+
+def runScenarioInChild(queue, *args):
+    try:
+        queue.put(runScenario(*args))
+    except Exception as e:
+        queue.put({"error": repr(e)})
+
+def measureStartup(command, runs):
+    """
+    Runs `devtools jira COMMAND --help` as a new process the given number of times. Reports the median time of a run
+    and the time spent importing modules, as traced in one more run.
+    """
+    args = [sys.executable, DEVTOOLS_PATH, "jira", command, "--help"]
+    durations = []
+    for _ in xrange(runs):
+        startTime = time.time()
+        sp.check_call(args, stdout=open(os.devnull, 'w'))
+        durations.append(time.time() - startTime)
+    durations.sort()
+
+    tracer = sp.Popen(args, stdout=open(os.devnull, 'w'), stderr=sp.PIPE, env=dict(os.environ, DEVTOOLS_IMPORTTIME="1"))
+    _, trace = tracer.communicate()
+    modules = {}
+    importMicroseconds = 0
+    for line in trace.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+        if not name.startswith("  "):  # imported by the command itself, nested ones are included in the cumulative time
+            importMicroseconds += int(cumulative)
+    logDebug("{0}:\n{1}".format(command, trace))
+    return {"command": command, "runMs": durations[len(durations) / 2] * 1000, "importMs": importMicroseconds / 1000.0,
+            "modules": sorted(modules)}
+
+def iterateSyntheticRevisions(revisionsCount, seed=0):
+    """
+    Yields (issue key, revisions) pairs of 1 to 3 random full SHAs each, revisionsCount SHAs in total.
+    """
+    random.seed(seed)
+    issueIndex = 0
+    while revisionsCount > 0:
+        count = min(revisionsCount, random.randint(1, 3))
+        revisionsCount -= count
+        issueIndex += 1
+        yield "BENCH-{0}".format(issueIndex), ["{0:040x}".format(random.getrandbits(160)) for _ in xrange(count)]
+
+def measureRevisionModel(revisionsCount, modulesCount=10):
+    """
+    Builds the revision table of jira-find from synthetic revisions, marks them as verified and reachable at random
+    the way verifyRevisions and verifyReachability would, then filters it in every mode.
+    Reports the peak memory taken over the one of the process before building.
+    """
+    rssBeforeKB = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    startTime = time.time()
+    modules = [jirafind.GitModule("url{0}".format(i), "path{0}".format(i), "0" * 40) for i in xrange(modulesCount)]
+    revisions = jirafind.RevisionTable(iterateSyntheticRevisions(revisionsCount))
+    for row in xrange(revisions.rowsCount()):
+        if random.random() < 0.9:
+            revisions.setModule(row, modules[row % modulesCount])
+            revisions.setReachable(row, random.random() < 0.3)
+    buildTime = time.time() - startTime
+
+    startTime = time.time()
+    counts = [len(jirafind.filterIssues(revisions, orphants, unreachable))
+              for orphants, unreachable in [(False, False), (False, True), (True, False)]]
+    filterTime = time.time() - startTime
+    return {"revisions": revisions.rowsCount(), "issues": len(revisions), "buildSeconds": buildTime,
+            "filterSeconds": filterTime, "reachables": counts[0], "unreachables": counts[1], "orphants": counts[2], "peakRSSKB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rssBeforeKB}
+
+def runInChild(func, *args):
+    """
+    Runs the function in a new process so that its peak memory is measured alone.
+    """
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=lambda: queue.put(func(*args)))
+    child.start()
+    result = queue.get()
+    child.join()
+    return result
+
+if __name__ == '__main__':
+    opt_parser = OptionParser(usage="%prog [options]",
+                              description="Benchmarks jira-find and jira-record-build against a local fake JIRA"
+                                          " and synthetic git superprojects. Each scale runs in a separate process"
+                                          " so that its peak memory is measured alone.")
+    opt_parser.add_option("--scale", action="append", default=[], metavar="NAME|SUBMODULES:COMMITS:ISSUES",
+                          help="A scale to run: {0} or a custom one. Default is small and medium.".format(", ".join(SCALES)))
+    opt_parser.add_option("--latency", action="store", type="float", default=20, metavar="MS",
+                          help="Latency of each fake JIRA response in milliseconds. Default is 20.")
+    opt_parser.add_option("--page-size", action="store", type="int", default=128, metavar="N",
+                          help="Number of issues requested per search page. The fake JIRA caps pages at 100.")
+    opt_parser.add_option("--jobs", action="store", type="int", default=1, metavar="N",
+                          help="Maximum number of JIRA requests in flight at once. Default is 1.")
+    opt_parser.add_option("--git-backend", action="store", type="choice", choices=sorted(jirafind.gitbackend.BACKENDS),
+                          default="process", help="Git backend of jira-find. Default is 'process'.")
+    opt_parser.add_option("--rate-limit", action="store", type="float", default=None, metavar="N",
+                          help="Make the fake JIRA answer the requests over N per second with 429. Default is no limit.")
+    opt_parser.add_option("--max-rate", action="store", type="float", default=None, metavar="N",
+                          help="Maximum number of JIRA requests per second sent by jira-find and jira-record-build.")
+    opt_parser.add_option("--workdir", action="store", default=None, metavar="DIR",
+                          help="Where the synthetic superprojects are created and reused. Default is a temporary directory.")
+    opt_parser.add_option("--json", action="store_true", default=False, help="Print the results as JSON.")
+
+    opt_parser.add_option("--startup", action="store_true", default=False,
+                          help="Instead of the scales, measure the startup of each devtools jira command"
+                          " and exit with 1 if importing the modules of any takes longer than --import-budget.")
+    opt_parser.add_option("--startup-runs", action="store", type="int", default=20, metavar="N",
+                          help="Number of times each command is started. Default is 20.")
+    opt_parser.add_option("--import-budget", action="store", type="float", default=40, metavar="MS",
+                          help="Time importing the modules of a command may take at most. Default is 40.")
+
+    opt_parser.add_option("--model", action="store", type="int", default=None, metavar="REVISIONS",
+                          help="Instead of the scales, measure the memory and time the revision table of jira-find takes"
+                          " for the given number of revisions, e.g. 1000000.")
+
+    opt_parser.add_option("--test", action="store_true", default=False, help="Run self-testing & diagnostics.")
+    opt_parser.add_option("--debug", action="store_true", default=False, help="Run in debug mode. Additional information will be printed to stderr.")
+
+    opts, args = opt_parser.parse_args()
+    if opts.test:
+        suite = unittest.TestLoader().loadTestsFromTestCase(Tests)
+        unittest.TextTestRunner(verbosity=2).run(suite)
+
+    elif opts.startup:
+        runtime.DEBUG = opts.debug
+        results = [measureStartup(command, opts.startup_runs) for command in STARTUP_COMMANDS]
+        if opts.json:
+            print json.dumps(results, indent=2, sort_keys=True)
+        else:
+            print "{0:<8} {1:>8} {2:>10} {3:>8}".format("command", "run, ms", "import, ms", "modules")
+            for result in results:
+                print "{0:<8} {1:>8.1f} {2:>10.1f} {3:>8}".format(
+                    result["command"], result["runMs"], result["importMs"], len(result["modules"]))
+        overBudget = [result["command"] for result in results if result["importMs"] > opts.import_budget]
+        if overBudget:
+            sys.stderr.write("Importing takes over {0}ms in: {1}\n".format(opts.import_budget, ", ".join(overBudget)))
+            sys.exit(1)
+
+    elif opts.model:
+        result = runInChild(measureRevisionModel, opts.model)
+        if opts.json:
+            print json.dumps(result, indent=2, sort_keys=True)
+        else:
+            print "{0:>10} {1:>10} {2:>9} {3:>10} {4:>10}".format("revisions", "issues", "build, s", "filter, s", "peak RSS")
+            print "{0:>10} {1:>10} {2:>9.2f} {3:>10.2f} {4:>8}MB".format(
+                result["revisions"], result["issues"], result["buildSeconds"], result["filterSeconds"],
+                result["peakRSSKB"] / 1024)
+
+    else:
+        runtime.DEBUG = opts.debug
+        workDir = opts.workdir or tempfile.mkdtemp(prefix="jira-benchmark-")
+
+        results = []
+        for scale in opts.scale or ["small", "medium"]:
+            name, params = (scale, SCALES[scale]) if scale in SCALES else ("custom", [int(n) for n in scale.split(":")])
+            queue = multiprocessing.Queue()
+            child = multiprocessing.Process(target=runScenarioInChild, args=(
+                queue, workDir, name) + tuple(params) + (opts.latency / 1000.0, opts.page_size, opts.jobs, opts.git_backend,
+                                                    opts.rate_limit, opts.max_rate))
+            child.start()
+            result = queue.get()
+            child.join()
+            if "error" in result:
+                sys.stderr.write("Scale {0} failed: {1}\n".format(scale, result["error"]))
+                sys.exit(1)
+            if result["reachableKeys"] != result["expectedReachableKeys"]:
+                sys.stderr.write("Scale {0} found wrong reachable issues\n".format(scale))
+            del result["reachableKeys"], result["expectedReachableKeys"]
+            results.append(result)
+
+        if opts.json:
+            print json.dumps(results, indent=2, sort_keys=True)
+        else:
+            print "{0:<8} {1:>18} {2:>9} {3:>9} {4:>9} {5:>9} {6:>12} {7:>10}".format(
+                "scale", "modules/commits/issues", "find, s", "requests", "git procs", "record, s", "throttled, s", "peak RSS")
+            for result in results:
+                print "{0:<8} {1:>18} {2:>9.2f} {3:>9} {4:>9} {5:>9.2f} {6:>12.2f} {7:>8}MB".format(
+                    result["scale"], "{submodules}/{commits}/{issues}".format(**result), result["findSeconds"],
+                    sum(result["requests"].values()), result["subprocesses"], result["recordSeconds"],
+                    result["scheduler"]["throttledSeconds"], result["peakRSSKB"] / 1024)
+
+        if not opts.workdir:
+            shutil.rmtree(workDir)
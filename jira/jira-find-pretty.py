@@ -1,9 +1,8 @@
 #!/usr/bin/python
 
 import sys
-import json
-from optparse import OptionParser
 import re
+from runtime import readIssuesReachability
 
 def splitTicketKey(key):
     index = 0
@@ -14,14 +13,34 @@ def splitTicketKey(key):
         prefix = key[0:(len(key) - len(m.group(0)))]
     return (prefix, index)
 
-if __name__ == '__main__':
-    opt_parser = OptionParser(usage="%prog [options]", description="Formats the output of jira-find in human readable format.")
-    opts, args = opt_parser.parse_args()
+def main(argv=None, prog=None):
+    from optparse import OptionParser
+    opt_parser = OptionParser(usage="%prog [options]", description="Formats the output of jira-find in human readable format."
+                                                                    " Accepts both the JSON array and the --stream output."
+                                                                    " The tickets are sorted by key, so the URLs of all of them"
+                                                                    " are kept in memory until the input ends, unless --unsorted.")
+    opt_parser.prog = prog  # as run by devtools
+    opt_parser.add_option("--unsorted", action="store_true", default=False,
+                          help="Print tickets as soon as they're read instead of sorting them by key."
+                          " Only the keys of the tickets printed are kept in memory then.")
+    opts, args = opt_parser.parse_args(argv)
+
+    # only the ticket URLs are kept, not the whole records, and only the keys of the ones printed already if unsorted
+    ticketURLs = {}
+    for ticket in readIssuesReachability(sys.stdin):
+        if ticket['key'] in ticketURLs:
+            continue
+        ticketURL = u'{endpoint}/browse/{key}\n'.format(**ticket).encode("utf-8")
+        if opts.unsorted:
+            ticketURLs[ticket['key']] = None
+            sys.stdout.write(ticketURL)
+            sys.stdout.flush()
+        else:
+            ticketURLs[ticket['key']] = ticketURL
 
-    ticketsMap = {}
-    for ticket in json.loads(sys.stdin.read()):
-        ticketsMap[ticket['key']] = ticket
-    orderedTickets = [ticketsMap[key] for key in sorted(ticketsMap, key=splitTicketKey)]
+    if not opts.unsorted:
+        for key in sorted(ticketURLs, key=splitTicketKey):
+            sys.stdout.write(ticketURLs[key])
 
-    for ticket in orderedTickets:
-        sys.stdout.write(u'{endpoint}/browse/{key}\n'.format(**ticket).encode("utf-8"))
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,353 @@
 #!/usr/bin/env python2.7
 
+import array
+import binascii
+import bisect
+import collections
+import contextlib
+import errno
+import gitbackend
 import jira
 import json
 import os
 import re
-import subprocess as sp
+import runtime
+import socket
 import sys
+import time
 import operator
-import urlparse
-from optparse import OptionParser
+import threading
+import zlib
+from runtime import execCommand, logDebug, readIssuesReachability
 
-DEBUG = False
+GIT_BACKEND = gitbackend.ProcessGitBackend()
+STATS = None  # a RunStats when the run is measured
+MISSING_KEYS_PER_QUERY = 100  # keeps the URLs of the `key in (...)` queries within the limits of the servers
+
+def loadTests():
+    import unittest
+
+    class Tests(unittest.TestCase):
+        def setUp(self):
+            self.workDirs = []
+
+        def tearDown(self):
+            import shutil
+            for workDir in self.workDirs:
+                shutil.rmtree(workDir)
+
+        def git(self, repoPath, *args):
+            import subprocess as sp
+            env = dict(os.environ, GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@localhost",
+                       GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@localhost")
+            return sp.check_output(("git",) + args, cwd=repoPath, env=env).strip()
+
+        def createWorkDir(self):
+            import tempfile
+            workDir = tempfile.mkdtemp()
+            self.workDirs.append(workDir)
+            return workDir
+
+        def createRepository(self):
+            repoPath = self.createWorkDir()
+            self.git(repoPath, "init", "-q")
+            return repoPath
+
+        def commit(self, repoPath, message):
+            self.git(repoPath, "commit", "-q", "--allow-empty", "-m", message)
+            return self.git(repoPath, "rev-parse", "HEAD")
+
+        def commitSubmodules(self, repoPath, submodules, message):
+            """
+            Commits a tree of just the given (path, revision) submodules.
+            """
+            self.git(repoPath, "read-tree", "--empty")
+            with open(os.path.join(repoPath, ".gitmodules"), 'w') as gitmodules:
+                for path, _ in submodules:
+                    gitmodules.write('[submodule "{0}"]\n\tpath = {0}\n\turl = https://example.com/{0}.git\n'.format(path))
+            self.git(repoPath, "add", ".gitmodules")
+            for path, revision in submodules:
+                self.git(repoPath, "update-index", "--add", "--cacheinfo", "160000,{0},{1}".format(revision, path))
+            return self.commit(repoPath, message)
+
+        def createSuperproject(self):
+            """
+            Creates a superproject whose revision `new` has, compared to `old`, the submodule a updated,
+            b moved from old/b to new/b, c added and x removed. Returns the root path and the SHAs by name.
+            """
+            root = self.createRepository()
+            shas = {}
+            for name, path in [("a", "a"), ("b", "new/b"), ("c", "c"), ("x", "x")]:
+                os.makedirs(os.path.join(root, path))
+                self.git(os.path.join(root, path), "init", "-q")
+                shas[name + "1"] = self.commit(os.path.join(root, path), name + " 1")
+                shas[name + "2"] = self.commit(os.path.join(root, path), name + " 2")
+            shas["old"] = self.commitSubmodules(root, [("a", shas["a1"]), ("old/b", shas["b1"]), ("x", shas["x1"])], "Old")
+            shas["new"] = self.commitSubmodules(root, [("a", shas["a2"]), ("new/b", shas["b2"]), ("c", shas["c2"])], "New")
+            return root, shas
+
+        def test_findOldHeads_onMovedAddedAndRemovedSubmodules_matchesEachModule(self):
+            root, shas = self.createSuperproject()
+            modules = getGitModules(root, shas["new"])
+            actual = dict((os.path.relpath(module.path, root), head) for module, head in findOldHeads(modules, shas["old"]).items())
+            self.assertEqual(actual, {".": shas["old"], "a": shas["a1"], "new/b": shas["b1"], "c": None})
+
+        def test_verifyReachabilitySince_onSuperproject_marksOnlyIssuesOfAddedCommits(self):
+            root, shas = self.createSuperproject()
+            modules = getGitModules(root, shas["new"])
+            issues = [("UPDATED", [shas["a2"]]), ("OLD", [shas["a1"]]), ("MOVED", [shas["b2"]]), ("ADDED", [shas["c1"]]),
+                      ("REACHABLE-BEFORE", [shas["a1"], shas["a2"]]), ("REMOVED", [shas["x2"]])]
+            revisions = verifyRevisions(RevisionTable(issues), modules)
+            verifyReachabilitySince(revisions, findOldHeads(modules, shas["old"]))
+            self.assertEqual(filterReachables(revisions).keys(), ["UPDATED", "MOVED", "ADDED"])
+
+            revisions = verifyRevisions(RevisionTable(issues), modules)
+            verifyReachabilitySince(revisions, findOldHeads(modules, shas["new"]))  # an empty range
+            self.assertEqual(filterReachables(revisions).keys(), [])
+
+        def test_findRevisions_onPlainText_findsFullRevisions(self):
+            extractor = RevisionExtractor()
+            actual = extractor.findRevisions("Fixed in {0}, see also {1}x and {0}.".format("a" * 40, "b" * 40))
+            self.assertEqual(actual, ["a" * 40])
+
+        def test_findRevisions_onNestedFieldValue_findsRevisionsInAllStrings(self):
+            extractor = RevisionExtractor()
+            adfDocument = {"type": "doc", "content": [
+                {"type": "paragraph", "content": [{"type": "text", "text": "Fixed in " + "a" * 40}]},
+                {"type": "paragraph", "content": [{"type": "text", "text": "b" * 40}, {"type": "hardBreak"}]},
+            ]}
+            actual = extractor.findRevisions([adfDocument, {"value": "c" * 40}, 12, None])
+            self.assertEqual(actual, ["a" * 40, "b" * 40, "c" * 40])
+
+        def test_findRevisions_withAbbreviatedRevisions_findsOnlyHexWithDigits(self):
+            extractor = RevisionExtractor(minAbbreviatedLength=7)
+            actual = extractor.findRevisions("Fixed in 1a2b3c4, deadbeef and a1b2c3 in the release2 branch " + "d" * 40)
+            self.assertEqual(actual, ["1a2b3c4", "d" * 40])
+
+        def test_findRevisionsInIssue_onDuplicateRevisions_listsEachOnce(self):
+            extractor = RevisionExtractor()
+            issue = {"key": "KEY-1", "fields": {
+                "comment": {"comments": [{"body": "a" * 40}, {"body": "a" * 40 + " " + "b" * 40}]},
+                "customfield_1": "b" * 40,
+            }}
+            actual = extractor.findRevisionsInIssue(issue, ["comment", "customfield_1"])
+            self.assertEqual(actual, ["a" * 40, "b" * 40])
+
+        def test_slimIssue_onLongComments_keepsOnlyRevisions(self):
+            extractor = RevisionExtractor()
+            issue = {"id": "1", "key": "KEY-1", "fields": {"comment": {"total": 2, "comments": [
+                {"body": "Fixed in " + "a" * 40 + " and " + "b" * 40, "author": {"name": "someone"}},
+                {"body": "Long discussion " * 1000}]}}}
+            actual = extractor.slimIssue(issue)
+            self.assertEqual(actual["fields"]["comment"]["comments"][0]["body"], "a" * 40 + " " + "b" * 40)
+            self.assertEqual(actual["fields"]["comment"]["comments"][1]["body"], "")
+            self.assertEqual(extractor.findRevisionsInIssue(actual, ["comment"]), extractor.findRevisionsInIssue(issue, ["comment"]))
+
+        def test_iterateConcurrently_onFailingItems_raisesTheError(self):
+            def items():
+                yield 1
+                yield 2
+                raise ValueError("page 2 failed")
+
+            results = []
+            with self.assertRaises(ValueError):
+                for result in iterateConcurrently(lambda item: item * 10, items(), jobs=2):
+                    results.append(result)
+            self.assertEqual(results, [10, 20][:len(results)])
+            self.assertEqual(list(iterateConcurrently(lambda item: item * 10, xrange(7), jobs=3)), range(0, 70, 10))
+
+        def test_RunStats_onCallsOfDifferentIssues_groupsThemByResource(self):
+            stats = RunStats()
+            stats.recordHTTP({'method': 'GET', 'resource': '/rest/api/2/issue/ABC-12/comment?startAt=0', 'status': 200,
+                              'bytes': 10, 'seconds': 0.005})
+            stats.recordHTTP({'method': 'GET', 'resource': '/rest/api/2/issue/XYZ-3/comment', 'status': 404,
+                              'bytes': 5, 'seconds': 0.5})
+            actual = stats.report()['http']['GET /rest/api/2/issue/*/comment']
+            self.assertEqual((actual['calls'], actual['bytes'], actual['statuses']), (2, 15, {200: 1, 404: 1}))
+            self.assertEqual((actual['latency']['<10ms'], actual['latency']['<1000ms']), (1, 1))
+
+        def test_LRUCache_onOverflow_evictsLeastRecentlyUsed(self):
+            cache = LRUCache(2)
+            cache["a"] = 1
+            cache["b"] = 2
+            cache.get("a")
+            cache["c"] = 3
+            self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+        def test_loadTicketIdPattern_onHookFormattedMessage_findsAllKeys(self):
+            actual = re.findall(loadTicketIdPattern(), "ABC-123: Fixed typo. Also fixes DEF-45, not utf8.")
+            self.assertEqual(actual, ["ABC-123", "DEF-45"])
+
+        def test_ReachableCommits_withCache_extendsClosestCachedAncestorAndEvictsMissingHeads(self):
+            repoPath = self.createRepository()
+            first = self.commit(repoPath, "First")
+            second = self.commit(repoPath, "Second")
+            cache = ReachabilityCache(GitModule("url", repoPath, second))
+            ReachableCommits(GitModule("url", repoPath, second), cache)
+            cache.store("f" * 40, set())  # e.g. rebased away
+            third = self.commit(repoPath, "Third")
+            listed = []
+
+            class RecordingReachableCommits(ReachableCommits):
+                def listCommits(self, module, head, excludedHead=None):
+                    commits = ReachableCommits.listCommits(self, module, head, excludedHead)
+                    listed.append((head, excludedHead, commits))
+                    return commits
+
+            commits = RecordingReachableCommits(GitModule("url", repoPath, third), cache)
+            self.assertEqual(listed, [(third, second, [third])])
+            self.assertEqual(commits.commits, set([first, second, third]))
+            self.assertEqual(sorted(cache.heads()), sorted([second, third]))
+            self.assertEqual(RecordingReachableCommits(GitModule("url", repoPath, third), cache).commits, commits.commits)
+            self.assertEqual(len(listed), 1)  # loaded from the cache
+
+        def test_ReachabilityCache_onHeadsRemovedByAnotherRun_takesThemAsEvicted(self):
+            repoPath = self.createRepository()
+            first = self.commit(repoPath, "First")
+            second = self.commit(repoPath, "Second")
+            cache = ReachabilityCache(GitModule("url", repoPath, first))
+            cache.store(first, set([first]))
+            vanished = [first, "e" * 40]  # listed, then removed by a concurrent run
+            listHeads = cache.heads
+            cache.heads = lambda: listHeads() + vanished
+            os.remove(os.path.join(cache.directory, first))
+            self.assertEqual(cache.load(first), None)
+            self.assertEqual(cache.closestAncestorOf(second), None)
+            cache.MAX_HEADS = 1
+            cache.store(second, set([first, second]))
+            self.assertEqual(listHeads(), [second])
+
+        def test_iterateIssuesReachability_onUnknownRevision_failsWithoutCachingIt(self):
+            repoPath = self.createRepository()
+            self.commit(repoPath, "First")
+            issues = iterateIssuesReachability(None, "project = ABC", [], repoPath, "nonexistent")
+            self.assertRaises(RepositoryError, list, issues)
+            self.assertFalse(os.path.exists(os.path.join(repoPath, ".git", "jira-find")))
+            cache = ReachabilityCache(GitModule("url", repoPath, "HEAD"))
+            self.assertRaises(ValueError, cache.store, "HEAD", set())
+
+        def test_CommitIssueIndex_onDivergentBranches_findsOnlyReachableCommitsAndDropsOldSegments(self):
+            repoPath = self.createRepository()
+            pattern = loadTicketIdPattern()
+            base = self.commit(repoPath, "ABC-1: Base")
+            self.git(repoPath, "checkout", "-q", "-b", "side")
+            side = self.commit(repoPath, "ABC-2: Side")
+            self.git(repoPath, "checkout", "-q", base)
+            main = self.commit(repoPath, "ABC-3: Main")
+            CommitIssueIndex(GitModule("url", repoPath, side), pattern).update(side)
+
+            module = GitModule("url", repoPath, main)
+            index = CommitIssueIndex(module, pattern)
+            index.update(main)
+            self.assertEqual(index.heads(), [side, main])
+            self.assertEqual(index.issueCommits(ReachableCommits(module)), {"ABC-1": [base], "ABC-3": [main]})
+
+            self.git(repoPath, "checkout", "-q", "side")
+            sideAgain = self.commit(repoPath, "ABC-4: Side again")
+            index.MAX_HEADS = 2
+            index.update(sideAgain)  # merges the segment of side
+            self.git(repoPath, "checkout", "-q", base)
+            other = self.commit(repoPath, "ABC-5: Other")
+            index.update(other)  # drops the segment of main
+            self.assertEqual(CommitIssueIndex(module, pattern).heads(), [sideAgain, other])
+            self.assertEqual(index.issueCommits(ReachableCommits(GitModule("url", repoPath, sideAgain))),
+                             {"ABC-1": [base], "ABC-2": [side], "ABC-4": [sideAgain]})
+
+        def test_RunStats_onNestedPhases_excludesNestedTimeFromOuterPhase(self):
+            stats = RunStats()
+            with stats.measure("outer"):
+                with stats.measure("inner"):
+                    time.sleep(0.05)
+            self.assertGreaterEqual(stats.phases["inner"], 0.05)
+            self.assertLess(stats.phases["outer"], 0.01)
+
+        def test_isInShard_onManyKeys_putsEachKeyIntoOneShard(self):
+            shards = [parseShard("{0}/3".format(i)) for i in xrange(1, 4)]
+            keys = ["KEY-{0}".format(i) for i in xrange(300)]
+            counts = [len([key for key in keys if isInShard(key, shard)]) for shard in shards]
+            self.assertEqual(sum(counts), len(keys))
+            self.assertEqual(shards[0], (0, 3))
+            self.assertGreater(min(counts), 50)
+            self.assertEqual((parseShard("0/3"), parseShard("4/3"), parseShard("x")), (None, None, None))
+
+        def test_mergeIssuesReachability_onPartialResults_groupsRevisionsOfEachIssue(self):
+            issue = lambda key, revision: {'key': key, 'endpoint': 'e', 'revision': revision, 'repository': None}
+            actual = mergeIssuesReachability([[issue("A-1", "a"), issue("B-2", "b")], [issue("A-1", "c"), issue("A-1", "a")]])
+            self.assertEqual(sorted((item['key'], item['revision']) for item in actual), [("A-1", "a"), ("A-1", "c"), ("B-2", "b")])
+            self.assertEqual(abs(actual.index(issue("A-1", "c")) - actual.index(issue("A-1", "a"))), 1)
+
+        def test_iterateIssuesIncrementally_onManyMissingKeys_queriesThemInChunks(self):
+            queries = []
+
+            class StubClient:
+                def search(self, jql, offset=None, limit=None, fields=None, expand=None, onIssue=None):
+                    queries.append(jql)
+                    if jql.startswith("key in"):
+                        keys = re.findall(r"KEY-\d+", jql)
+                    else:  # none updated since the snapshot, which is empty
+                        keys = [] if "updated >=" in jql else ["KEY-{0}".format(i) for i in xrange(250)]
+                    return {"startAt": 0, "total": len(keys), "issues": [{"key": key, "fields": {}} for key in keys]}
+
+            snapshotPath = os.path.join(self.createWorkDir(), "snapshot.json")
+            with open(snapshotPath, 'w') as snapshotFile:
+                json.dump({'query': "q", 'fields': [], 'slimming': None, 'lastRun': time.time(), 'issues': {}}, snapshotFile)
+            issues = list(iterateIssuesIncrementally(StubClient(), "q", [], snapshotPath, pageSize=1000))
+            self.assertEqual(len(issues), 250)
+            self.assertEqual([len(re.findall(r"KEY-\d+", query)) for query in queries if query.startswith("key in")], [100, 100, 50])
+
+        def test_ReachabilityServer_onManyUsers_sharesOneResponseCache(self):
+            server = ReachabilityServer()
+            alice = server.clientFor("http://jira.example.com", "alice:secret")
+            bob = server.clientFor("http://jira.example.com", "bob:secret")
+            self.assertFalse(alice is bob)
+            self.assertTrue(alice.cache is bob.cache is server.responseCache)
+
+        def test_ReachabilityServer_onManyUsers_keepsRecentClientsAndOwnSnapshots(self):
+            snapshotsPath = self.createWorkDir()
+            server = ReachabilityServer(snapshotsPath=snapshotsPath, maxClients=2)
+            clients = [server.clientFor("http://jira.example.com", user) for user in ["a:1", "b:2", "a:1", "c:3"]]
+            self.assertTrue(clients[0] is clients[2])
+            self.assertEqual(len(server.clients), 2)
+            self.assertFalse(server.clientFor("http://jira.example.com", "b:2") is clients[1])  # evicted
+            self.assertEqual(os.path.dirname(server.snapshotPathFor("/etc/cron.d/evil")), snapshotsPath)
+            self.assertEqual(ReachabilityServer().snapshotPathFor("/tmp/snapshot.json"), None)
+
+        def test_RevisionTable_onExtendAndSelect_keepsRevisionsModulesAndReachability(self):
+            moduleA, moduleB = GitModule("a", "a", "0" * 40), GitModule("b", "b", "0" * 40)
+            first = RevisionTable([("A-1", ["a" * 40, "1a2b3c4"]), ("A-2", [])])
+            first.setModule(0, moduleA)
+            first.setReachable(1, True)
+            second = RevisionTable([("B-1", ["b" * 40]), ("B-2", ["c" * 40] * 9)])
+            second.setModule(0, moduleB)
+            second.setModule(9, moduleA)
+            second.setReachable(9, True)
+            first.extend(second)
+            first.setRevision(1, "1a2b3c4" + "d" * 33)
+            selected = first.select([3, 0])
+            self.assertEqual(selected.keys(), ["B-2", "A-1"])
+            self.assertEqual([selected.revision(row) for row in selected.rowsOf(1)], ["a" * 40, "1a2b3c4" + "d" * 33])
+            self.assertEqual([selected.module(row) for row in (0, 8, 9)], [None, moduleA, moduleA])
+            self.assertEqual([row for row in xrange(selected.rowsCount()) if selected.isReachable(row)], [8, 10])
+            self.assertEqual((first.module(2), len(first.modules)), (moduleB, 2))
+
+        def test_RevisionTable_onNonHexToken_keepsItAsText(self):
+            token = "zz" + "a" * 38
+            revisions = RevisionTable([("K-1", [token, "b" * 40])])
+            revisions.setRevision(1, "Y" * 40)
+            self.assertEqual([revisions.revision(row) for row in revisions.rowsOf(0)], [token, "Y" * 40])
+
+        def test_filterIssues_onEachMode_classifiesLikeTheRevisions(self):
+            module = GitModule("a", "a", "0" * 40)
+            revisions = RevisionTable([("R-1", ["a" * 40, "b" * 40]), ("U-1", ["c" * 40]), ("O-1", ["d" * 40]), ("O-2", [])])
+            for row in (1, 2):
+                revisions.setModule(row, module)
+            revisions.setReachable(1, True)
+            self.assertEqual(filterIssues(revisions).keys(), ["R-1"])
+            self.assertEqual(filterIssues(revisions, unreachable=True).keys(), ["U-1", "O-1", "O-2"])
+            self.assertEqual(filterIssues(revisions, orphants=True).keys(), ["O-1", "O-2"])
+            self.assertEqual(filterIssues(revisions, orphants=True, unreachable=True).keys(), ["U-1", "O-1", "O-2"])
+
+    return Tests
 
 def getFieldIDs(client, rawNames):
     fields = client.getFields()
@@ -25,199 +362,1388 @@ def getFieldIDs(client, rawNames):
     logDebug("Fields: " + str(filtered))
     return filtered
 
-def getAllIssues(client, query, fields):
-    issues = []
-    while True:
-        found = client.search(query, len(issues), 128, fields)
-        issues.extend(found['issues'])
-        if 0 == len(found['issues']):
-            break
-    return issues
+def iterateIssues(client, query, fields, pageSize=128, jobs=1, onIssue=None):
+    """
+    Yields all the issues matching the query. The first page tells the total number of issues,
+    the remaining pages are then requested concurrently but yielded in order.
+    If onIssue is given, the results of it are yielded instead, each issue is passed to it as soon as it's read.
+    """
+    firstPage = client.search(query, 0, pageSize, fields, onIssue=onIssue)
+    for issue in firstPage['issues']:
+        yield issue
+
+    pageSize = len(firstPage['issues'])  # the server may cap maxResults below the requested one
+    if 0 == pageSize:
+        return
+
+    fetchPage = lambda offset: client.search(query, offset, pageSize, fields, onIssue=onIssue)
+    for page in iterateConcurrently(fetchPage, xrange(pageSize, firstPage['total'], pageSize), jobs):
+        for issue in page['issues']:
+            yield issue
+
+def iterateIssuesIncrementally(client, query, fields, snapshotPath, pageSize=128, jobs=1, extractor=None):
+    """
+    Yields all the issues matching the query reusing the ones saved in the snapshot file by the previous run.
+    Only the keys of the matching issues and the issues updated since the previous run are fetched.
+    The issues are slimmed by the extractor if it's given.
+    """
+    onIssue = extractor.slimIssue if extractor else None
+    slimming = extractor.pattern.pattern if extractor else None
+    snapshot = None
+    if os.path.isfile(snapshotPath):
+        with open(snapshotPath, 'r') as snapshotFile:
+            snapshot = json.load(snapshotFile)
+        if snapshot['query'] != query or snapshot['fields'] != sorted(fields) or snapshot.get('slimming') != slimming:
+            logDebug("Snapshot " + snapshotPath + " is for another query, ignoring it")
+            snapshot = None
+
+    runTime = time.time()
+    if snapshot:
+        filterQuery, orderBy = re.match(r"(?is)^(.*?)(\s+order\s+by\s+.*)?$", query).groups()
+        sinceMinutes = int((runTime - snapshot['lastRun']) / 60) + 5  # a margin for clock skew and indexing lag
+        updatedQuery = "({0}) AND updated >= -{1}m{2}".format(filterQuery, sinceMinutes, orderBy or "")
+        updatedIssues = dict((issue['key'], issue) for issue in iterateIssues(client, updatedQuery, fields, pageSize, jobs, onIssue))
+        logDebug("{0} issues updated in the last {1} minutes".format(len(updatedIssues), sinceMinutes))
+
+        keys = [issue['key'] for issue in iterateIssues(client, query, ['key'], pageSize, jobs)]
+        knownIssues = dict(snapshot['issues'], **updatedIssues)
+        missingKeys = [key for key in keys if key not in knownIssues]
+        for someMissingKeys in iterateBatches(missingKeys, MISSING_KEYS_PER_QUERY):  # the query goes in the URL
+            missingQuery = "key in ({0})".format(", ".join(someMissingKeys))
+            knownIssues.update((issue['key'], issue) for issue in iterateIssues(client, missingQuery, fields, pageSize, jobs, onIssue))
+        issues = [knownIssues[key] for key in keys if key in knownIssues]
+    else:
+        issues = list(iterateIssues(client, query, fields, pageSize, jobs, onIssue))
+
+    tempPath = snapshotPath + ".tmp"
+    with open(tempPath, 'w') as snapshotFile:
+        json.dump({'query': query, 'fields': sorted(fields), 'slimming': slimming, 'lastRun': runTime,
+                   'issues': dict((issue['key'], issue) for issue in issues)}, snapshotFile)
+    os.rename(tempPath, snapshotPath)
+
+    for issue in issues:
+        yield issue
+
+def getAllIssues(client, query, fields, pageSize=128, jobs=1):
+    return list(iterateIssues(client, query, fields, pageSize, jobs))
+
+class RepositoryError(Exception):
+    """
+    Raised when the repository or the revision to check doesn't exist.
+    """
+
+def resolveCommit(repoPath, revision):
+    """
+    Returns the SHA of the commit the revision names in the repository, peeling tags.
+    """
+    import pipes
+    sha, returnCode = execCommand("git rev-parse --verify --quiet {0}".format(pipes.quote(revision + "^{commit}")),
+                                  isQuery=True, cwd=repoPath)
+    if returnCode:
+        raise RepositoryError("No commit {0} in {1}".format(revision, repoPath))
+    return sha
 
 class GitModule:
     def __init__(self, url, path, headRevision):
         self.url = url
         self.path = path
         self.head = headRevision
+        self.submodules = []
+
+class RevisionTable:
+    """
+    The revisions specified in the issues, kept by columns as there may be millions of them: a row per revision
+    of an issue with its SHA as 20 bytes, the index of its module and a bit telling if it's reachable.
+    The rows of an issue are adjacent. The revisions that aren't full SHAs, i.e. the abbreviated ones not expanded
+    by verifyRevisions or the tokens looking like SHAs but not hex, are kept as text aside. Iterating a table gives the keys of its issues as iterating a dict would.
+    """
+    NO_MODULE = -1
+    FULL_SHA_REGEX = re.compile(r"[0-9a-f]{40}$")
 
-class RevisionSpecifier:
-    def __init__(self, revision):
-        self.revision = revision
-        self.module = None
-        self.isReachable = False
+    def __init__(self, issueRevisions=()):
+        self.issueKeys = []
+        self.issueRowStarts = array.array('l', [0])  # the rows of the i-th issue are issueRowStarts[i]:issueRowStarts[i + 1]
+        self.shas = bytearray()
+        self.partialSHAs = {}  # row: revision as text
+        self.moduleIndices = array.array('h')
+        self.reachableBits = bytearray()
+        self.modules = []
+        self.moduleIndicesByPath = {}
+        for issueKey, revisions in issueRevisions:
+            self.addIssue(issueKey, revisions)
 
-def findRevisionsSpecified(jiraClient, issues, fields):
-    revisions = {}
-    for issue in issues:
-        foundRevs = []
+    def __len__(self):
+        return len(self.issueKeys)
 
-        # search through issue fields
+    def __iter__(self):
+        return iter(self.issueKeys)
+
+    def keys(self):
+        return list(self.issueKeys)
 
-        def findRevisions(fieldValue):
-            for gitCommit in re.finditer(r"(?<!\w)[a-z0-9]{40}(?!\w)", fieldValue):
-                foundRevs.append(RevisionSpecifier(gitCommit.group(0)))
-                logDebug("Found rev {0} in field {1} of issue {2}".format(gitCommit.group(0), fieldName, issue['key']))
+    def rowsCount(self):
+        return len(self.moduleIndices)
 
+    def rowsOf(self, issueIndex):
+        return xrange(self.issueRowStarts[issueIndex], self.issueRowStarts[issueIndex + 1])
+
+    def addIssue(self, issueKey, revisions):
+        for revision in revisions:
+            if self.FULL_SHA_REGEX.match(revision):
+                self.shas += binascii.unhexlify(revision)
+            else:
+                self.partialSHAs[len(self.moduleIndices)] = revision
+                self.shas += "\0" * 20
+            self.moduleIndices.append(self.NO_MODULE)
+        self.reachableBits.extend("\0" * ((len(self.moduleIndices) + 7) / 8 - len(self.reachableBits)))
+        self.issueKeys.append(issueKey)
+        self.issueRowStarts.append(len(self.moduleIndices))
+
+    def revision(self, row):
+        partialSHA = self.partialSHAs.get(row)
+        return partialSHA if partialSHA is not None else binascii.hexlify(self.shas[row * 20:row * 20 + 20])
+
+    def setRevision(self, row, revision):
+        if self.FULL_SHA_REGEX.match(revision):
+            self.shas[row * 20:row * 20 + 20] = binascii.unhexlify(revision)
+            self.partialSHAs.pop(row, None)
+        else:
+            self.partialSHAs[row] = revision
+
+    def module(self, row):
+        moduleIndex = self.moduleIndices[row]
+        return self.modules[moduleIndex] if moduleIndex != self.NO_MODULE else None
+
+    def setModule(self, row, module):
+        self.moduleIndices[row] = self.indexOfModule(module) if module else self.NO_MODULE
+
+    def indexOfModule(self, module):
+        moduleIndex = self.moduleIndicesByPath.get(module.path)
+        if moduleIndex is None:
+            moduleIndex = self.moduleIndicesByPath[module.path] = len(self.modules)
+            self.modules.append(module)
+        return moduleIndex
+
+    def isReachable(self, row):
+        return bool(self.reachableBits[row >> 3] & (1 << (row & 7)))
+
+    def setReachable(self, row, isReachable):
+        if isReachable:
+            self.reachableBits[row >> 3] |= 1 << (row & 7)
+        else:
+            self.reachableBits[row >> 3] &= ~(1 << (row & 7)) & 0xff
+
+    def extend(self, other):
+        """
+        Appends the issues of the other table.
+        """
+        rowOffset = self.rowsCount()
+        self.issueKeys.extend(other.issueKeys)
+        self.issueRowStarts.extend(rowOffset + start for start in other.issueRowStarts[1:])
+        self.shas += other.shas
+        self.partialSHAs.update((rowOffset + row, revision) for row, revision in other.partialSHAs.iteritems())
+        moduleIndices = [self.indexOfModule(module) for module in other.modules]
+        self.moduleIndices.extend(moduleIndices[i] if i != self.NO_MODULE else i for i in other.moduleIndices)
+        if 0 == rowOffset % 8:
+            del self.reachableBits[(rowOffset + 7) / 8:]
+            self.reachableBits += other.reachableBits
+        else:
+            self.reachableBits.extend("\0" * ((self.rowsCount() + 7) / 8 - len(self.reachableBits)))
+            for row in xrange(other.rowsCount()):
+                if other.isReachable(row):
+                    self.setReachable(rowOffset + row, True)
+
+    def select(self, issueIndices):
+        """
+        Returns a table of only the issues given by their indices. It shares the modules of this one.
+        """
+        selected = RevisionTable()
+        selected.modules, selected.moduleIndicesByPath = self.modules, self.moduleIndicesByPath
+        for issueIndex in issueIndices:
+            start, end = self.issueRowStarts[issueIndex], self.issueRowStarts[issueIndex + 1]
+            selectedStart = selected.rowsCount()
+            selected.issueKeys.append(self.issueKeys[issueIndex])
+            selected.issueRowStarts.append(selectedStart + end - start)
+            selected.shas += self.shas[start * 20:end * 20]
+            selected.moduleIndices.extend(self.moduleIndices[start:end])
+            selected.reachableBits.extend("\0" * ((selected.rowsCount() + 7) / 8 - len(selected.reachableBits)))
+            for row in xrange(start, end):
+                if row in self.partialSHAs:
+                    selected.partialSHAs[selectedStart + row - start] = self.partialSHAs[row]
+                if self.isReachable(row):
+                    selected.setReachable(selectedStart + row - start, True)
+        return selected
+
+def iterateConcurrently(func, items, jobs):
+    """
+    Lazily applies func to each of the items using up to `jobs` worker threads.
+    The results are yielded as soon as they're ready but keep the order of the items.
+    The items are pulled on the calling thread, up to twice as many as the workers ahead of the results, so that
+    an error raised by the items, e.g. a generator of JIRA pages, is raised here rather than lost in the pool.
+    """
+    if jobs <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(jobs)
+    try:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+class RunStats:
+    """
+    Collects the wall time of the run phases, the HTTP calls and the git subprocesses.
+    Phases may nest, each one is accounted only for the time not spent in the phases nested in it.
+    Phases are measured on the main thread only, calls may be recorded from any thread.
+    """
+    LATENCY_BUCKETS = [0.01, 0.03, 0.1, 0.3, 1, 3, 10]
+
+    def __init__(self):
+        self.startTime = time.time()
+        self.phases = {}
+        self.phaseStack = []  # [phase, time spent in the nested phases]
+        self.http = {}
+        self.git = {}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, phase):
+        self.phaseStack.append([phase, 0.0])
+        startTime = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - startTime
+            _, nestedTime = self.phaseStack.pop()
+            self.phases[phase] = self.phases.get(phase, 0.0) + elapsed - nestedTime
+            if self.phaseStack:
+                self.phaseStack[-1][1] += elapsed
+
+    def measureIteration(self, phase, items):
+        """
+        Yields the items accounting the time spent waiting for each of them to the phase.
+        """
+        iterator = iter(items)
+        while True:
+            with self.measure(phase):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def recordHTTP(self, call):
+        """
+        Suitable for jira.STATS_FUNC. The calls are grouped by resource with issue and comment IDs masked.
+        """
+        resource = re.sub(r"(/issue/|/comment/)[^/]*\d[^/]*", r"\1*", call['resource'].split('?', 1)[0])
+        bucket = bisect.bisect_left(self.LATENCY_BUCKETS, call['seconds'])
+        with self.lock:
+            stats = self.http.setdefault(call['method'] + " " + resource, {
+                'calls': 0, 'seconds': 0.0, 'bytes': 0, 'statuses': {}, 'latency': [0] * (len(self.LATENCY_BUCKETS) + 1)})
+            stats['calls'] += 1
+            stats['seconds'] += call['seconds']
+            stats['bytes'] += call['bytes']
+            stats['statuses'][call['status']] = stats['statuses'].get(call['status'], 0) + 1
+            stats['latency'][bucket] += 1
+
+    def recordGit(self, call):
+        """
+        Suitable for gitbackend.STATS_FUNC.
+        """
+        with self.lock:
+            stats = self.git.setdefault(call['command'], {'processes': 0, 'seconds': 0.0})
+            stats['processes'] += 1
+            stats['seconds'] += call['seconds']
+
+    def report(self):
+        labels = ["<{0}ms".format(int(limit * 1000)) for limit in self.LATENCY_BUCKETS]
+        labels.append(">={0}ms".format(int(self.LATENCY_BUCKETS[-1] * 1000)))
+        with self.lock:
+            http = dict((resource, dict(stats, latency=dict(zip(labels, stats['latency']))))
+                        for resource, stats in self.http.iteritems())
+            git = dict((command, dict(stats)) for command, stats in self.git.iteritems())
+        return {
+            'seconds': time.time() - self.startTime,
+            'phases': dict(self.phases),
+            'http': http,
+            'git': git,
+            'totals': {
+                'httpCalls': sum(stats['calls'] for stats in http.itervalues()),
+                'httpBytes': sum(stats['bytes'] for stats in http.itervalues()),
+                'httpSeconds': sum(stats['seconds'] for stats in http.itervalues()),
+                'gitProcesses': sum(stats['processes'] for stats in git.itervalues()),
+                'gitSeconds': sum(stats['seconds'] for stats in git.itervalues()),
+            },
+        }
+
+class NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+NO_PHASE = NoPhase()
+
+def measurePhase(phase):
+    return STATS.measure(phase) if STATS else NO_PHASE
+
+class RevisionExtractor:
+    """
+    Finds git revisions mentioned in issue fields of any shape: strings, lists, objects
+    and Atlassian Document Format trees. Abbreviated revisions are found only if their minimal length is given,
+    they're expanded to the full ones on verification.
+    """
+    def __init__(self, minAbbreviatedLength=None):
+        pattern = r"[a-z0-9]{40}"
+        if minAbbreviatedLength:
+            # an abbreviation must have a digit, otherwise it's likely to be just a word like 'facade'
+            pattern += r"|(?=[a-f]*[0-9])[0-9a-f]{{{0},39}}".format(minAbbreviatedLength)
+        self.pattern = re.compile(r"(?<!\w)(?:{0})(?!\w)".format(pattern))
+
+    def findRevisions(self, fieldValue):
+        """
+        Returns distinct revisions in the order of their appearance.
+        """
+        revisions = []
+        seenRevisions = set()
+        pendingValues = [fieldValue]
+        while pendingValues:
+            value = pendingValues.pop()
+            if isinstance(value, basestring):
+                for match in self.pattern.finditer(value):
+                    revision = match.group(0)
+                    if revision not in seenRevisions:
+                        seenRevisions.add(revision)
+                        revisions.append(revision)
+            elif isinstance(value, dict):
+                pendingValues.extend(reversed(value.values()))
+            elif isinstance(value, list):
+                pendingValues.extend(reversed(value))
+        return revisions
+
+    def slim(self, value):
+        """
+        Returns a copy of the value of the same shape with each string cut down to the revisions it mentions.
+        """
+        if isinstance(value, basestring):
+            return " ".join(self.pattern.findall(value))
+        if isinstance(value, dict):
+            return dict((key, self.slim(item)) for key, item in value.iteritems())
+        if isinstance(value, list):
+            return [self.slim(item) for item in value]
+        return value
+
+    def slimIssue(self, issue):
+        """
+        The same revisions are found in the slim issue, but huge comment threads no longer take memory.
+        """
+        return {'id': issue['id'], 'key': issue['key'], 'fields': self.slim(issue.get('fields', {}))}
+
+    def findRevisionsInIssue(self, issue, fields):
+        values = []
         for fieldName in fields:
-            field = issue['fields'][fieldName] if fieldName in issue['fields'] else None
+            field = issue['fields'].get(fieldName)
             if field is not None:
                 if 'comment' == fieldName:
-                    for comment in field['comments']:
-                        findRevisions(comment['body'])
+                    values.extend(comment['body'] for comment in field['comments'])
                 else:
-                    findRevisions(field)
+                    values.append(field)
+
+        revisions = self.findRevisions(values)
+        if runtime.DEBUG:
+            for revision in revisions:
+                logDebug("Found rev {0} in issue {1}".format(revision, issue['key']))
+        return revisions
+
+def findRevisionsSpecified(jiraClient, issues, fields, jobs=1, extractor=None):
+    return dict(iterateRevisionsSpecified(jiraClient, issues, fields, jobs, extractor))
+
+def iterateRevisionsSpecified(jiraClient, issues, fields, jobs=1, extractor=None, indexedCommits=None):
+    """
+    Yields (issue key, revisions mentioned in the issue) pairs.
+    The issues may be a generator, they're processed as they arrive.
+    JIRA is asked for the commits of only the issues not found in indexedCommits, a map of issue keys to their commits.
+    """
+    extractor = extractor or RevisionExtractor()
+    indexedCommits = indexedCommits or {}
+
+    def fetchRelatedCommits(issue):
+        if issue['key'] in indexedCommits:
+            return issue, []
+        return issue, jiraClient.getRepositoryCommits(issue["id"])
+
+    for issue, relatedCommits in iterateConcurrently(fetchRelatedCommits, issues, jobs):
+
+        # search through issue fields
+
+        with measurePhase("extraction"):
+            foundRevs = extractor.findRevisionsInIssue(issue, fields)
+
+        # search through commit messages
+
+        foundRevs.extend(sha for sha in indexedCommits.get(issue['key'], []) if sha not in foundRevs)
 
         # search through bitbucket
 
-        relatedCommits = jiraClient.getRepositoryCommits(issue["id"])
         for repositoryGroup in relatedCommits:
             nonMerges = [commit for commit in repositoryGroup["commits"] if not commit["merge"]]
             if len(nonMerges) > 0:
                 latestCommit = sorted(nonMerges, key=operator.itemgetter("authorTimestamp"), reverse=True)[0]
-                foundRevs.append(RevisionSpecifier(latestCommit["id"]))
+                if latestCommit["id"] not in foundRevs:
+                    foundRevs.append(latestCommit["id"])
 
-        revisions[issue['key']] = foundRevs
+        yield issue['key'], foundRevs
 
-    return revisions
+def findExistingCommits(module, shas):
+    """
+    Returns a map of each SHA to the full SHA of the commit it names in the module or None if there's no such commit.
+    """
+    if not shas:
+        return {}
+    startTime = time.time()
+    existence = GIT_BACKEND.findCommits(module.path, shas)
+    logDebug("{0}: {1} revisions looked up in {2:.3f}s".format(module.path, len(shas), time.time() - startTime))
+    return existence
 
-def verifyRevisions(revisions, modules):
+def verifyRevisions(revisions, modules, knownRevisions=None):
     """
-    Checks the validity of the revisions specified. The valid revisions will get their module info filled in.
+    Checks the validity of the revisions in the table. The valid revisions will get their module filled in
+    and abbreviated ones get expanded. Each distinct SHA is looked up in the modules in order until the first one
+    containing it. The results are collected in knownRevisions, so subsequent calls sharing it never look up
+    the same SHA again. It maps a full SHA, in binary, to its module and an abbreviated one to its module and full SHA.
     """
-    for issueKey, revSpecifiers in revisions.iteritems():
-        for rev in revSpecifiers:
-            for module in modules:
-                _, isValid = execCommand("git rev-parse --verify {0}^{{commit}}".format(rev.revision), isQuery = True, cwd=module.path)
-                isValid = not isValid  # invert shell's 0 for True
-                if isValid:
-                    rev.module = module
-                    
+    knownRevisions = knownRevisions if knownRevisions is not None else {}
+
+    def knownRevisionKey(sha):
+        return binascii.unhexlify(sha) if RevisionTable.FULL_SHA_REGEX.match(sha) else sha
+
+    rowsBySHA = {}
+    for row in xrange(revisions.rowsCount()):
+        rowsBySHA.setdefault(revisions.revision(row), []).append(row)
+
+    pending = sorted(sha for sha in rowsBySHA if knownRevisionKey(sha) not in knownRevisions)
+    for module in modules:
+        if not pending:
+            break
+        existence = findExistingCommits(module, pending)
+        for sha in pending:
+            if existence[sha]:
+                knownRevisions[knownRevisionKey(sha)] = module if existence[sha] == sha else (module, existence[sha])
+        pending = [sha for sha in pending if not existence[sha]]
+    for sha in pending:
+        knownRevisions[knownRevisionKey(sha)] = None
+
+    for sha, rows in rowsBySHA.iteritems():
+        module = knownRevisions[knownRevisionKey(sha)]
+        module, fullSHA = module if isinstance(module, tuple) else (module, sha)
+        for row in rows:
+            revisions.setModule(row, module)
+            if fullSHA != sha:
+                revisions.setRevision(row, fullSHA)
+
     return revisions
 
-def verifyReachability(revisions):
+class ReachabilityCache:
+    """
+    Persists the sets of commits reachable from the heads of a module between runs.
+    Each set is stored in `<git dir>/jira-find/reachable/<head>` as a sorted array of binary 20-byte SHAs.
+    The cache may be shared by concurrent runs, so a head file may vanish at any moment: it's then taken as evicted.
+    """
+    MAX_HEADS = 16
+
+    def __init__(self, module):
+        self.module = module
+        self.directory = os.path.join(GIT_BACKEND.gitDir(module.path), "jira-find", "reachable")
+
+    def heads(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [name for name in os.listdir(self.directory) if RevisionTable.FULL_SHA_REGEX.match(name)]
+
+    def load(self, head):
+        path = os.path.join(self.directory, head)
+        try:
+            with open(path, 'rb') as cacheFile:
+                data = cacheFile.read()
+            os.utime(path, None)  # keeps recently used heads from eviction
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        return set(binascii.hexlify(data[i:i + 20]) for i in xrange(0, len(data), 20))
+
+    def store(self, head, commits):
+        if not RevisionTable.FULL_SHA_REGEX.match(head):
+            raise ValueError("Only the commits reachable from full SHAs are cached, not from " + head)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        import tempfile
+        fd, tempPath = tempfile.mkstemp(prefix=head + ".", suffix=".tmp", dir=self.directory)  # may be stored concurrently
+        with os.fdopen(fd, 'wb') as cacheFile:
+            cacheFile.write("".join(binascii.unhexlify(commit) for commit in sorted(commits)))
+        os.rename(tempPath, os.path.join(self.directory, head))
+
+        byAge = sorted((mtime, cachedHead) for cachedHead, mtime in self.statHeads(os.path.getmtime))
+        for _, cachedHead in byAge[:-self.MAX_HEADS]:
+            self.evict(cachedHead)
+
+    def statHeads(self, statFunc, heads=None):
+        """
+        Returns (head, statFunc(head file)) pairs of the heads given or all the cached ones, skipping the evicted ones.
+        """
+        stats = []
+        for head in heads if heads is not None else self.heads():
+            try:
+                stats.append((head, statFunc(os.path.join(self.directory, head))))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return stats
+
+    def evict(self, head):
+        logDebug("Evicting cached reachability of " + head + " in " + self.module.path)
+        try:
+            os.remove(os.path.join(self.directory, head))
+        except OSError as e:
+            if e.errno != errno.ENOENT:  # evicted by another run already
+                raise
+
+    def closestAncestorOf(self, head):
+        """
+        Returns the cached head which is an ancestor of the given one and has the most commits reachable.
+        Evicts the cached heads which no longer exist in the repository.
+        """
+        cachedHeads = self.heads()
+        existence = findExistingCommits(self.module, cachedHeads)
+        ancestors = []
+        for cachedHead in cachedHeads:
+            if not existence[cachedHead]:
+                self.evict(cachedHead)
+                continue
+            if GIT_BACKEND.isAncestor(self.module.path, cachedHead, head):
+                ancestors.append(cachedHead)
+
+        sizes = self.statHeads(os.path.getsize, ancestors)
+        if not sizes:
+            return None
+        return max(sizes, key=operator.itemgetter(1))[0]
+
+class ReachableCommits:
+    """
+    The set of all commits reachable from the head of a module. It's listed once by a single `git rev-list`
+    and then answers every membership query in O(1).
+    With a cache, only the commits added since the closest cached ancestor of the head are listed.
+    """
+    def __init__(self, module, cache=None):
+        self.module = module
+        startTime = time.time()
+
+        self.commits = cache.load(module.head) if cache else None
+        if self.commits is None:
+            base = cache.closestAncestorOf(module.head) if cache else None
+            self.commits = cache.load(base) if base else set()
+            self.commits.update(self.listCommits(module, module.head, base))
+            if cache:
+                cache.store(module.head, self.commits)
+
+        self.listingTime = time.time() - startTime
+        logDebug("{0} commits reachable from {1} in {2} found in {3:.3f}s".format(
+            len(self.commits), module.head, module.path, self.listingTime))
+
+    def listCommits(self, module, head, excludedHead=None):
+        commits = GIT_BACKEND.listCommits(module.path, head, excludedHead)
+        logDebug("{0}: {1} commits listed from {2}{3}".format(module.path, len(commits), head,
+                                                              " excluding " + excludedHead if excludedHead else ""))
+        return commits
+
+    def __contains__(self, revision):
+        return revision in self.commits
+
+def findReachableCommits(module, reachableCommits, useCache=False):
+    """
+    Returns the ReachableCommits of the head of the module collected in reachableCommits, listing them if they aren't.
+    """
+    moduleHead = (module.path, module.head)
+    commits = reachableCommits.get(moduleHead)
+    if commits is None:
+        commits = reachableCommits[moduleHead] = ReachableCommits(module, ReachabilityCache(module) if useCache else None)
+    return commits
+
+def verifyReachability(revisions, bulk=True, useCache=False, reachableCommits=None):
     """
     Checks if the revision is reachable from the head of its module.
+    In bulk mode the history of each module is listed once, otherwise each revision is checked by its own git process.
+    The bulk mode may persist the listed histories in the modules' git dirs to extend them incrementally on later runs.
+    The listed histories are collected in reachableCommits by (module path, head), so they may be shared by subsequent calls.
     """
-    for issueKey, revSpecifiers in revisions.iteritems():
-        for rev in revSpecifiers:
-            if rev.module:
-                _, isReachable = execCommand("git merge-base --is-ancestor {0} {1}".format(rev.revision, rev.module.head), isQuery = True, cwd=rev.module.path)
-                rev.isReachable = not isReachable  # invert shell's 0 for True
-                if rev.isReachable:
-                    logDebug(issueKey + " is reachable at " + rev.revision + " in " + rev.module.url)
-                    
+    startTime = time.time()
+    reachableCommits = reachableCommits if reachableCommits is not None else {}
+    checksCount = 0
+    for issueIndex, issueKey in enumerate(revisions.issueKeys):
+        for row in revisions.rowsOf(issueIndex):
+            module = revisions.module(row)
+            if module:
+                checksCount += 1
+                revision = revisions.revision(row)
+                if bulk:
+                    isReachable = revision in findReachableCommits(module, reachableCommits, useCache)
+                else:
+                    isReachable = GIT_BACKEND.isAncestor(module.path, revision, module.head)
+                revisions.setReachable(row, isReachable)
+                if isReachable:
+                    logDebug(issueKey + " is reachable at " + revision + " in " + module.url)
+
+    logDebug("Reachability of {0} revisions checked in {1:.3f}s ({2} mode)".format(
+        checksCount, time.time() - startTime, "bulk" if bulk else "per-revision"))
     return revisions
 
-def getGitModules(pathToRepo, revision, outModules=[]):
-    logDebug("Found module '" + pathToRepo + "' in rev " + revision)
+def findOldHeads(modules, oldRevision):
+    """
+    Returns the map of each of the modules to the head it had at the old revision of the root, the first of the modules.
+    A submodule moved to another path is matched with its old path by its old head being found in its repository.
+    The head is None if the module has been added since or its old head is missing, e.g. it's another repository now.
+    """
+    oldHeads = {}
+    pending = [(modules[0], oldRevision)]
+    while pending:
+        module, oldHead = pending.pop()
+        if oldHead and oldHead != module.head and not findExistingCommits(module, [oldHead])[oldHead]:
+            oldHead = None
+        oldHeads[module] = oldHead
 
-    repoURL, _ = execCommand("git config --local --get remote.origin.url", isQuery=True, cwd=pathToRepo)
-    outModules.append(GitModule(repoURL, pathToRepo, revision))
-    
-    submodulesStr, _ = execCommand('git config -f .gitmodules --get-regexp ^submodule.*path$', isQuery=True, cwd=pathToRepo)
-    submodules = [os.path.join(pathToRepo, kvPair.split(' ', 1)[1]) for kvPair in submodulesStr.split('\n')] if submodulesStr else []
-    for modulePath in submodules:
-        moduleInfo, _ = execCommand('git ls-tree {0} {1}'.format(revision, modulePath), isQuery=True, cwd=pathToRepo)
-        moduleRevision = re.match('\\d+ commit (?P<revision>.{40})\t', moduleInfo).group('revision')
-        getGitModules(modulePath, moduleRevision, outModules)
+        oldSubmodules = dict((os.path.join(module.path, path), rev)
+                             for path, rev in GIT_BACKEND.readSubmodules(module.path, oldHead)) if oldHead else {}
+        removedSubmodules = [rev for path, rev in oldSubmodules.iteritems()
+                             if path not in set(submodule.path for submodule in module.submodules)]
+        for submodule in module.submodules:
+            submoduleOldHead = oldSubmodules.get(submodule.path)
+            if submoduleOldHead is None and removedSubmodules:
+                existence = findExistingCommits(submodule, removedSubmodules)
+                movedFrom = [rev for rev in removedSubmodules if existence[rev]]
+                submoduleOldHead = movedFrom[0] if movedFrom else None
+            pending.append((submodule, submoduleOldHead))
+    return oldHeads
 
-    return outModules
+def verifyReachabilitySince(revisions, oldHeads, addedCommits=None):
+    """
+    Marks as reachable only the revisions added to their modules since the old heads. Only the commits added are listed,
+    so the cost depends on the size of the change. The issues having some revision reachable from the old heads
+    get none of their revisions marked as they've been reachable already.
+    The commits added are collected in addedCommits by module, so they may be shared by subsequent calls.
+    """
+    addedCommits = addedCommits if addedCommits is not None else {}
+    for issueIndex, issueKey in enumerate(revisions.issueKeys):
+        rows = revisions.rowsOf(issueIndex)
+        for row in rows:
+            module = revisions.module(row)
+            if module:
+                if module not in addedCommits:
+                    oldHead = oldHeads[module]
+                    commits = GIT_BACKEND.listCommits(module.path, module.head, oldHead) if oldHead != module.head else []
+                    logDebug("{0}: {1} commits added since {2}".format(module.path, len(commits), oldHead))
+                    addedCommits[module] = set(commits)
+                revisions.setReachable(row, revisions.revision(row) in addedCommits[module])
 
-def calculateIssuesReachability(jiraClient, issuesQuery, fieldsToSearchIn, repositoryPath, revision):
-    repoRootPath, _ = execCommand('git rev-parse --show-toplevel', isQuery=True, cwd=repositoryPath)
-    revision, _ = execCommand("git rev-parse {0}".format(revision), isQuery=True, cwd=repoRootPath)
+        if any(revisions.isReachable(row) for row in rows):
+            wasReachable = any(GIT_BACKEND.isAncestor(module.path, revisions.revision(row), oldHeads[module])
+                               for row, module in ((row, revisions.module(row)) for row in rows)
+                               if module and not revisions.isReachable(row) and oldHeads[module])
+            if wasReachable:
+                logDebug(issueKey + " has been reachable already")
+                for row in rows:
+                    revisions.setReachable(row, False)
+    return revisions
+
+def loadTicketIdPattern():
+    """
+    Returns the pattern of the issue keys the commit-msg hook puts into commit messages.
+    """
+    hookPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "git", "hooks", "commit-msg")
+    hookGlobals = {'__name__': 'commit-msg'}
+    execfile(hookPath, hookGlobals)
+    return hookGlobals['ticketIdPattern']
+
+class CommitIssueIndex:
+    """
+    Maps the commits of a module to the issue keys mentioned in their messages and back.
+    It's kept in `<git dir>/jira-find/issues.json` as a segment of commits per head indexed: the commits mentioning
+    some issue which were reachable from the head but from none of the heads indexed before. Indexing a new head
+    reads the messages of only the commits of its segment. The segments of the heads it descends from are merged
+    into its own, and the segments of the heads dropped past MAX_HEADS are dropped along, so the index stays bounded.
+    The commits of a dropped segment are then just unknown to the index.
+    """
+    MAX_HEADS = 16
+
+    def __init__(self, module, ticketIdPattern):
+        self.module = module
+        self.pattern = re.compile(ticketIdPattern)
+        self.path = os.path.join(GIT_BACKEND.gitDir(module.path), "jira-find", "issues.json")
+        self.segments = []  # [head, {SHA: issue keys}], the least recently indexed heads first
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as indexFile:
+                index = json.load(indexFile)
+            if index['pattern'] == ticketIdPattern and 'segments' in index:
+                self.segments = index['segments']
+
+    def heads(self):
+        return [head for head, _ in self.segments]
+
+    def update(self, head):
+        if head in self.heads():
+            return
+        startTime = time.time()
+        existence = findExistingCommits(self.module, self.heads())
+        segments = [segment for segment in self.segments if existence[segment[0]]]  # e.g. rebased away
+        messages = GIT_BACKEND.commitMessages(self.module.path, head, [indexedHead for indexedHead, _ in segments])
+        commits = {}
+        for sha, message in messages:
+            keys = []
+            for key in self.pattern.findall(message):
+                if key.upper() not in keys:
+                    keys.append(key.upper())
+            if keys:
+                commits[sha] = keys
+        logDebug("{0}: {1} commit messages indexed in {2:.3f}s".format(self.module.path, len(messages), time.time() - startTime))
+
+        # the heads reachable from the new one add nothing to it but their segments
+        remaining = []
+        for indexedHead, indexedCommits in segments:
+            if GIT_BACKEND.isAncestor(self.module.path, indexedHead, head):
+                commits.update(indexedCommits)
+            else:
+                remaining.append([indexedHead, indexedCommits])
+        self.segments = remaining[-(self.MAX_HEADS - 1):] + [[head, commits]]
+        self.save()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        import tempfile
+        fd, tempPath = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        with os.fdopen(fd, 'w') as indexFile:
+            json.dump({'pattern': self.pattern.pattern, 'segments': self.segments}, indexFile)
+        os.rename(tempPath, self.path)
+
+    def issueCommits(self, reachableCommits):
+        """
+        Returns the map of each issue key to the commits mentioning it among the reachable commits given,
+        so that the commits of the other heads indexed, e.g. of divergent branches, are left out.
+        """
+        issueCommits = {}
+        for _, commits in self.segments:
+            for sha, keys in commits.iteritems():
+                if sha in reachableCommits:
+                    for key in keys:
+                        issueCommits.setdefault(key, []).append(sha)
+        return issueCommits
+
+def indexIssueCommits(modules, jobs=1, reachableCommits=None, useCache=False):
+    """
+    Returns the map of each issue key to the commits mentioning it in the histories of the heads of the modules.
+    The histories are listed as by verifyReachability and collected in reachableCommits, so it may reuse them.
+    """
+    ticketIdPattern = loadTicketIdPattern()
+    reachableCommits = reachableCommits if reachableCommits is not None else {}
+
+    def indexModule(module):
+        index = CommitIssueIndex(module, ticketIdPattern)
+        index.update(module.head)
+        return index.issueCommits(findReachableCommits(module, reachableCommits, useCache))
+
+    issueCommits = {}
+    for moduleIssueCommits in iterateConcurrently(indexModule, modules, jobs):
+        for key, commits in moduleIssueCommits.iteritems():
+            issueCommits.setdefault(key, []).extend(commits)
+    return issueCommits
+
+def readGitModule(pathToRepo, revision):
+    """
+    Reads the module along with the paths and revisions of its submodules as they are in the given revision.
+    """
+    module = GitModule(GIT_BACKEND.remoteURL(pathToRepo), pathToRepo, revision)
+    submodules = [(os.path.join(pathToRepo, path), rev) for path, rev in GIT_BACKEND.readSubmodules(pathToRepo, revision)]
+    return module, submodules
+
+class LRUCache:
+    """
+    A thread-safe mapping keeping only the given number of the most recently used items.
+    """
+    def __init__(self, maxItems, onEvict=None):
+        self.maxItems = maxItems
+        self.onEvict = onEvict  # called with each item evicted
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+            value = self.items.pop(key)
+            self.items[key] = value  # most recently used go last
+            return value
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        evicted = []
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.maxItems:
+                evicted.append(self.items.popitem(last=False)[1])
+        if self.onEvict:
+            for evictedValue in evicted:
+                self.onEvict(evictedValue)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def values(self):
+        with self.lock:
+            return self.items.values()
+
+gitModulesCache = LRUCache(32)
+gitModulesCacheLock = threading.Lock()
+
+def getGitModules(pathToRepo, revision, jobs=1):
+    """
+    Returns the module of the repository followed by all its submodules, recursively, in depth-first order.
+    The modules of each level of the hierarchy are read concurrently. The result is cached by (repo, revision).
+    """
+    cacheKey = (os.path.abspath(pathToRepo), revision)
+    with gitModulesCacheLock:
+        if cacheKey in gitModulesCache:
+            return list(gitModulesCache[cacheKey])
+
+    root = None
+    pending = [(None, pathToRepo, revision)]
+    while pending:
+        nextPending = []
+        readModule = lambda pendingModule: (pendingModule[0], readGitModule(*pendingModule[1:]))
+        for parent, (module, submodules) in iterateConcurrently(readModule, pending, jobs):
+            logDebug("Found module '" + module.path + "' in rev " + module.head)
+            if parent:
+                parent.submodules.append(module)
+            else:
+                root = module
+            nextPending.extend((module, path, rev) for path, rev in submodules)
+        pending = nextPending
+
+    modules = []
+    pendingModules = [root]
+    while pendingModules:
+        module = pendingModules.pop()
+        modules.append(module)
+        pendingModules.extend(reversed(module.submodules))
+
+    with gitModulesCacheLock:
+        gitModulesCache[cacheKey] = modules
+    return list(modules)
+
+def iterateBatches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iterateIssuesReachability(jiraClient, issuesQuery, fieldsToSearchIn, repositoryPath, revision, jobs=1, pageSize=128,
+                              useCache=True, snapshotPath=None, extractor=None, reachableCommits=None, sinceRevision=None,
+                              useIndex=False, shard=None):
+    """
+    Yields verified revisions of the issues in batches. Each batch is verified as soon as its issues are fetched.
+    The reachable commits listed may be shared with other calls through reachableCommits.
+    With sinceRevision, only the revisions added since that revision of the root are reachable.
+    With useIndex, the issues are looked up in the commit messages of the modules first, and JIRA is asked
+    for the commits of only the issues mentioned in none.
+    With shard, a (index, count) pair, only the issues of that shard are checked, see isInShard.
+    """
+    with measurePhase("modules"):
+        if not os.path.isdir(repositoryPath):
+            raise RepositoryError("No directory " + repositoryPath)
+        repoRootPath, returnCode = execCommand('git rev-parse --show-toplevel', isQuery=True, cwd=repositoryPath)
+        if returnCode:
+            raise RepositoryError("No git repository at " + repositoryPath)
+        revision = resolveCommit(repoRootPath, revision)
+        if sinceRevision:
+            sinceRevision = resolveCommit(repoRootPath, sinceRevision)
 
     logDebug('repo: {0} revision: {1}'.format(repoRootPath, revision))
 
-    fields = getFieldIDs(jiraClient, fieldsToSearchIn)
-    issues = getAllIssues(jiraClient, issuesQuery, set(['summary', 'resolution'] + fields))
-    revisions = findRevisionsSpecified(jiraClient, issues, fields)
+    with measurePhase("fields"):
+        fields = getFieldIDs(jiraClient, fieldsToSearchIn)
+    searchFields = fields or ['key']  # no fields would mean all of them
+    extractor = extractor or RevisionExtractor()
+    if snapshotPath:
+        issues = iterateIssuesIncrementally(jiraClient, issuesQuery, searchFields, snapshotPath, pageSize, jobs, extractor)
+    else:
+        issues = iterateIssues(jiraClient, issuesQuery, searchFields, pageSize, jobs, extractor.slimIssue)
+    if shard:
+        issues = (issue for issue in issues if isInShard(issue['key'], shard))
 
-    gitModules = getGitModules(repoRootPath, revision)
+    with measurePhase("modules"):
+        gitModules = getGitModules(repoRootPath, revision, jobs)
+        oldHeads = findOldHeads(gitModules, sinceRevision) if sinceRevision else None
+        reachableCommits = reachableCommits if reachableCommits is not None else {}
+        indexedCommits = indexIssueCommits(gitModules, jobs, reachableCommits, useCache) if useIndex else None
 
-    verifiedRevisions = verifyRevisions(revisions, gitModules)
-    verifiedRevisions = verifyReachability(revisions)
+    knownRevisions = {}
+    addedCommits = {}
+    batches = iterateBatches(iterateRevisionsSpecified(jiraClient, issues, fields, jobs, extractor, indexedCommits), pageSize)
+    if STATS:
+        batches = STATS.measureIteration("search", batches)  # waiting for both the search pages and dev-status
+    for batch in batches:
+        revisions = RevisionTable(batch)
+        with measurePhase("verification"):
+            verifyRevisions(revisions, gitModules, knownRevisions)
+        with measurePhase("reachability"):
+            if oldHeads:
+                verifyReachabilitySince(revisions, oldHeads, addedCommits)
+            else:
+                verifyReachability(revisions, useCache=useCache, reachableCommits=reachableCommits)
+        yield revisions
 
+def calculateIssuesReachability(jiraClient, issuesQuery, fieldsToSearchIn, repositoryPath, revision, jobs=1, pageSize=128,
+                                useCache=True, snapshotPath=None, extractor=None, sinceRevision=None, useIndex=False,
+                                shard=None):
+    verifiedRevisions = RevisionTable()
+    for revisions in iterateIssuesReachability(jiraClient, issuesQuery, fieldsToSearchIn, repositoryPath, revision,
+                                               jobs, pageSize, useCache, snapshotPath, extractor,
+                                               sinceRevision=sinceRevision, useIndex=useIndex, shard=shard):
+        verifiedRevisions.extend(revisions)
     return verifiedRevisions
 
-def filterReachables(revisions):
-    reachables = {}
-    for issueKey, revSpecifiers in revisions.iteritems():
-        for rev in revSpecifiers:
-            if rev.module and rev.isReachable:
-                reachables[issueKey] = revSpecifiers
+def parseShard(text):
+    """
+    Parses "i/N", i from 1 to N, into the zero-based (index, count) pair. Returns None if it's malformed.
+    """
+    match = re.match(r"^(\d+)/(\d+)$", text or "")
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        return None
+    return int(match.group(1)) - 1, int(match.group(2))
+
+def isInShard(issueKey, shard):
+    """
+    Tells if the issue belongs to the shard. The issues are spread over the shards by a hash of their keys,
+    so every shard gets about as many issues whatever the key ranges of the query are.
+    """
+    index, count = shard
+    return (zlib.crc32(issueKey) & 0xffffffff) % count == index
+
+def checkShard(params, shard):
+    """
+    Checks the issues of the shard in a process of its own. The params are those of calculateIssuesReachability
+    except the JIRA client, which is created from the endpoint, the credentials and the response cache path given.
+    Returns the issues found as printed by printIssuesReachability.
+    """
+    global GIT_BACKEND
+    GIT_BACKEND = gitbackend.BACKENDS[params['gitBackend']]()  # processes of the parent's backend can't be shared
+    jiraClient = makeClient(params['endpoint'], params['user'], params['jobs'], params['maxRate'], params['timeout'],
+                            params['httpCache'])
+    try:
+        revisions = calculateIssuesReachability(jiraClient, params['query'], params['searchIn'], params['repository'],
+                                                params['revision'], params['jobs'], params['pageSize'], params['useCache'],
+                                                None, RevisionExtractor(params['abbreviated']), params['since'],
+                                                params['index'], shard)
+        return issuesReachabilityJSON(filterIssues(revisions, params['orphants'], params['unreachable']), params['endpoint'])
+    finally:
+        jiraClient.close()
+        GIT_BACKEND.close()
+
+def checkShardOfParams(paramsAndShard):
+    return checkShard(*paramsAndShard)
+
+def iterateShardsInParallel(params, count):
+    """
+    Checks all the shards in a pool of processes. Yields the issues found by each shard as soon as it's done.
+    """
+    import multiprocessing
+    pool = multiprocessing.Pool(count)
+    try:
+        for issuesJSON in pool.imap_unordered(checkShardOfParams, [(params, (index, count)) for index in xrange(count)]):
+            yield issuesJSON
+    finally:
+        pool.close()
+        pool.join()
+
+def classifyIssues(revisions):
+    """
+    Sorts the issues of the table out in a single pass over its columns. Returns the indices of the reachable issues,
+    i.e. having some valid revision reachable, of the unreachable ones and of the orphants, i.e. having no valid revision.
+    The orphants are unreachable too.
+    """
+    reachables, unreachables, orphants = array.array('l'), array.array('l'), array.array('l')
+    moduleIndices, reachableBits, rowStarts = revisions.moduleIndices, revisions.reachableBits, revisions.issueRowStarts
+    for issueIndex in xrange(len(revisions)):
+        hasValidRevisions = isReachable = False
+        for row in xrange(rowStarts[issueIndex], rowStarts[issueIndex + 1]):
+            if moduleIndices[row] != RevisionTable.NO_MODULE:
+                hasValidRevisions = True
+                if reachableBits[row >> 3] & (1 << (row & 7)):
+                    isReachable = True
+                    break
 
-    logDebug("Reachables: " + str(reachables))
+        if isReachable:
+            reachables.append(issueIndex)
+        else:
+            unreachables.append(issueIndex)
+            if not hasValidRevisions:
+                orphants.append(issueIndex)
+    return reachables, unreachables, orphants
+
+def filterReachables(revisions):
+    reachables = revisions.select(classifyIssues(revisions)[0])
+    if runtime.DEBUG:
+        logDebug("Reachables: " + ", ".join(reachables))
     return reachables
 
 def filterUnreachables(revisions):
-    unreachables = {}
-    for issueKey, revSpecifiers in revisions.iteritems():
-        issueIsReachable = False
-        for rev in revSpecifiers:
-            if rev.module and rev.isReachable:
-                issueIsReachable = True
-                break
-
-        if not issueIsReachable:
-            unreachables[issueKey] = revSpecifiers
-            
-    logDebug("Unreachables: " + str(unreachables))
+    unreachables = revisions.select(classifyIssues(revisions)[1])
+    if runtime.DEBUG:
+        logDebug("Unreachables: " + ", ".join(unreachables))
     return unreachables
 
 def filterOrphants(revisions):
-    orphants = {}
-    for issueKey, revSpecifiers in revisions.iteritems():
-        hasValidRevisions = False
-        for rev in revSpecifiers:
-            if rev.module:
-                hasValidRevisions = True
-                break
-        
-        if not hasValidRevisions:
-            orphants[issueKey] = revSpecifiers
-            logDebug(issueKey + " is an orphant")
-            
+    orphants = revisions.select(classifyIssues(revisions)[2])
+    for issueKey in orphants:
+        logDebug(issueKey + " is an orphant")
     return orphants
 
-def execCommand(command, cwd='.', isQuery=False, raw=False):
-    stdout = sp.PIPE if isQuery else sys.stdout
-    stderr = open(os.devnull, 'w') if isQuery else sys.stderr
-    p = sp.Popen(command, shell=True, cwd=cwd, stdout=stdout, stderr=stderr, stdin=sys.stdin)
-    out, _ = p.communicate()
-    if not raw:
-        out = out.strip()
-    logDebug(cwd + " $ " + command + " -> " + str(p.returncode) + ": " + out)
-    return out, p.returncode
-
-def logDebug(msg):
-    if DEBUG:
-        for line in msg.split('\n'):
-            sys.stderr.write("[DEBUG] " + line + "\n")
-
-def printIssuesReachability(reachables, jiraEndpoint):
+def filterIssues(revisions, orphants=False, unreachable=False):
+    reachableIssues, unreachableIssues, orphantIssues = classifyIssues(revisions)
+    logDebug("{0} reachable, {1} unreachable, {2} orphant issues".format(
+        len(reachableIssues), len(unreachableIssues), len(orphantIssues)))
+    if unreachable:
+        return revisions.select(unreachableIssues)
+    if orphants:
+        return revisions.select(orphantIssues)
+    return revisions.select(reachableIssues)
+
+def issuesReachabilityJSON(reachables, jiraEndpoint):
     reachablesJSON = []
-    for issueKey, revSpecifiers in reachables.iteritems():
-        for rev in revSpecifiers:
+    for issueIndex, issueKey in enumerate(reachables.issueKeys):
+        for row in reachables.rowsOf(issueIndex):
+            module = reachables.module(row)
             reachablesJSON.append({
                 'key': issueKey,
                 'endpoint': jiraEndpoint,
-                'revision': rev.revision,
-                'repository': rev.module.url if rev.module else None})
-    print json.dumps(reachablesJSON)
+                'revision': reachables.revision(row),
+                'repository': module.url if module else None})
+    return reachablesJSON
 
-if __name__ == '__main__':
-    opt_parser = OptionParser(usage="%prog [options] JIRA_ENDPOINT JIRA_QUERY [GIT_REPO_PATH]",
+def printIssuesReachability(reachables, jiraEndpoint, streaming=False):
+    """
+    Prints the issues as a JSON array or, when streaming, as one JSON object per line.
+    """
+    printIssuesReachabilityJSON(issuesReachabilityJSON(reachables, jiraEndpoint), streaming)
+
+def printIssuesReachabilityJSON(reachablesJSON, streaming=False):
+    if streaming:
+        for issueJSON in reachablesJSON:
+            sys.stdout.write(json.dumps(issueJSON) + "\n")
+        sys.stdout.flush()
+    else:
+        print json.dumps(reachablesJSON)
+
+def mergeIssuesReachability(partialResults):
+    """
+    Merges the issues found by the shards into the list printIssuesReachability would print for all of them at once:
+    the revisions of each issue are listed together, the ones found by more than one shard only once.
+    """
+    revisionsOfIssues = {}
+    for issuesJSON in partialResults:
+        for issueJSON in issuesJSON:
+            revisions = revisionsOfIssues.setdefault(issueJSON['key'], [])
+            if issueJSON not in revisions:
+                revisions.append(issueJSON)
+    return [issueJSON for revisions in revisionsOfIssues.itervalues() for issueJSON in revisions]
+
+def queryServer(address, args, opts):
+    """
+    Prints the answer of the server to the query given by the command line. Returns False if there's no server.
+    """
+    request = {'endpoint': args[0], 'query': args[1], 'repository': os.path.abspath(args[2] if len(args) > 2 else '.'),
+               'searchIn': opts.search_in, 'abbreviated': opts.abbreviated, 'revision': opts.revision,
+               'unreachable': opts.unreachable, 'orphants': opts.orphants, 'noCache': opts.no_cache,
+               'incremental': os.path.abspath(opts.incremental) if opts.incremental else None,
+               'since': opts.since, 'index': opts.index, 'shard': opts.shard, 'user': opts.user, 'jobs': opts.jobs,
+               'pageSize': opts.page_size}
+    try:
+        issuesJSON = queryReachabilityServer(address, request)
+    except socket.error as e:
+        sys.stderr.write("No reachability server at {0} ({1}), checking here\n".format(address, e))
+        return False
+
+    if opts.stream:
+        for issueJSON in issuesJSON:
+            sys.stdout.write(json.dumps(issueJSON) + "\n")
+            sys.stdout.flush()
+    else:
+        print json.dumps(list(issuesJSON))
+    return True
+
+class ReachabilityServer:
+    """
+    Answers reachability queries of many clients keeping JIRA clients, module trees and reachable commits warm
+    between them. Only the reachable commits of the most recently queried heads are kept in memory.
+    A query is a JSON object of the jira-find arguments, the answer streams the issues found one JSON object per line.
+    The snapshots of incremental queries are kept in the server's own directory, if any, named after the path
+    the client gives, so that no client may have the server write elsewhere.
+    """
+    MAX_HEADS = 64
+    MAX_CLIENTS = 16
+
+    def __init__(self, jobs=1, httpCachePath=None, maxHeads=MAX_HEADS, maxRate=None, timeout=10, snapshotsPath=None,
+                 maxClients=MAX_CLIENTS):
+        self.jobs = jobs
+        self.maxRate = maxRate
+        self.timeout = timeout
+        self.snapshotsPath = snapshotsPath
+        if snapshotsPath and not os.path.isdir(snapshotsPath):
+            os.makedirs(snapshotsPath)
+        self.clients = LRUCache(maxClients, onEvict=lambda client: client.close())  # a client per credentials
+        self.clientsLock = threading.Lock()
+        # shared by all the clients, the cached responses are keyed by the credentials they were fetched with
+        self.responseCache = jira.ResponseCache(httpCachePath)
+        self.reachableCommits = LRUCache(maxHeads)
+        self.queriesCount = 0
+
+    def clientFor(self, endpoint, user):
+        with self.clientsLock:
+            key = (endpoint, user)
+            client = self.clients.get(key)
+            if client is None:
+                client = self.clients[key] = makeClient(endpoint, user, self.jobs, self.maxRate, self.timeout,
+                                                        cache=self.responseCache)
+            return client
+
+    def snapshotPathFor(self, clientPath):
+        """
+        Returns the path of the snapshot the client names by the path given, None if the server keeps no snapshots.
+        """
+        if not clientPath or not self.snapshotsPath:
+            return None
+        import hashlib
+        return os.path.join(self.snapshotsPath, hashlib.sha1(clientPath.encode("utf-8")).hexdigest() + ".json")
+
+    def query(self, request):
+        with self.clientsLock:
+            self.queriesCount += 1
+        endpoint = request['endpoint']
+        client = self.clientFor(endpoint, request.get('user'))
+        extractor = RevisionExtractor(request.get('abbreviated'))
+        for revisions in iterateIssuesReachability(client, request['query'], request.get('searchIn') or ['comment'],
+                                                   request.get('repository', '.'), request.get('revision', 'HEAD'),
+                                                   min(request.get('jobs', 1), self.jobs), request.get('pageSize', 128),
+                                                   not request.get('noCache'), self.snapshotPathFor(request.get('incremental')), extractor,
+                                                   self.reachableCommits, request.get('since'), request.get('index'),
+                                                   parseShard(request.get('shard'))):
+            for issueJSON in issuesReachabilityJSON(filterIssues(revisions, request.get('orphants'),
+                                                                 request.get('unreachable')), endpoint):
+                yield issueJSON
+
+    def stats(self):
+        with self.clientsLock:
+            clients = self.clients.values()
+            queriesCount = self.queriesCount
+        return {'queries': queriesCount, 'heads': len(self.reachableCommits), 'moduleTrees': len(gitModulesCache),
+                'connections': [stats for client in clients for stats in client.connectionStats()],
+                'schedulers': [client.schedulerStats() for client in clients],
+                'responseCache': self.responseCache.stats()}
+
+    def close(self):
+        with self.clientsLock:
+            clients = self.clients.values()
+        for client in clients:
+            client.cache = None  # saved once below rather than by each client
+            client.close()
+        self.responseCache.save()
+
+    def serve(self, address):
+        """
+        Serves HTTP on the Unix socket if the address is a path, otherwise on the [host:]port given.
+        """
+        import BaseHTTPServer
+        import SocketServer
+        reachabilityServer = self
+
+        class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        class UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+            daemon_threads = True
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if "/stats" != self.path:
+                    return self.send_error(404)
+                self.respond("application/json", [reachabilityServer.stats()])
+
+            def do_POST(self):
+                if "/reachability" != self.path:
+                    return self.send_error(404)
+                request = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+                logDebug("Query: " + json.dumps(dict(request, user=None)))
+                self.respond("application/x-ndjson", reachabilityServer.query(request))
+
+            def respond(self, contentType, objects):
+                # HTTP/1.0, the end of the answer is told by closing the connection
+                self.send_response(200)
+                self.send_header("Content-Type", contentType)
+                self.end_headers()
+                try:
+                    for obj in objects:
+                        self.wfile.write(json.dumps(obj) + "\n")
+                        self.wfile.flush()
+                except Exception as e:
+                    logDebug("Query failed: " + repr(e))
+                    self.wfile.write(json.dumps({'error': repr(e)}) + "\n")
+
+            def address_string(self):
+                return str(self.client_address)
+
+            def log_message(self, format, *args):
+                logDebug(format % args)
+
+        if '/' in address:
+            if os.path.exists(address):
+                os.remove(address)  # left by a previous server
+            server = UnixHTTPServer(address, Handler)
+            os.chmod(address, 0600)  # only the user of the server may query it
+        else:
+            host, _, port = address.rpartition(':')
+            server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+def queryReachabilityServer(address, request):
+    """
+    Sends the query to the server and returns a generator of the issues answered as they arrive.
+    Raises socket.error if there's no server at the address.
+    """
+    import httplib
+
+    class UnixHTTPConnection(httplib.HTTPConnection):
+        def __init__(self, path, timeout=None):
+            httplib.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+            self.path = path
+
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.path)
+
+    if '/' in address:
+        connection = UnixHTTPConnection(address)
+    else:
+        host, _, port = address.rpartition(':')
+        connection = httplib.HTTPConnection(host or "127.0.0.1", int(port))
+    try:
+        connection.request("POST", "/reachability", json.dumps(request), {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        if 200 != response.status:
+            raise Exception("Reachability server responded {0} {1}".format(response.status, response.reason))
+    except:
+        connection.close()
+        raise
+    return iterateServerAnswer(connection, response)
+
+def iterateServerAnswer(connection, response):
+    try:
+        for line in iter(response.fp.readline, ''):
+            issueJSON = json.loads(line)
+            if 'error' in issueJSON:
+                raise Exception("Reachability server failed: " + issueJSON['error'])
+            yield issueJSON
+    finally:
+        connection.close()
+
+def makeClient(endpoint, user=None, jobs=1, maxRate=None, timeout=10, httpCachePath=None, cache=None):
+    """
+    Returns a JIRA client logged in with the USER:PWD credentials, if any, making up to jobs requests at once.
+    The responses are cached in the given ResponseCache or in a new one kept in the file at httpCachePath.
+    """
+    credentials = user.split(":", 1) if user else [None, None]
+    if cache is None and httpCachePath:
+        cache = jira.ResponseCache(httpCachePath)
+    return jira.JIRA(endpoint, credentials[0], credentials[1] if len(credentials) > 1 else None, timeout=timeout,
+                     maxIdleConnections=max(4, jobs), maxConcurrentRequests=jobs, maxRequestsPerSecond=maxRate, cache=cache)
+
+def setUpDebugging(debug, stats=None):
+    """
+    Directs the debug output of all the modules to stderr if debug is set and the stats of their calls to stats if given.
+    """
+    runtime.DEBUG = debug
+    if stats:
+        jira.STATS_FUNC = stats.recordHTTP
+        gitbackend.STATS_FUNC = stats.recordGit
+        runtime.STATS_FUNC = stats.recordGit
+    if debug:
+        jira.DEBUG_FUNC = logDebug
+        gitbackend.DEBUG_FUNC = logDebug
+        recordHTTP = jira.STATS_FUNC
+        def logCallStats(callStats):
+            if recordHTTP:
+                recordHTTP(callStats)
+            logDebug("Call stats: " + json.dumps(callStats))
+        jira.STATS_FUNC = logCallStats
+
+def logClientStats(client):
+    logDebug("Connection stats: " + json.dumps(client.connectionStats()))
+    logDebug("Scheduler stats: " + json.dumps(client.schedulerStats()))
+    if client.cache:
+        logDebug("Response cache stats: " + json.dumps(client.cache.stats()))
+
+def main(argv=None, prog=None):
+    global GIT_BACKEND, STATS
+    from optparse import OptionParser
+    opt_parser = OptionParser(usage="%prog [options] JIRA_ENDPOINT JIRA_QUERY [GIT_REPO_PATH]\n"
+                                    "       %prog [options] --serve ADDRESS\n"
+                                    "       %prog [options] --merge [PARTIAL_RESULT...]",
                               description="Lists issues resolved for the given git revision."
                               " Lists only issues matching given JQL query."
                               " The result is in JSON format. Use git-jira-format to get human-readable form.")
+    opt_parser.prog = prog  # as run by devtools
     opt_parser.add_option("--search-in", action="append", default=[], metavar="FIELD",
                           help="A ticket field where revision ID should be searched for. This could be field id or field name."
                           " E.g. comment, My Custom Field, customfield_10202.")
+    opt_parser.add_option("--abbreviated", action="store", type="int", default=None, metavar="LENGTH",
+                          help="Also search for abbreviated revision IDs of at least the given length, e.g. 7.")
     opt_parser.add_option("--revision", action="store", default="HEAD", metavar="GIT_REF",
                           help="A revison of the root repository against which all the checks should be performed."
                           " The submodules will be checked against revisions they had in this revision of the root.")
     
+    opt_parser.add_option("--since", action="store", default=None, metavar="GIT_REF",
+                          help="Search only tickets that became reachable since the given revision of the root repository,"
+                          " e.g. the previous release. Only the commits added since then to the root and each submodule"
+                          " are listed, including submodules added or moved.")
     opt_parser.add_option("--unreachable", action="store_true", default=False,
                           help="Search tickets that are valid but not reachable from the given repository head."
                           " Useful in finding tickets that have their Fix Version/s set to some version"
@@ -226,15 +1752,123 @@ if __name__ == '__main__':
                           help="Search tickets with no valid git revision specified."
                           " Useful with 'resolution = Fixed or resolution = Complete' criteria.")
     
+    opt_parser.add_option("--stream", action="store_true", default=False,
+                          help="Print each issue as a separate JSON object per line as soon as it's checked"
+                          " instead of a single JSON array at the end.")
+    opt_parser.add_option("--index", action="store_true", default=False,
+                          help="Look for the tickets in the commit messages first, as put there by the commit-msg hook,"
+                          " and ask JIRA for the commits of only the tickets mentioned in none. The messages are indexed"
+                          " in the git dir of each module and only the new commits are read on later runs.")
+    opt_parser.add_option("--no-cache", action="store_true", default=False,
+                          help="Don't use or update the reachability cache kept in the git dir of each module.")
+    opt_parser.add_option("--git-backend", action="store", type="choice", choices=sorted(gitbackend.BACKENDS), default="process",
+                          help="How git objects are accessed: 'process' keeps a git cat-file process per module,"
+                          " 'native' reads packs in-process, 'shell' runs a shell command per query. Default is 'process'.")
+
+    opt_parser.add_option("--http-cache", action="store", default=None, metavar="FILE",
+                          help="Keep JIRA responses in the given file and reuse or revalidate them on later runs.")
+    opt_parser.add_option("--incremental", action="store", default=None, metavar="FILE",
+                          help="Keep the found issues in the given file and only fetch the issues updated since the previous run."
+                          " With --serve, the directory the server keeps the snapshots of such queries in, they aren't"
+                          " kept without it.")
+
     opt_parser.add_option("--user", action="store", default=None, metavar="USER:PWD", help="Login credentials.")
+    opt_parser.add_option("--jobs", action="store", type="int", default=1, metavar="N",
+                          help="Maximum number of JIRA requests in flight at once. Default is 1.")
+    opt_parser.add_option("--page-size", action="store", type="int", default=128, metavar="N",
+                          help="Number of issues requested per search page. Default is 128.")
+    opt_parser.add_option("--max-rate", action="store", type="float", default=None, metavar="N",
+                          help="Maximum number of JIRA requests per second. Default is no limit, the requests are"
+                          " slowed down only when JIRA rejects them with 429 or 503. The --processes share it evenly.")
+    opt_parser.add_option("--timeout", action="store", type="float", default=10, metavar="SECONDS",
+                          help="Time to wait for a JIRA response. Default is 10.")
     
+    opt_parser.add_option("--shard", action="store", default=None, metavar="I/N",
+                          help="Check only the I-th of N shards of the issues, I from 1 to N, e.g. in one of N CI jobs."
+                          " The issues are spread over the shards by their keys. Combine the results with --merge.")
+    opt_parser.add_option("--processes", action="store", type="int", default=1, metavar="N",
+                          help="Check the issues in N shards at once, each in a process of its own with up to --jobs"
+                          " JIRA requests in flight, and print the merged result.")
+    opt_parser.add_option("--merge", action="store_true", default=False,
+                          help="Merge the results of the shards read from the files given, '-' or none for STDIN,"
+                          " into the result of checking all the issues at once.")
+
+    opt_parser.add_option("--stats", action="store", default=None, metavar="FILE",
+                          help="Write a JSON report of the time spent per phase, the HTTP calls and the git processes"
+                          " to the given file, '-' for stderr.")
+
+    opt_parser.add_option("--serve", action="store", default=None, metavar="ADDRESS",
+                          help="Run as a server answering the queries of jira-find --server on a Unix socket path"
+                          " or [HOST:]PORT of the loopback interface, as the queries name the paths the server"
+                          " reads and writes. The server keeps JIRA connections, responses, module trees and"
+                          " reachable commits warm between the queries. Its --jobs caps the JIRA requests of all queries.")
+    opt_parser.add_option("--server", action="store", default=None, metavar="ADDRESS",
+                          help="Ask the server running at the address instead of checking here."
+                          " Falls back to checking here if there's no server.")
+
+    opt_parser.add_option("--test", action="store_true", default=False, help="Run self-testing & diagnostics.")
     opt_parser.add_option("--debug", action="store_true", default=False, help="Run in debug mode. Additional information will be printed to stderr.")
 
-    opts, args = opt_parser.parse_args()
-    if len(args) >= 2:
-        DEBUG = opts.debug
-        if DEBUG:
-            jira.DEBUG_FUNC = logDebug
+    opts, args = opt_parser.parse_args(argv)
+    if opts.since and (opts.unreachable or opts.orphants):
+        opt_parser.error("--since lists only the tickets that became reachable")
+    shard = parseShard(opts.shard) if opts.shard else None
+    if opts.shard and not shard:
+        opt_parser.error("--shard should be I/N with I from 1 to N")
+    if opts.serve and '/' not in opts.serve and opts.serve.rpartition(':')[0] not in ("", "127.0.0.1", "localhost"):
+        opt_parser.error("--serve listens on a Unix socket or the loopback interface only")
+    if opts.processes > 1 and (opts.shard or opts.incremental or opts.stats):
+        opt_parser.error("--processes can't be combined with --shard, --incremental or --stats,"
+                         " run a process per --shard instead")
+
+    if opts.test:
+        runtime.runTests(loadTests)
+
+    elif opts.serve:
+        setUpDebugging(opts.debug)
+        GIT_BACKEND = gitbackend.BACKENDS[opts.git_backend]()
+        server = ReachabilityServer(opts.jobs, opts.http_cache, maxRate=opts.max_rate, timeout=opts.timeout,
+                                    snapshotsPath=opts.incremental)
+        try:
+            server.serve(opts.serve)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            GIT_BACKEND.close()
+
+    elif opts.merge:
+        partialResults = []
+        for path in args or ['-']:
+            with (open(path, 'r') if '-' != path else contextlib.closing(sys.stdin)) as partialFile:
+                partialResults.append(list(readIssuesReachability(partialFile)))
+        printIssuesReachabilityJSON(mergeIssuesReachability(partialResults), streaming=opts.stream)
+
+    elif len(args) >= 2 and opts.server and queryServer(opts.server, args, opts):
+        pass
+
+    elif len(args) >= 2 and opts.processes > 1:
+        setUpDebugging(opts.debug)
+        params = {'endpoint': args[0], 'query': args[1], 'repository': args[2] if len(args) > 2 else '.',
+                  'searchIn': opts.search_in or ['comment'], 'abbreviated': opts.abbreviated, 'revision': opts.revision,
+                  'unreachable': opts.unreachable, 'orphants': opts.orphants, 'useCache': not opts.no_cache,
+                  'since': opts.since, 'index': opts.index, 'user': opts.user, 'jobs': opts.jobs,
+                  'pageSize': opts.page_size, 'httpCache': opts.http_cache, 'gitBackend': opts.git_backend,
+                  'maxRate': opts.max_rate / opts.processes if opts.max_rate else None, 'timeout': opts.timeout}
+        shardResults = iterateShardsInParallel(params, opts.processes)
+        try:
+            if opts.stream:
+                for issuesJSON in shardResults:  # an issue is in one shard only, so there's nothing to merge
+                    printIssuesReachabilityJSON(issuesJSON, streaming=True)
+            else:
+                printIssuesReachabilityJSON(mergeIssuesReachability(shardResults))
+        except RepositoryError as e:
+            opt_parser.error(str(e))
+
+    elif len(args) >= 2:
+        STATS = RunStats() if opts.stats else None
+        setUpDebugging(opts.debug, STATS)
+        GIT_BACKEND = gitbackend.BACKENDS[opts.git_backend]()
 
         jiraEndpoint = args[0]
         jiraQuery = args[1]
@@ -243,22 +1877,41 @@ if __name__ == '__main__':
         if not opts.search_in:
             opts.search_in = ['comment']
 
-        credentials = opts.user.split(":", 1) if opts.user else [None, None]
-        jiraClient = jira.JIRA(jiraEndpoint, credentials[0], credentials[1] if len(credentials) > 1 else None)
+        jiraClient = makeClient(jiraEndpoint, opts.user, opts.jobs, opts.max_rate, opts.timeout, opts.http_cache)
 
-        verifiedRevisions = calculateIssuesReachability(jiraClient, jiraQuery, opts.search_in, repositoryPath, opts.revision)
+        extractor = RevisionExtractor(opts.abbreviated)
+        try:
+            if opts.stream:
+                for revisions in iterateIssuesReachability(jiraClient, jiraQuery, opts.search_in, repositoryPath, opts.revision,
+                                                           opts.jobs, opts.page_size, not opts.no_cache, opts.incremental,
+                                                           extractor, sinceRevision=opts.since, useIndex=opts.index,
+                                                           shard=shard):
+                    printIssuesReachability(filterIssues(revisions, opts.orphants, opts.unreachable), jiraEndpoint,
+                                            streaming=True)
+            else:
+                verifiedRevisions = calculateIssuesReachability(jiraClient, jiraQuery, opts.search_in, repositoryPath,
+                                                                opts.revision, opts.jobs, opts.page_size, not opts.no_cache,
+                                                                opts.incremental, extractor, opts.since, opts.index, shard)
+                printIssuesReachability(filterIssues(verifiedRevisions, opts.orphants, opts.unreachable), jiraEndpoint)
+        except RepositoryError as e:
+            jiraClient.close()
+            GIT_BACKEND.close()
+            opt_parser.error(str(e))
 
-        filteredIssues = {}
-        
-        if opts.orphants:
-            filteredIssues.update(filterOrphants(verifiedRevisions))
-        if opts.unreachable:
-            filteredIssues.update(filterUnreachables(verifiedRevisions))
-            
-        if not opts.orphants and not opts.unreachable:
-            filteredIssues.update(filterReachables(verifiedRevisions))
+        logClientStats(jiraClient)
+        jiraClient.close()
+        GIT_BACKEND.close()
 
-        printIssuesReachability(filteredIssues, jiraEndpoint)
+        if STATS:
+            report = json.dumps(dict(STATS.report(), scheduler=jiraClient.schedulerStats()), indent=2, sort_keys=True)
+            if "-" == opts.stats:
+                sys.stderr.write(report + "\n")
+            else:
+                with open(opts.stats, 'w') as statsFile:
+                    statsFile.write(report + "\n")
 
     else:
         opt_parser.print_help()
+
+if __name__ == '__main__':
+    main()
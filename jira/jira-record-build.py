@@ -4,67 +4,125 @@ import jira
 import json
 import sys
 import re
-from optparse import OptionParser
-import unittest
+import runtime
+import time
+from runtime import logDebug
 jirafind = __import__("jira-find")
 
-DEBUG = False
-
-class Tests(unittest.TestCase):
-    def addCommentMock(self):
-        def mock(ticketKey, bodyText):
-            self.addedComments.append((ticketKey, bodyText))
-        return mock
-
-    def updateCommentMock(self):
-        def mock(ticketKey, commentId, bodyText):
-            self.updatedComments.append((ticketKey, commentId, bodyText))
-        return mock
-
-    def setUp(self):
-        self.addedComments = []
-        self.updatedComments = []
-
-    def test_onNoPreviousRecords_addsNewRecord(self):
-        jiraClient = lambda: None
-        jiraClient.getComments = lambda key: {
-            "startAt": 0, "maxResults": 1, "total": 1,
-            "comments": [{"id": "1234", "body": "test"}]
-        }
-        jiraClient.addComment = self.addCommentMock()
-
-        recordBuildInTicket(jiraClient, "KEY-123", "abcd123")
-        self.assertEqual(self.addedComments, [("KEY-123", "[Available in builds: abcd123 ]")])
-
-    def test_onExistingRecordAndNewBuild_addsBuildToExisitingRecord(self):
-        jiraClient = lambda: None
-        jiraClient.getComments = lambda key: {
-            "startAt": 0, "maxResults": 1, "total": 1,
-            "comments": [{"id": "comm1234", "body": "[Available in builds: abcd123 ]"}]
-        }
-        jiraClient.updateComment = self.updateCommentMock()
-
-        recordBuildInTicket(jiraClient, "KEY-123", "xyz")
-        self.assertEqual(self.updatedComments, [("KEY-123", "comm1234", "[Available in builds: abcd123, xyz ]")])
-
-    def test_onExistingRecordForSameBuild_doesNothing(self):
-        jiraClient = lambda: None
-        jiraClient.getComments = lambda key: {
-            "startAt": 0, "maxResults": 1, "total": 1,
-            "comments": [{"id": "comm1234", "body": "[Available in builds: abcd123 ]"}]
-        }
-        jiraClient.updateComment = self.updateCommentMock()
-
-        recordBuildInTicket(jiraClient, "KEY-123", "abcd123")
-        self.assertEqual(self.updatedComments, [])
+def loadTests():
+    import unittest
 
-def recordBuildInTicket(jiraClient, ticketKey, buildId):
+    class Tests(unittest.TestCase):
+        def addCommentMock(self):
+            def mock(ticketKey, bodyText):
+                self.addedComments.append((ticketKey, bodyText))
+            return mock
+
+        def updateCommentMock(self):
+            def mock(ticketKey, commentId, bodyText):
+                self.updatedComments.append((ticketKey, commentId, bodyText))
+            return mock
+
+        def setUp(self):
+            self.addedComments = []
+            self.updatedComments = []
+
+        def test_onNoPreviousRecords_addsNewRecord(self):
+            jiraClient = lambda: None
+            jiraClient.getComments = lambda key: {
+                "startAt": 0, "maxResults": 1, "total": 1,
+                "comments": [{"id": "1234", "body": "test"}]
+            }
+            jiraClient.addComment = self.addCommentMock()
+
+            recordBuildInTicket(jiraClient, "KEY-123", "abcd123")
+            self.assertEqual(self.addedComments, [("KEY-123", "[Available in builds: abcd123 ]")])
+
+        def test_onExistingRecordAndNewBuild_addsBuildToExisitingRecord(self):
+            jiraClient = lambda: None
+            jiraClient.getComments = lambda key: {
+                "startAt": 0, "maxResults": 1, "total": 1,
+                "comments": [{"id": "comm1234", "body": "[Available in builds: abcd123 ]"}]
+            }
+            jiraClient.updateComment = self.updateCommentMock()
+
+            recordBuildInTicket(jiraClient, "KEY-123", "xyz")
+            self.assertEqual(self.updatedComments, [("KEY-123", "comm1234", "[Available in builds: abcd123, xyz ]")])
+
+        def test_onExistingRecordForSameBuild_doesNothing(self):
+            jiraClient = lambda: None
+            jiraClient.getComments = lambda key: {
+                "startAt": 0, "maxResults": 1, "total": 1,
+                "comments": [{"id": "comm1234", "body": "[Available in builds: abcd123 ]"}]
+            }
+            jiraClient.updateComment = self.updateCommentMock()
+
+            recordBuildInTicket(jiraClient, "KEY-123", "abcd123")
+            self.assertEqual(self.updatedComments, [])
+
+        def test_onExistingRecordOnNextCommentsPage_addsBuildToExisitingRecord(self):
+            pages = {
+                None: {"startAt": 0, "maxResults": 1, "total": 2, "comments": [{"id": "comm1", "body": "test"}]},
+                1: {"startAt": 1, "maxResults": 1, "total": 2, "comments": [{"id": "comm2", "body": "[Available in builds: abcd123 ]"}]},
+            }
+            jiraClient = lambda: None
+            jiraClient.getComments = lambda key, offset=None: pages[offset]
+            jiraClient.updateComment = self.updateCommentMock()
+
+            recordBuildInTicket(jiraClient, "KEY-123", "xyz")
+            self.assertEqual(self.updatedComments, [("KEY-123", "comm2", "[Available in builds: abcd123, xyz ]")])
+
+        def test_recordBuildInTickets_onFailingTicket_retriesAndCountsOutcomes(self):
+            failures = {"KEY-2": 1, "KEY-3": 10}
+            def getComments(key):
+                if failures.get(key, 0) > 0:
+                    failures[key] -= 1
+                    raise IOError("connection reset")
+                body = "[Available in builds: abcd123 ]" if "KEY-4" == key else "test"
+                return {"startAt": 0, "maxResults": 1, "total": 1, "comments": [{"id": "comm1234", "body": body}]}
+            jiraClient = lambda: None
+            jiraClient.getComments = getComments
+            jiraClient.addComment = self.addCommentMock()
+
+            summary = recordBuildInTickets(jiraClient, ["KEY-1", "KEY-2", "KEY-3", "KEY-4"], "abcd123", jobs=2, retries=2, retryDelay=0)
+            self.assertEqual(sorted(self.addedComments), [("KEY-1", "[Available in builds: abcd123 ]"),
+                                                          ("KEY-2", "[Available in builds: abcd123 ]")])
+            self.assertEqual((summary["added"], summary["updated"], summary["skipped"], summary["failed"]), (2, 0, 1, 1))
+
+        def test_recordBuildInTickets_onClientError_failsWithoutRetries(self):
+            calls = []
+            def getComments(key):
+                calls.append(key)
+                raise jira.JIRAError(404, "Issue does not exist")
+            jiraClient = lambda: None
+            jiraClient.getComments = getComments
+
+            summary = recordBuildInTickets(jiraClient, ["KEY-1"], "abcd123", retries=2, retryDelay=0)
+            self.assertEqual((calls, summary["failed"]), (["KEY-1"], 1))
 
-    comments = jiraClient.getComments(ticketKey)
+    return Tests
+
+def iterateComments(jiraClient, ticketKey):
+    """
+    Yields all the comments of the ticket fetching the next page only when the previous one is exhausted.
+    """
+    page = jiraClient.getComments(ticketKey)
+    while True:
+        for comment in page["comments"]:
+            yield comment
+        nextOffset = page["startAt"] + len(page["comments"])
+        if not page["comments"] or nextOffset >= page["total"]:
+            break
+        page = jiraClient.getComments(ticketKey, nextOffset)
+
+def recordBuildInTicket(jiraClient, ticketKey, buildId):
+    """
+    Returns 'added', 'updated' or 'skipped' depending on what has been done to the build record of the ticket.
+    """
 
     existingComment = None
     existingBuildsMatch = None
-    for comment in comments["comments"]:
+    for comment in iterateComments(jiraClient, ticketKey):
         existingBuildsMatch = re.search(r"\[Available in builds: (?P<builds>.*) \]", comment["body"])
         if existingBuildsMatch:
             existingComment = comment
@@ -78,19 +136,77 @@ def recordBuildInTicket(jiraClient, ticketKey, buildId):
             existingBuilds.append(buildId)
             updatedText = "[Available in builds: {0} ]".format(", ".join(existingBuilds))
             jiraClient.updateComment(ticketKey, existingComment["id"], updatedText)
+            return "updated"
+        return "skipped"
     else:
         jiraClient.addComment(ticketKey, "[Available in builds: {0} ]".format(buildId))
+        return "added"
 
-def logDebug(msg):
-    if DEBUG:
-        for line in msg.split('\n'):
-            sys.stderr.write("[DEBUG] " + line + "\n")
+def recordBuildInTickets(jiraClient, ticketKeys, buildId, jobs=1, retries=3, retryDelay=1):
+    """
+    Records the build in every ticket using up to `jobs` worker threads. A ticket failed transiently is retried
+    from scratch, which is safe as the build already recorded is skipped. Returns the summary of outcomes and latencies.
+    """
+    def record(ticketKey):
+        startTime = time.time()
+        attempt = 0
+        while True:
+            try:
+                outcome = recordBuildInTicket(jiraClient, ticketKey, buildId)
+                break
+            except Exception as e:
+                attempt += 1
+                logDebug("Recording build in {0} failed: {1}".format(ticketKey, e))
+                if attempt > retries or not isTransientError(e):
+                    sys.stderr.write("Failed to record build in {0}: {1}\n".format(ticketKey, e))
+                    outcome = "failed"
+                    break
+                time.sleep(retryDelay * 2 ** (attempt - 1))
+        return ticketKey, outcome, time.time() - startTime
 
-if __name__ == '__main__':
-    opt_parser = OptionParser(usage="%prog [options] JIRA_ENDPOINT JIRA_QUERY [GIT_REPO_PATH]",
+    summary = {"added": 0, "updated": 0, "skipped": 0, "failed": 0}
+    latencies = []
+    for ticketKey, outcome, latency in jirafind.iterateConcurrently(record, ticketKeys, jobs):
+        logDebug("{0}: {1} in {2:.3f}s".format(ticketKey, outcome, latency))
+        summary[outcome] += 1
+        latencies.append(latency)
+
+    latencies.sort()
+    summary["latency"] = {
+        "avg": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50": latencies[len(latencies) / 2] if latencies else 0.0,
+        "max": latencies[-1] if latencies else 0.0,
+    }
+    return summary
+
+def isTransientError(error):
+    """
+    Tells if the request may succeed when repeated: it failed at the network level or JIRA was overloaded or down.
+    The client has retried it already, so the ticket is retried only after JIRA had time to recover.
+    """
+    import httplib
+    if isinstance(error, jira.JIRAError):
+        return error.status >= 500 or 429 == error.status
+    return isinstance(error, (IOError, httplib.HTTPException))
+
+def uniqueKeys(keys):
+    seenKeys = set()
+    for key in keys:
+        if key not in seenKeys:
+            seenKeys.add(key)
+            yield key
+
+def main(argv=None, prog=None):
+    from optparse import OptionParser
+    opt_parser = OptionParser(usage="%prog [options] JIRA_ENDPOINT JIRA_QUERY [GIT_REPO_PATH]\n"
+                                    "       %prog [options] --stdin JIRA_ENDPOINT",
                               description="Records a new build information into each JIRA issue reachable in the specified revision. "
                                           "After adding record, you may use JQL to e.g. look up tickets fixed in specific build. "
-                                          "Reads issues list from STDIN - see output format of jira-find.")
+                                          "With --stdin reads issues list from STDIN - see output format of jira-find.")
+    opt_parser.prog = prog  # as run by devtools
+
+    opt_parser.add_option("--stdin", action="store_true", default=False,
+                          help="Read the reachable issues from STDIN as printed by jira-find, with or without --stream.")
 
     opt_parser.add_option("--revision", action="store", default="HEAD", metavar="GIT_REF",
                           help="A revison of the root repository against which all the checks should be performed. ")
@@ -98,34 +214,58 @@ if __name__ == '__main__':
     opt_parser.add_option("--build", action="store", default=None, metavar="BUILD_ID",
                           help="The identifier of the build to be attached to tickets.")
 
+    opt_parser.add_option("--no-cache", action="store_true", default=False,
+                          help="Don't use or update the reachability cache kept in the git dir of each module.")
+
+    opt_parser.add_option("--http-cache", action="store", default=None, metavar="FILE",
+                          help="Keep JIRA responses in the given file and reuse or revalidate them on later runs.")
+
     opt_parser.add_option("--user", action="store", default=None, metavar="USER:PWD", help="Login credentials.")
+    opt_parser.add_option("--jobs", action="store", type="int", default=1, metavar="N",
+                          help="Maximum number of JIRA requests in flight at once. Default is 1.")
+    opt_parser.add_option("--max-rate", action="store", type="float", default=None, metavar="N",
+                          help="Maximum number of JIRA requests per second. Default is no limit, the requests are"
+                          " slowed down only when JIRA rejects them with 429 or 503.")
+    opt_parser.add_option("--timeout", action="store", type="float", default=10, metavar="SECONDS",
+                          help="Time to wait for a JIRA response. Default is 10.")
+    opt_parser.add_option("--retries", action="store", type="int", default=3, metavar="N",
+                          help="Number of times recording into a ticket is retried after a failure. Default is 3.")
 
     opt_parser.add_option("--test", action="store_true", default=False, help="Run self-testing & diagnostics.")
     opt_parser.add_option("--debug", action="store_true", default=False, help="Run in debug mode. Additional information will be printed to stderr.")
 
-    opts, args = opt_parser.parse_args()
+    opts, args = opt_parser.parse_args(argv)
     if opts.test:
-        suite = unittest.TestLoader().loadTestsFromTestCase(Tests)
-        unittest.TextTestRunner(verbosity=2).run(suite)
+        runtime.runTests(loadTests)
 
-    elif len(args) >= 2 and opts.build:
-        DEBUG = opts.debug
-        if DEBUG:
-            jira.DEBUG_FUNC = logDebug
-            jirafind.DEBUG = DEBUG
+    elif (len(args) >= 2 or (opts.stdin and len(args) >= 1)) and opts.build:
+        jirafind.setUpDebugging(opts.debug)
+        jiraClient = jirafind.makeClient(args[0], opts.user, opts.jobs, opts.max_rate, opts.timeout, opts.http_cache)
 
-        jiraEndpoint = args[0]
-        jiraQuery = args[1]
-        repositoryPath = args[2] if len(args) > 2 else '.'
-        credentials = opts.user.split(":", 1) if opts.user else [None, None]
+        if opts.stdin:
+            issueKeys = uniqueKeys(issue['key'] for issue in runtime.readIssuesReachability(sys.stdin))
+        else:
+            jiraQuery = args[1]
+            repositoryPath = args[2] if len(args) > 2 else '.'
+            try:
+                issues = jirafind.calculateIssuesReachability(jiraClient, jiraQuery, [], repositoryPath, opts.revision,
+                                                              opts.jobs, useCache=not opts.no_cache)
+            except jirafind.RepositoryError as e:
+                jiraClient.close()
+                opt_parser.error(str(e))
+            issueKeys = jirafind.filterReachables(issues).keys()
 
-        jiraClient = jira.JIRA(jiraEndpoint, credentials[0], credentials[1] if len(credentials) > 1 else None)
-        issues = jirafind.calculateIssuesReachability(jiraClient, jiraQuery, [], repositoryPath, opts.revision)
-        reachableIssues = jirafind.filterReachables(issues)
-
-        for issueKey in reachableIssues:
-            recordBuildInTicket(jiraClient, issueKey, opts.build)
+        summary = recordBuildInTickets(jiraClient, issueKeys, opts.build, opts.jobs, opts.retries)
+        sys.stderr.write("Build {0} recorded: {1}\n".format(opts.build, json.dumps(summary, sort_keys=True)))
 
+        jirafind.logClientStats(jiraClient)
+        jiraClient.close()
+        jirafind.GIT_BACKEND.close()
+        if summary["failed"]:
+            sys.exit(1)
 
     else:
-        opt_parser.print_help()
\ No newline at end of file
+        opt_parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,588 @@
 #!/usr/bin/python
 
 import base64
+import collections
+import hashlib
 import json
+import os
+import re
+import socket
+import threading
+import time
 import urllib
 import urlparse
-import httplib
+import zlib
+from StringIO import StringIO
 
 DEBUG_FUNC = None
+STATS_FUNC = None  # called with a dict of per-call stats after every API call
+
+def loadTests():
+    import unittest
+
+    class Tests(unittest.TestCase):
+        def setUp(self):
+            self.workDirs = []
+
+        def tearDown(self):
+            import shutil
+            for workDir in self.workDirs:
+                shutil.rmtree(workDir)
+
+        def createWorkDir(self):
+            import tempfile
+            workDir = tempfile.mkdtemp()
+            self.workDirs.append(workDir)
+            return workDir
+
+        def test_ResponseCache_onConcurrentSavesToOneFile_keepsAWholeCache(self):
+            workDir = self.createWorkDir()
+            path = os.path.join(workDir, "http-cache")
+            caches = [ResponseCache(path) for _ in xrange(8)]
+            for i, cache in enumerate(caches):
+                cache.store("key", "/rest/api/2/field", "data{0}".format(i))
+            errors = []
+
+            def save(cache):
+                try:
+                    for _ in xrange(20):
+                        cache.save()
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=save, args=(cache,)) for cache in caches]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(os.listdir(workDir), ["http-cache"])
+            self.assertEqual(ResponseCache(path).stats()['entries'], 1)
+
+        def test_decodeObjectStreaming_onTinyChunks_passesEachIssue(self):
+            page = json.dumps({"startAt": 0, "total": 12345, "issues": [{"key": "KEY-1", "x": [1.5, u"\u00e9"]}, {"key": "KEY-2"}],
+                               "names": {}})
+            body = StringIO(page)
+            actual = decodeObjectStreaming(lambda size: body.read(3), "issues", lambda issue: issue["key"])
+            self.assertEqual(actual, {"startAt": 0, "total": 12345, "issues": ["KEY-1", "KEY-2"], "names": {}})
+
+        def createStubClient(self, responses, cache):
+            """
+            Returns a JIRA client answering the requests with the (status, headers, body) responses given, in order,
+            and the list the headers of the requests are collected in.
+            """
+            requests = []
+
+            class StubConnection:
+                def request(self, method, resource, body, headers):
+                    requests.append(headers)
+
+                def getresponse(self):
+                    status, headers, body = responses.pop(0)
+                    response = StringIO(body)
+                    response.status = status
+                    response.getheaders = lambda: headers.items()
+                    return response
+
+            class StubPool:
+                released = discarded = 0
+
+                def acquire(self):
+                    return StubConnection(), False
+
+                def release(self, connection):
+                    self.released += 1
+
+                def discard(self, connection, isReconnecting=False):
+                    self.discarded += 1
+
+                def close(self):
+                    pass
+
+            client = JIRA("http://jira.example.com", cache=cache)
+            client.pools[("http", "jira.example.com")] = StubPool()
+            return client, requests
+
+        def test_callAPI_onUndecodableBody_discardsTheConnection(self):
+            client, _ = self.createStubClient([(200, {}, '{"total": 1, "issues": [{"key": "A-1"},')], None)
+            self.assertRaises(ValueError, client.search, "project = A")
+            pool = client.pools[("http", "jira.example.com")]
+            self.assertEqual((pool.released, pool.discarded), (0, 1))
+
+        def test_ResponseCache_onNotModified_revalidatesAndSurvivesSaveAndLoad(self):
+            path = os.path.join(self.createWorkDir(), "http-cache")
+            client, requests = self.createStubClient([(200, {"etag": '"v1"'}, '[{"id": "comment"}]'), (304, {}, "")],
+                                                     ResponseCache(path, ttls=[]))  # revalidated every time
+            self.assertEqual(client.getFields(), [{"id": "comment"}])
+            self.assertEqual(client.getFields(), [{"id": "comment"}])
+            self.assertEqual(requests[1].get("If-None-Match"), '"v1"')
+            self.assertEqual(client.cache.stats()['revalidations'], 1)
+            client.close()
+
+            client, requests = self.createStubClient([(304, {}, "")], ResponseCache(path, ttls=[]))
+            self.assertEqual(client.getFields(), [{"id": "comment"}])
+            self.assertEqual(requests[0].get("If-None-Match"), '"v1"')
+
+        def test_ResponseCache_onOverflow_evictsLeastRecentlyUsed(self):
+            cache = ResponseCache(maxBytes=10)
+            cache.store("a", "/rest/api/2/field", "1234")
+            cache.store("b", "/rest/api/2/field", "1234")
+            cache.lookup("a")
+            cache.store("c", "/rest/api/2/field", "1234")
+            self.assertEqual([cache.lookup(key)[0] is not None for key in "abc"], [True, False, True])
+            self.assertEqual(cache.stats()['bytes'], 8)
+
+        def test_RequestScheduler_onOverload_halvesConcurrencyAndGrowsItBack(self):
+            scheduler = RequestScheduler(maxConcurrency=8)
+            scheduler.acquire()
+            scheduler.release(0.01, isOverloaded=True, retryAfter=0.05)
+            self.assertEqual(scheduler.stats()['concurrencyLimit'], 4)
+            startTime = time.time()
+            for _ in xrange(30):
+                scheduler.acquire()
+                scheduler.release(0.01)
+            self.assertGreaterEqual(time.time() - startTime, 0.05)  # paused for the Retry-After
+            self.assertEqual(scheduler.stats()['concurrencyLimit'], 8)
+
+        def test_RequestScheduler_withMaxRate_throttlesBurstsOver(self):
+            scheduler = RequestScheduler(maxRate=100, burst=2)
+            startTime = time.time()
+            for _ in xrange(7):
+                scheduler.acquire()
+                scheduler.release(0)
+            self.assertGreaterEqual(time.time() - startTime, 0.045)  # the 5 requests over the burst wait for 10ms each
+            self.assertGreater(scheduler.stats()['throttledSeconds'], 0.04)
+
+    return Tests
+
+class JIRAError(Exception):
+    """
+    Raised on an HTTP error status, once the client has run out of retries if the request is retried.
+    """
+    def __init__(self, status, message, retryAfter=None):
+        Exception.__init__(self, message)
+        self.status = status
+        self.retryAfter = retryAfter
+
+class RateLimitExceeded(JIRAError):
+    """
+    Raised on HTTP 429 once the client has run out of retries.
+    """
+    def __init__(self, retryAfter=None):
+        JIRAError.__init__(self, 429, "JIRA rate limit exceeded" + (", retry after {0}s".format(retryAfter) if retryAfter is not None else ""),
+                           retryAfter)
+
+def describeError(data):
+    """
+    Returns the messages of a JIRA error response, or the beginning of the body if it's not one, e.g. a proxy's error page.
+    """
+    try:
+        error = json.loads(data)
+        return "; ".join(error.get('errorMessages', []) + ["{0}: {1}".format(*item) for item in error.get('errors', {}).items()])
+    except (ValueError, AttributeError):
+        return data[:200]
+
+def parseRetryAfter(value):
+    """
+    Returns the delay in seconds specified by the Retry-After header which is either a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        import email.utils
+        date = email.utils.parsedate_tz(value)
+        return max(0.0, email.utils.mktime_tz(date) - time.time()) if date else None
+
+class BodyReader:
+    """
+    Reads a response body in chunks inflating it if it's gzipped. Counts the bytes actually transferred.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, response, contentEncoding=None):
+        self.response = response
+        self.inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if "gzip" == contentEncoding else None
+        self.transferredBytes = 0
+
+    def read(self, size=CHUNK_SIZE):
+        while True:
+            chunk = self.response.read(size)
+            self.transferredBytes += len(chunk)
+            if not self.inflater:
+                return chunk
+            if not chunk:
+                return self.inflater.flush()
+            data = self.inflater.decompress(chunk)
+            if data:
+                return data
+
+    def readAll(self):
+        return "".join(iter(self.read, ""))
+
+def decodeJSON(read):
+    return json.loads("".join(iter(lambda: read(BodyReader.CHUNK_SIZE), "")))
+
+class ChunkedJSONReader:
+    """
+    Decodes JSON values one by one from text read in chunks. Only the text of the value being decoded is buffered.
+    """
+    WHITESPACE = re.compile(r"[ \t\n\r]*")
+    DECODER = json.JSONDecoder()
+
+    def __init__(self, read):
+        self.read = read
+        self.buffer = ""
+        self.position = 0
+        self.isEOF = False
+
+    def readMore(self):
+        if self.isEOF:
+            return False
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        chunk = self.read(max(BodyReader.CHUNK_SIZE, len(self.buffer)))  # re-decoding a value stays linear in its size
+        self.isEOF = not chunk
+        self.buffer += chunk
+        return not self.isEOF
+
+    def peek(self):
+        while True:
+            self.position = self.WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.readMore():
+                raise ValueError("Unexpected end of JSON")
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError("Expected one of '{0}' at '{1}'".format(chars, self.buffer[self.position:self.position + 32]))
+        self.position += 1
+        return char
+
+    def decodeValue(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.DECODER.raw_decode(self.buffer, self.position)
+            except ValueError:
+                if not self.readMore():
+                    raise
+                continue
+            if end == len(self.buffer) and isinstance(value, (int, long, float)) and self.readMore():
+                continue  # the number may go on in the next chunk
+            self.position = end
+            return value
+
+def decodeObjectStreaming(read, arrayKey, onItem):
+    """
+    Decodes a JSON object read in chunks passing each item of its arrayKey array to onItem as soon as it's decoded.
+    The array is replaced with the results of onItem, so only a single original item is in memory at once.
+    """
+    reader = ChunkedJSONReader(read)
+    result = {}
+    reader.expect('{')
+    if '}' == reader.peek():
+        return result
+    while True:
+        key = reader.decodeValue()
+        reader.expect(':')
+        if key == arrayKey and '[' == reader.peek():
+            reader.position += 1
+            items = []
+            if ']' == reader.peek():
+                reader.position += 1
+            else:
+                while True:
+                    items.append(onItem(reader.decodeValue()))
+                    if ']' == reader.expect(',]'):
+                        break
+            result[key] = items
+        else:
+            result[key] = reader.decodeValue()
+        if '}' == reader.expect(',}'):
+            return result
+
+class ResponseCache:
+    """
+    An LRU cache of GET responses bounded by their total size, optionally persisted to a file between runs.
+    An entry is served as is for the TTL of its resource. After that it's revalidated with If-None-Match or
+    If-Modified-Since if the server gave an ETag or Last-Modified, otherwise it's refetched.
+    """
+    DEFAULT_TTLS = [  # (resource prefix, seconds)
+        ("/rest/api/2/field", 24 * 60 * 60),
+        ("/rest/dev-status/", 10 * 60),
+    ]
+
+    def __init__(self, path=None, maxBytes=64 * 1024 * 1024, ttls=None):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.ttls = ttls if ttls is not None else self.DEFAULT_TTLS
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+        if path and os.path.isfile(path):
+            with open(path, 'r') as cacheFile:
+                for key, entry in json.load(cacheFile):
+                    self.insert(key, entry)
+
+    def ttlFor(self, resource):
+        for prefix, ttl in self.ttls:
+            if resource.startswith(prefix):
+                return ttl
+        return 0
+
+    def lookup(self, key):
+        """
+        Returns (entry, isFresh) pair. The entry is None when nothing's cached for the key.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            self.entries[key] = entry  # most recently used go last
+            isFresh = entry['expires'] > time.time()
+            if isFresh:
+                self.hits += 1
+            return entry, isFresh
+
+    def store(self, key, resource, data, etag=None, lastModified=None):
+        ttl = self.ttlFor(resource)
+        if not ttl and not etag and not lastModified:
+            return  # could never be reused
+        with self.lock:
+            self.insert(key, {'data': data, 'etag': etag, 'lastModified': lastModified, 'expires': time.time() + ttl})
+
+    def refresh(self, key, resource):
+        with self.lock:
+            self.revalidations += 1
+            if key in self.entries:
+                self.entries[key]['expires'] = time.time() + self.ttlFor(resource)
+
+    def invalidate(self, keyPrefix):
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(keyPrefix)]:
+                self.size -= len(self.entries.pop(key)['data'])
+
+    def insert(self, key, entry):
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key)['data'])
+        self.entries[key] = entry
+        self.size += len(entry['data'])
+        while self.size > self.maxBytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted['data'])
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            entries = self.entries.items()
+        import tempfile
+        # a temporary file of its own, so that processes sharing the cache file don't mix their writes, the last one wins
+        fd, tempPath = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(fd, 'w') as cacheFile:
+            json.dump(entries, cacheFile)
+        os.rename(tempPath, self.path)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size,
+                    'hits': self.hits, 'revalidations': self.revalidations, 'misses': self.misses}
+
+class ConnectionPool:
+    """
+    Keeps idle keep-alive connections to a single host so that subsequent calls skip the TCP/TLS handshake.
+    """
+    def __init__(self, scheme, netloc, timeout=10, maxIdle=4):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self.maxIdle = maxIdle
+        self.idle = []
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.handshakes = 0
+        self.reuses = 0
+        self.reconnects = 0
+
+    def acquire(self):
+        """
+        Returns (connection, isReused) pair. The connection must be given back with either release() or discard().
+        """
+        with self.lock:
+            self.requests += 1
+            if self.idle:
+                self.reuses += 1
+                return self.idle.pop(), True
+            self.handshakes += 1
+
+        import httplib
+        MakeConnection = httplib.HTTPConnection if 'http' == self.scheme else httplib.HTTPSConnection
+        return MakeConnection(self.netloc, timeout=self.timeout), False
+
+    def release(self, connection):
+        with self.lock:
+            if len(self.idle) < self.maxIdle:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def discard(self, connection, isReconnecting=False):
+        connection.close()
+        if isReconnecting:
+            with self.lock:
+                self.reconnects += 1
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'host': self.netloc,
+                'requests': self.requests,
+                'handshakes': self.handshakes,
+                'reuses': self.reuses,
+                'reconnects': self.reconnects,
+                'idle': len(self.idle),
+                'reuseRate': float(self.reuses) / self.requests if self.requests else 0.0,
+            }
+
+class RequestScheduler:
+    """
+    Paces the requests to a server. A request waits for a token of a bucket refilled at maxRate tokens per second and
+    holding up to burst of them, and for a slot among the current concurrency limit. The limit adapts to the server:
+    it grows by one per limit's worth of requests answered in time and halves on a sign of overload, i.e. a 429 or 503,
+    a network failure or a request slower than slowSeconds, once per the time such a request took.
+    A Retry-After of the server pauses all the requests. The time the requests wait is reported as throttled.
+    """
+    def __init__(self, maxConcurrency=None, maxRate=None, burst=None, slowSeconds=None):
+        self.maxConcurrency = maxConcurrency
+        self.limit = float(maxConcurrency) if maxConcurrency else None
+        self.maxRate = maxRate
+        self.burst = burst or max(1.0, maxRate or 0)  # a second's worth of requests by default
+        self.tokens = self.burst
+        self.refillTime = time.time()
+        self.slowSeconds = slowSeconds
+        self.pausedUntil = 0.0
+        self.lastDecreaseTime = 0.0
+        self.inFlight = 0
+        self.condition = threading.Condition()
+        self.requests = 0
+        self.throttledSeconds = 0.0
+        self.overloads = 0
+        self.pauses = 0
+        self.retries = 0
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent. Returns the seconds it's been throttled.
+        """
+        startTime = time.time()
+        with self.condition:
+            while True:
+                now = time.time()
+                delay = self.pausedUntil - now
+                if delay <= 0 and self.limit is not None and self.inFlight >= int(self.limit):
+                    self.condition.wait()
+                    continue
+                if delay <= 0 and self.maxRate:
+                    self.tokens = min(self.burst, self.tokens + (now - self.refillTime) * self.maxRate)
+                    self.refillTime = now
+                    delay = (1 - self.tokens) / self.maxRate
+                if delay <= 0:
+                    break
+                self.condition.wait(delay)
+
+            if self.maxRate:
+                self.tokens -= 1
+            self.inFlight += 1
+            self.requests += 1
+            throttledSeconds = time.time() - startTime
+            self.throttledSeconds += throttledSeconds
+            return throttledSeconds
+
+    def release(self, seconds, isOverloaded=False, retryAfter=None):
+        """
+        Frees the slot of a request answered in the given seconds.
+        """
+        with self.condition:
+            now = time.time()
+            self.inFlight -= 1
+            isOverloaded = isOverloaded or (self.slowSeconds is not None and seconds > self.slowSeconds)
+            if isOverloaded:
+                self.overloads += 1
+            if retryAfter:
+                self.pauses += 1
+                self.pausedUntil = max(self.pausedUntil, now + retryAfter)
+            if self.limit is not None:
+                if not isOverloaded:
+                    self.limit = min(float(self.maxConcurrency), self.limit + 1 / self.limit)
+                elif now - self.lastDecreaseTime > seconds:  # the requests sent along with this one tell of the same overload
+                    self.limit = max(1.0, self.limit / 2)
+                    self.lastDecreaseTime = now
+            self.condition.notify_all()
+
+    def recordRetry(self):
+        with self.condition:
+            self.retries += 1
+
+    def stats(self):
+        with self.condition:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'overloads': self.overloads,
+                'pauses': self.pauses,
+                'throttledSeconds': self.throttledSeconds,
+                'concurrencyLimit': int(self.limit) if self.limit is not None else None,
+                'maxConcurrency': self.maxConcurrency,
+                'maxRate': self.maxRate,
+            }
 
 class JIRA:
-    def __init__(self, endpoint, username=None, password=None):
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+    OVERLOAD_STATUSES = (429, 503)  # the server has rejected the request without processing it
+    TRANSIENT_STATUSES = (502, 504)  # the request may have been processed nevertheless
+
+    def __init__(self, endpoint, username=None, password=None, timeout=10, maxIdleConnections=4, maxRetries=5,
+                 maxConcurrentRequests=None, cache=None, maxRequestsPerSecond=None, backoffSeconds=0.5, maxBackoffSeconds=30):
         self.endpoint = endpoint
         self.username = username
         self.password = password
+        self.timeout = timeout
+        self.maxIdleConnections = maxIdleConnections
+        self.maxRetries = maxRetries
+        self.backoffSeconds = backoffSeconds
+        self.maxBackoffSeconds = maxBackoffSeconds
+        self.scheduler = RequestScheduler(maxConcurrentRequests, maxRequestsPerSecond, slowSeconds=timeout / 2.0)
+        self.cache = cache
+        self.pools = {}
+        self.poolsLock = threading.Lock()
 
-    def search(self, jql, offset=None, limit=None, fields=None, expand=None):
+    def search(self, jql, offset=None, limit=None, fields=None, expand=None, onIssue=None):
+        """
+        If onIssue is given, each issue is passed to it as soon as it's read and the page lists its results instead.
+        """
+        decodeBody = (lambda read: decodeObjectStreaming(read, "issues", onIssue)) if onIssue else None
         return self.callJiraAPI("GET", "/rest/api/2/search?"
                                 + "jql=" + urllib.quote(jql)
                                 + ("&fields={0}".format(urllib.quote(','.join(fields))) if fields else "")
                                 + ("&expand={0}".format(urllib.quote(','.join(expand))) if expand else "")
                                 + ("&startAt={0}".format(offset) if offset else "")
-                                + ("&maxResults={0}".format(limit) if limit else ""))
+                                + ("&maxResults={0}".format(limit) if limit else ""),
+                                decodeBody=decodeBody)
 
     def getFields(self):
         return self.callJiraAPI("GET", "/rest/api/2/field")
@@ -31,8 +593,10 @@ class JIRA:
                                 + "&applicationType=stash&dataType=repository"
                                 )["detail"][0]["repositories"]
 
-    def getComments(self, issueKey):
-        return self.callJiraAPI("GET", "/rest/api/2/issue/{0}/comment".format(issueKey))
+    def getComments(self, issueKey, offset=None, limit=None):
+        return self.callJiraAPI("GET", "/rest/api/2/issue/{0}/comment".format(issueKey)
+                                + ("?startAt={0}".format(offset) if offset else "")
+                                + ("{0}maxResults={1}".format("&" if offset else "?", limit) if limit else ""))
 
     def updateComment(self, issueKey, commentId, text):
         return self.callJiraAPI(
@@ -46,13 +610,54 @@ class JIRA:
             {"body": text}
         )
 
-    def callJiraAPI(self, method, resource, body=None):
+    def callJiraAPI(self, method, resource, body=None, decodeBody=None):
+        """
+        Sends the request once the scheduler lets it go and retries it if it fails transiently. A request rejected
+        for the overload is retried whatever its method. One that may have been processed, i.e. failed with 502 or 504
+        or at the network level, is retried only if its method is idempotent, so that e.g. a comment is never added twice.
+        """
+        import httplib
         authHeader = base64.b64encode(self.username + ":" + self.password) if self.username else None
-        statusCode, data = self.callAPI(self.endpoint, method, resource, body, authHeader)
-        return data
+        attempt = 0
+        while True:
+            try:
+                statusCode, data = self.callAPI(self.endpoint, method, resource, body, authHeader, decodeBody)
+                return data
+            except JIRAError as e:
+                isRetriable = (e.status in self.OVERLOAD_STATUSES
+                               or (e.status in self.TRANSIENT_STATUSES and method in self.IDEMPOTENT_METHODS))
+                if not isRetriable or attempt >= self.maxRetries:
+                    raise
+                retryAfter = e.retryAfter
+            except (httplib.HTTPException, socket.error):
+                if method not in self.IDEMPOTENT_METHODS or attempt >= self.maxRetries:
+                    raise
+                retryAfter = None
+
+            attempt += 1
+            delay = self.backoffDelay(attempt, retryAfter)
+            self.scheduler.recordRetry()
+            if DEBUG_FUNC:
+                DEBUG_FUNC("{0} {1}\nFailed, retry {2} in {3:.2f}s".format(method, resource, attempt, delay))
+            time.sleep(delay)
+
+    def backoffDelay(self, attempt, retryAfter=None):
+        """
+        Returns a random delay up to the exponential backoff of the attempt, so that the requests failed together
+        are retried apart. The server's Retry-After is waited for in full.
+        """
+        import random
+        if retryAfter is not None:
+            return retryAfter + random.uniform(0, self.backoffSeconds)
+        return random.uniform(0, min(self.maxBackoffSeconds, self.backoffSeconds * 2 ** attempt))
 
-    def callAPI(self, endpoint, method, resource, body=None, authHeader=None):
-        headers = {}
+    def callAPI(self, endpoint, method, resource, body=None, authHeader=None, decodeBody=None):
+        """
+        decodeBody is given a chunk reader of the body of a successful response. By default the body is loaded as JSON.
+        Unless the responses are cached, it decodes the body right from the socket.
+        """
+        decodeBody = decodeBody or decodeJSON
+        headers = {"Accept-Encoding": "gzip"}
         bodyData = None
         if body is not None:
             bodyData = json.dumps(body)
@@ -61,20 +666,130 @@ class JIRA:
         if authHeader is not None:
             headers["Authorization"] = "Basic " + authHeader
 
+        cacheKey = "{0}{1}#{2}".format(endpoint, resource, hashlib.sha1(authHeader or "").hexdigest()[:12])
+        cachedEntry = None
+        if self.cache and "GET" == method:
+            cachedEntry, isFresh = self.cache.lookup(cacheKey)
+            if isFresh:
+                if DEBUG_FUNC:
+                    DEBUG_FUNC("{0} {1}\n(cached)".format(method, resource))
+                return 200, decodeBody(StringIO(cachedEntry['data']).read)
+            if cachedEntry and cachedEntry['etag']:
+                headers["If-None-Match"] = cachedEntry['etag']
+            if cachedEntry and cachedEntry['lastModified']:
+                headers["If-Modified-Since"] = cachedEntry['lastModified']
+
+        pool = self.poolFor(endpoint)
+        self.scheduler.acquire()
+        startTime = time.time()
+
+        import httplib
+        streamedDecodeBody = None if self.cache else decodeBody  # the cache needs the raw body
+        connection, isReused = pool.acquire()
+        try:
+            try:
+                statusCode, responseHeaders, transferredBytes, data = self.sendRequest(connection, method, resource, bodyData,
+                                                                                       headers, streamedDecodeBody)
+            except (httplib.HTTPException, socket.error) as e:
+                pool.discard(connection, isReconnecting=isReused)
+                if not isReused or method not in self.IDEMPOTENT_METHODS or isinstance(e, socket.timeout):
+                    raise  # a timed out or non-idempotent request may have been processed, so it mustn't be repeated
+                # The server has dropped the idle keep-alive socket. Retry once on a fresh connection.
+                connection, isReused = pool.acquire()
+                try:
+                    statusCode, responseHeaders, transferredBytes, data = self.sendRequest(connection, method, resource, bodyData,
+                                                                                           headers, streamedDecodeBody)
+                except:
+                    pool.discard(connection)
+                    raise
+            except:
+                pool.discard(connection)  # e.g. the body failed to decode, the rest of it is left unread
+                raise
+        except Exception as e:
+            self.scheduler.release(time.time() - startTime, isOverloaded=isinstance(e, (httplib.HTTPException, socket.error)))
+            raise
+        pool.release(connection)
+        isOverloaded = statusCode in self.OVERLOAD_STATUSES
+        self.scheduler.release(time.time() - startTime, isOverloaded,
+                               parseRetryAfter(responseHeaders.get("retry-after")) if isOverloaded else None)
+        isDecoded = streamedDecodeBody is not None and 200 == statusCode
+
+        if STATS_FUNC:
+            STATS_FUNC({'method': method, 'resource': resource, 'status': statusCode, 'reused': isReused,
+                        'bytes': transferredBytes, 'seconds': time.time() - startTime})
+        if DEBUG_FUNC:
+            DEBUG_FUNC("{0} {1}\n{2}".format(method, resource, "({0} bytes decoded as streamed)".format(transferredBytes) if isDecoded else data))
+        if 429 == statusCode:
+            raise RateLimitExceeded(parseRetryAfter(responseHeaders.get("retry-after")))
+        if statusCode >= 400:
+            raise JIRAError(statusCode, "{0} {1} failed with HTTP {2}: {3}".format(method, resource, statusCode, describeError(data)),
+                            parseRetryAfter(responseHeaders.get("retry-after")))
+
+        if self.cache:
+            if 304 == statusCode and cachedEntry:
+                self.cache.refresh(cacheKey, resource)
+                statusCode, data = 200, cachedEntry['data']
+            elif 200 == statusCode and "GET" == method:
+                self.cache.store(cacheKey, resource, data, responseHeaders.get("etag"), responseHeaders.get("last-modified"))
+            elif "GET" != method:
+                # e.g. a new comment makes the cached list of the issue comments outdated
+                self.cache.invalidate("{0}{1}".format(endpoint, resource.rsplit("/", 1)[0]))
+        if isDecoded:
+            return statusCode, data
+        return statusCode, decodeBody(StringIO(data).read)
+
+    def sendRequest(self, connection, method, resource, bodyData, headers, decodeBody=None):
+        """
+        Returns the status, the headers, the size of the body as transferred and the body.
+        The body of a successful response is decoded while read if decodeBody is given.
+        """
+        connection.request(method, resource, bodyData, headers)
+        response = connection.getresponse()
+        responseHeaders = dict(response.getheaders())
+        reader = BodyReader(response, responseHeaders.get("content-encoding"))
+        if decodeBody and 200 == response.status:
+            data = decodeBody(reader.read)
+            reader.readAll()  # the body has to be fully read before the connection can be reused
+        else:
+            data = reader.readAll()
+        return response.status, responseHeaders, reader.transferredBytes, data
+
+    def poolFor(self, endpoint):
         endp = urlparse.urlparse(endpoint)
         if not endp.netloc:
             endp = urlparse.urlparse("//" + endpoint)
 
-        MakeConnection = httplib.HTTPSConnection
-        if 'http' == endp.scheme:
-            MakeConnection = httplib.HTTPConnection
-        connection = MakeConnection(endp.netloc, timeout=10)
+        with self.poolsLock:
+            key = (endp.scheme, endp.netloc)
+            if key not in self.pools:
+                self.pools[key] = ConnectionPool(endp.scheme, endp.netloc, self.timeout, self.maxIdleConnections)
+            return self.pools[key]
 
-        connection.request(method, resource, bodyData, headers)
-        response = connection.getresponse()
-        statusCode, data = response.status, response.read()
-        connection.close()
-        
-        if DEBUG_FUNC:
-            DEBUG_FUNC("{0} {1}\n{2}".format(method, resource, data))
-        return statusCode, json.loads(data)
+    def schedulerStats(self):
+        return self.scheduler.stats()
+
+    def connectionStats(self):
+        with self.poolsLock:
+            pools = self.pools.values()
+        return [pool.stats() for pool in pools]
+
+    def close(self):
+        with self.poolsLock:
+            pools = self.pools.values()
+        for pool in pools:
+            pool.close()
+        if self.cache:
+            self.cache.save()
+
+if __name__ == '__main__':
+    import runtime
+    from optparse import OptionParser
+    opt_parser = OptionParser(usage="%prog --test", description="JIRA REST API client of the jira tools.")
+    opt_parser.add_option("--test", action="store_true", default=False, help="Run self-testing & diagnostics.")
+
+    opts, args = opt_parser.parse_args()
+    if opts.test:
+        runtime.runTests(loadTests)
+
+    else:
+        opt_parser.print_help()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python2.7
+
+# What the jira tools share at run time. It's imported by every tool on startup, so it imports next to nothing itself:
+# the modules needed only by some commands, by the tests or when debugging are imported where they're used.
+
+import os
+import sys
+import time
+
+DEBUG = False
+STATS_FUNC = None  # called with a dict of per-process stats after every command run by execCommand
+
+def logDebug(msg):
+    if DEBUG:
+        for line in msg.split('\n'):
+            sys.stderr.write("[DEBUG] " + line + "\n")
+
+def execCommand(command, cwd='.', isQuery=False, raw=False):
+    import subprocess as sp
+    stdout = sp.PIPE if isQuery else sys.stdout
+    stderr = open(os.devnull, 'w') if isQuery else sys.stderr
+    startTime = time.time()
+    p = sp.Popen(command, shell=True, cwd=cwd, stdout=stdout, stderr=stderr, stdin=sys.stdin)
+    out, _ = p.communicate()
+    if isQuery:
+        stderr.close()
+    if STATS_FUNC:
+        STATS_FUNC({'command': command.split()[1] if command.startswith("git ") else command.split()[0],
+                    'seconds': time.time() - startTime})
+    if not raw:
+        out = out.strip()
+    logDebug(cwd + " $ " + command + " -> " + str(p.returncode) + ": " + out)
+    return out, p.returncode
+
+def readIssuesReachability(stream):
+    """
+    Yields the issues printed by jira-find, either as a JSON array or one per line with --stream. The streamed ones
+    are yielded as they arrive.
+    """
+    import json
+    for line in iter(stream.readline, ''):
+        if line.lstrip().startswith('['):
+            for issueJSON in json.loads(line + stream.read()):
+                yield issueJSON
+        elif line.strip():
+            yield json.loads(line)
+
+def runTests(loadTests):
+    """
+    Runs the tests of a tool, loadTests returns its TestCase class. Returns True if they pass.
+    """
+    import unittest
+    suite = unittest.TestLoader().loadTestsFromTestCase(loadTests())
+    return unittest.TextTestRunner(verbosity=2).run(suite).wasSuccessful()
+
+def traceImports(output=sys.stderr):
+    """
+    Reports the time every module takes to import, like `python -X importtime` of Python 3 does:
+    "import time: <self us> | <cumulative us> | <nested module name>" once each module is imported.
+    """
+    import __builtin__
+    originalImport = __builtin__.__import__
+    importing = []  # the names of the modules being imported, outermost first
+    nestedTimes = [0]  # the cumulative time of the modules imported by the one being imported
+
+    def timedImport(name, globals=None, locals=None, fromlist=None, level=-1):
+        if name in sys.modules:
+            return originalImport(name, globals, locals, fromlist, level)
+        outerNestedTime, nestedTimes[0] = nestedTimes[0], 0
+        importing.append(name)
+        startTime = time.time()
+        try:
+            return originalImport(name, globals, locals, fromlist, level)
+        finally:
+            cumulativeTime = time.time() - startTime
+            importing.pop()
+            output.write("import time: {0:>9} | {1:>11} | {2}{3}\n".format(
+                int((cumulativeTime - nestedTimes[0]) * 1000000), int(cumulativeTime * 1000000), "  " * len(importing), name))
+            nestedTimes[0] = outerNestedTime + cumulativeTime
+
+    __builtin__.__import__ = timedImport
@@ -1,24 +1,164 @@
 #!/usr/bin/env python2.7
 
 from optparse import OptionParser
+import glob
+import multiprocessing
 import os
 import re
+import shutil
+import sys
+import tempfile
+import time
 import unittest
 
 DEBUG = False
 
+RULES = [  # (pattern, replacement), group names are unique across the rules
+    (r"^open class", r"public class"),
+    (r"^(?P<classAttribute>@objc(\([^)\n]+\))?) open class", r"\g<classAttribute> public class"),
+    (r"    open", r"    public"),
+    (r"    static open", r"    static public"),
+    (r"    override open", r"    override public"),
+    (r"    (?P<memberAttribute>@objc(\([^)\n]+\))?) open", r"    \g<memberAttribute> public"),
+    (r"^fileprivate class", r"private class"),
+    (r"    fileprivate", r"    private"),
+    (r" fileprivate\(set\) ", r" private(set) "),
+    (r"    static fileprivate", r"    static private"),
+]
+
+# A single pass trying all the rules at each position gives the same result as applying them one by one
+# as no replacement produces text matched by another rule. No rule matches across lines, so any block of whole lines
+# can be upgraded on its own.
+# The lookahead lets the positions no rule starts with be skipped without trying every alternative.
+RULES_PATTERN = re.compile("(?=[ o@f])(?:" + "|".join("(?P<rule{0}>{1})".format(i, pattern) for i, (pattern, _) in enumerate(RULES)) + ")",
+                           flags=re.MULTILINE)
+
+def compileReplacement(replacement):
+    """
+    Splits the replacement into literal parts and group names up front, as match.expand() parses it on each call.
+    """
+    parts = re.split(r"\\g<(\w+)>", replacement)
+    if len(parts) == 1:
+        return lambda match: replacement
+    return lambda match: "".join(part if i % 2 == 0 else match.group(part) for i, part in enumerate(parts))
+
+RULES_REPLACEMENTS = dict(("rule{0}".format(i), compileReplacement(replacement)) for i, (_, replacement) in enumerate(RULES))
+
+def replaceMatch(match):
+    return RULES_REPLACEMENTS[match.lastgroup](match)
+
 def open2public(source):
-    source = re.sub(r"^open class", r"public class", source, flags=re.MULTILINE)
-    source = re.sub(r"^(@objc(\([^)]+\))?) open class", r"\1 public class", source, flags=re.MULTILINE)
-    source = re.sub(r"    open", r"    public", source)
-    source = re.sub(r"    static open", r"    static public", source)
-    source = re.sub(r"    override open", r"    override public", source)
-    source = re.sub(r"    (@objc(\([^)]+\))?) open", r"    \1 public", source)
-    source = re.sub(r"^fileprivate class", r"private class", source, flags=re.MULTILINE)
-    source = re.sub(r"    fileprivate", r"    private", source)
-    source = re.sub(r" fileprivate\(set\) ", r" private(set) ", source)
-    source = re.sub(r"    static fileprivate", r"    static private", source)
-    return source
+    return RULES_PATTERN.sub(replaceMatch, source)
+
+def countingOpen2public(source):
+    """
+    Returns the updated source along with the number of replacements made.
+    """
+    return RULES_PATTERN.subn(replaceMatch, source)
+
+def findSourceFiles(paths, extension=".swift"):
+    """
+    Yields the files given, the files matching the globs given and the files with the extension in the directories given.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for dirPath, dirNames, fileNames in os.walk(path):
+                dirNames[:] = sorted(name for name in dirNames if not name.startswith('.'))
+                for fileName in sorted(fileNames):
+                    if fileName.endswith(extension):
+                        yield os.path.join(dirPath, fileName)
+        elif os.path.isfile(path):
+            yield path
+        else:
+            for matchingPath in sorted(glob.glob(path)):
+                if os.path.isfile(matchingPath):
+                    yield matchingPath
+
+BLOCK_SIZE = 1024 * 1024
+
+def iterateLineBlocks(sourceFile, blockSize=BLOCK_SIZE):
+    """
+    Yields the file's content in blocks of whole lines, each about blockSize long unless a single line is longer.
+    """
+    pendingParts = []
+    while True:
+        block = sourceFile.read(blockSize)
+        if not block:
+            break
+        linesEnd = block.rfind("\n") + 1
+        if not linesEnd:
+            pendingParts.append(block)
+            continue
+        pendingParts.append(block[:linesEnd])
+        yield "".join(pendingParts)
+        pendingParts = [block[linesEnd:]]
+    lastLine = "".join(pendingParts)
+    if lastLine:
+        yield lastLine
+
+def copyPrefix(path, size, output, blockSize=BLOCK_SIZE):
+    with open(path, 'rb') as sourceFile:
+        while size > 0:
+            block = sourceFile.read(min(size, blockSize))
+            if not block:
+                break
+            output.write(block)
+            size -= len(block)
+
+def upgradeFile(path, dryRun=False, blockSize=BLOCK_SIZE):
+    """
+    Streams the file through the rules block by block. The upgraded copy is started at the first replacement only
+    and is renamed over the original once complete, so an unchanged file is never written
+    and an interrupted upgrade leaves the original intact.
+    Returns (path, replacements count, file size, seconds spent).
+    """
+    startTime = time.time()
+    size, replacementsCount = 0, 0
+    output = None
+    try:
+        with open(path, 'rb') as sourceFile:
+            for block in iterateLineBlocks(sourceFile, blockSize):
+                updatedBlock, blockReplacementsCount = countingOpen2public(block)
+                if blockReplacementsCount and not output and not dryRun:
+                    output = tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or ".", prefix="." + os.path.basename(path) + ".",
+                                                         suffix=".tmp", delete=False)
+                    copyPrefix(path, size, output, blockSize)
+                if output:
+                    output.write(updatedBlock)
+                size += len(block)
+                replacementsCount += blockReplacementsCount
+
+        if output:
+            output.close()
+            shutil.copymode(path, output.name)
+            os.rename(output.name, path)
+            output = None
+    finally:
+        if output:
+            output.close()
+            os.remove(output.name)
+    return path, replacementsCount, size, time.time() - startTime
+
+def upgradeFileInDryRun(path):
+    return upgradeFile(path, dryRun=True)
+
+def upgradeFiles(paths, jobs=1, dryRun=False):
+    """
+    Yields (path, replacements count, file size, seconds spent) for each of the files as soon as it's upgraded by one of the processes.
+    """
+    upgrade = upgradeFileInDryRun if dryRun else upgradeFile  # the pool can only pass top-level functions
+    if jobs <= 1:
+        for path in paths:
+            yield upgrade(path)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(upgrade, paths, chunksize=16):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
 
 class Tests(unittest.TestCase):
     def testThat_open2public_onSnippetWithOpens_replacesOpensWithPublics(self):
@@ -73,9 +213,63 @@ public class MyClass {
         updated = open2public(original)
         self.assertEqual(updated, expected)
 
+    def testThat_open2public_onRandomSnippets_replacesAsRulesAppliedOneByOne(self):
+        import random
+        random.seed(0)
+        pieces = ["open", "fileprivate", "fileprivate(set)", "class", "static", "override", "@objc", "@objc(a:b:)", "var",
+                  " ", "    ", "\n", "("]
+        for _ in xrange(2000):
+            snippet = "".join(random.choice(pieces) for _ in xrange(random.randint(1, 12)))
+            expected = snippet
+            for pattern, replacement in RULES:
+                expected = re.sub(pattern, replacement, expected, flags=re.MULTILINE)
+            self.assertEqual(open2public(snippet), expected, repr(snippet))
+
+    def testThat_upgradeFiles_inDirectory_rewritesOnlyChangedSwiftFiles(self):
+        root = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(root, "sub"))
+            sources = {"a.swift": "open class A {}\n", "sub/b.swift": "class B {}\n", "c.txt": "open class C {}\n"}
+            for name, source in sources.items():
+                with open(os.path.join(root, name), 'w') as sourceFile:
+                    sourceFile.write(source)
+            os.utime(os.path.join(root, "sub/b.swift"), (0, 0))
+
+            results = sorted(upgradeFiles(findSourceFiles([root]), jobs=2, dryRun=True))
+            self.assertEqual([(os.path.relpath(path, root), count) for path, count, _, _ in results], [("a.swift", 1), ("sub/b.swift", 0)])
+            self.assertEqual(open(os.path.join(root, "a.swift")).read(), "open class A {}\n")
+
+            list(upgradeFiles(findSourceFiles([os.path.join(root, "*.swift"), os.path.join(root, "sub")])))
+            self.assertEqual(open(os.path.join(root, "a.swift")).read(), "public class A {}\n")
+            self.assertEqual(os.path.getmtime(os.path.join(root, "sub/b.swift")), 0)
+            self.assertEqual(open(os.path.join(root, "c.txt")).read(), "open class C {}\n")
+            self.assertEqual(sorted(os.listdir(root)), ["a.swift", "c.txt", "sub"])
+        finally:
+            shutil.rmtree(root)
+
+    def testThat_upgradeFile_withSmallBlocks_upgradesAsWhole(self):
+        root = tempfile.mkdtemp()
+        try:
+            path = os.path.join(root, "a.swift")
+            source = "class A {\n" + "    var a = 1\n" * 7 + "    @objc(long:selector:) open func f() {}\n    fileprivate var b\n}"
+            with open(path, 'w') as sourceFile:
+                sourceFile.write(source)
+            for blockSize in [1, 5, 16, 1024]:
+                self.assertEqual(upgradeFile(path, dryRun=True, blockSize=blockSize)[1:3], (2, len(source)))
+            upgradeFile(path, blockSize=5)
+            self.assertEqual(open(path).read(), open2public(source))
+        finally:
+            shutil.rmtree(root)
+
 if __name__ == '__main__':
-    opt_parser = OptionParser(usage="%prog [options]",
-                              description="")
+    opt_parser = OptionParser(usage="%prog [options] PATH...",
+                              description="Replaces 'open' with 'public' and 'fileprivate' with 'private' in Swift sources."
+                              " A PATH may be a file, a glob or a directory to search for .swift files in."
+                              " Only the files changed are rewritten and listed with the number of replacements.")
+    opt_parser.add_option("--check", action="store_true", default=False,
+                          help="Don't rewrite anything, only list the files which would change. Exits with 1 if there are any.")
+    opt_parser.add_option("--jobs", action="store", type="int", default=multiprocessing.cpu_count(), metavar="N",
+                          help="Number of files upgraded at once. Default is the number of CPUs.")
     opt_parser.add_option("--test", action="store_true", default=False, help="Run self-testing & diagnostics.")
     opt_parser.add_option("--debug", action="store_true", default=False, help="Run in debug mode. Additional information will be printed to stderr.")
 
@@ -87,13 +281,25 @@ if __name__ == '__main__':
     elif len(args) >= 1:
         DEBUG = opts.debug
 
-        sourceFilePath = args[0]
-        print sourceFilePath
-        with open(sourceFilePath, 'rb') as sourceFile:
-            source = sourceFile.read()
-        updatedSource = open2public(source)
-        with open(sourceFilePath, 'wb') as sourceFile:
-            sourceFile.write(updatedSource)
+        startTime = time.time()
+        filesCount, changedFilesCount, replacementsCount, totalSize = 0, 0, 0, 0
+        for path, fileReplacementsCount, size, elapsed in upgradeFiles(findSourceFiles(args), opts.jobs, opts.check):
+            filesCount += 1
+            totalSize += size
+            if fileReplacementsCount:
+                changedFilesCount += 1
+                replacementsCount += fileReplacementsCount
+                print "{0}: {1}".format(path, fileReplacementsCount)
+            if DEBUG:
+                sys.stderr.write("[DEBUG] {0}: {1} replacements, {2} bytes, {3:.0f} bytes/s\n".format(
+                    path, fileReplacementsCount, size, size / max(elapsed, 1e-6)))
+
+        elapsed = max(time.time() - startTime, 1e-6)
+        sys.stderr.write("{0} of {1} files {2}, {3} replacements, {4:.1f} MB/s, {5:.0f} files/s\n".format(
+            changedFilesCount, filesCount, "to change" if opts.check else "changed", replacementsCount,
+            totalSize / elapsed / 1024 / 1024, filesCount / elapsed))
+        if opts.check and changedFilesCount:
+            sys.exit(1)
 
     else:
-        opt_parser.print_help()
\ No newline at end of file
+        opt_parser.print_help()